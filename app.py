@@ -1,65 +1,213 @@
-import io
 import os
+import sys
+import time
+import atexit
 import re
+import io
 import json
-import queue
+import math
+import hashlib
 import logging
-import zipfile
+import zlib
+import struct
+import tempfile
 import collections
 import threading
-import importlib.util
-import inspect
 import traceback
-import mimetypes
 import shutil
+from contextlib import contextmanager
+from array import array
+from bisect import bisect_left
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from dataclasses import dataclass, field
+from dataclasses import dataclass
 from typing import Any
+
+if __name__ == '__main__' and sys.argv[1:2] in (['run'], ['sweep'], ['watch']):
+    # Headless runner, sweeps, hot folders: keep the web stack out of scripts and cron jobs.
+    from pipeline import main
+    raise SystemExit(main(sys.argv[1:]))
+
 from flask import Flask, request, jsonify, render_template, send_file
 from flask_cors import CORS
+from pipeline import Payload as Payload   # re-exported for older plugins; new ones import it from pipeline
+from pipeline import (
+    BASE_DIR, PLUGIN_DIR, PRESETS_DIR, TEXT_ENCODING, StepError, guess_mime,
+    CancelToken, PluginSandbox, SANDBOX_WORKERS, SANDBOX_STEP_SECS, SANDBOX_MEMORY_MB,
+    payload_from_file, payload_to_file, payload_unchanged, branch_output_name,
+    expand_sweep, run_sweep, sweep_output_name, sweep_summary_name, write_sweep_summary,
+    plugin_catalog, plugin_registry_version, reap_shared_segments, resolve_steps, validate_steps, run_steps,
+    run_batch,
+    _plugin_registry,
+)
 
 app = Flask(__name__)
 CORS(app)
 
-# ── Browser log streaming ──────────────────────────────────────────────────
+# ── Event bus ──────────────────────────────────────────────────────────────
+#
+# Typed events ("log", "step", "job") are published to channels: "global" for
+# server logs, or a run id for everything one pipeline run emits.  Subscribers
+# pick the types and channels they want, each with its own bounded backlog.
+# A slow subscriber loses its oldest events, and those losses are counted. It
+# never blocks a publisher or holds up other subscribers.
+
+EVENT_TYPES        = ('log', 'step', 'job')
+EVENT_REPLAY       = 500    # events kept for late subscribers on the global channel
+EVENT_RUN_REPLAY   = 200    # … and per run channel
+EVENT_RUN_CHANNELS = 64     # run channels with replay kept (LRU)
+EVENT_BACKLOG      = 1000   # per-subscriber events before the oldest are dropped
+EVENT_BATCH        = 200    # max events per SSE frame
+EVENT_LINGER_SECS  = 0.05   # after the first event, wait this long to fill a frame
+EVENT_KEEPALIVE    = 15
+RUN_ID_RE          = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+_run_context = threading.local()     # .run_id tags logs emitted during a run
+
+
+class _Subscriber:
+    def __init__(self, types, channels):
+        self.types    = types
+        self.channels = channels        # None → every channel
+        self.events   = collections.deque()
+        self.dropped  = 0               # since the last frame
+        self.cond     = threading.Condition(threading.Lock())
+
+    def wants(self, ev: dict) -> bool:
+        return ev["type"] in self.types and (self.channels is None or ev["channel"] in self.channels)
+
+    def offer(self, ev: dict) -> bool:
+        """Queue ev; returns False if an older event had to be dropped for it."""
+        with self.cond:
+            lost = len(self.events) >= EVENT_BACKLOG
+            if lost:
+                self.events.popleft()
+                self.dropped += 1
+            self.events.append(ev)
+            self.cond.notify()
+        return not lost
+
+    def take(self, timeout: float) -> tuple[list, int]:
+        """Block up to timeout for events; return (batch, dropped since last take)."""
+        with self.cond:
+            if not self.events:
+                self.cond.wait(timeout)
+            if not self.events and not self.dropped:
+                return [], 0
+        if len(self.events) < EVENT_BATCH:
+            time.sleep(EVENT_LINGER_SECS)     # let a burst coalesce into one frame
+        with self.cond:
+            n     = min(EVENT_BATCH, len(self.events))
+            batch = [self.events.popleft() for _ in range(n)]
+            dropped, self.dropped = self.dropped, 0
+        return batch, dropped
+
+
+class _EventBus:
+    def __init__(self):
+        self._lock     = threading.Lock()
+        self._subs     = ()                        # replaced, never mutated
+        self._seq      = 0
+        self._replay   = {"global": collections.deque(maxlen=EVENT_REPLAY)}
+        self._runs     = collections.OrderedDict()  # run id → replay deque
+        self.published = 0
+        self.delivered = 0
+        self.dropped   = 0
+
+    def _replay_for(self, channel: str):
+        if channel == "global":
+            return self._replay["global"]
+        buf = self._runs.get(channel)
+        if buf is None:
+            buf = self._runs[channel] = collections.deque(maxlen=EVENT_RUN_REPLAY)
+            while len(self._runs) > EVENT_RUN_CHANNELS:
+                self._runs.popitem(last=False)
+        else:
+            self._runs.move_to_end(channel)
+        return buf
+
+    def publish(self, type_: str, channel: str = "global", **data) -> None:
+        # Sequence, replay and the subscriber snapshot are taken together, so a
+        # concurrent subscribe() sees each event exactly once (replay or live).
+        with self._lock:
+            self._seq += 1
+            ev = {"seq": self._seq, "type": type_, "channel": channel, "ts": time.time(), **data}
+            self._replay_for(channel).append(ev)
+            subs = self._subs
+            self.published += 1
+        delivered = lost = 0
+        for sub in subs:
+            if sub.wants(ev):
+                delivered += 1
+                lost += not sub.offer(ev)
+        if delivered:
+            with self._lock:
+                self.delivered += delivered
+                self.dropped   += lost
+
+    def subscribe(self, types, channels=None, since: int = 0) -> _Subscriber:
+        sub = _Subscriber(frozenset(types), frozenset(channels) if channels else None)
+        with self._lock:
+            bufs = ([self._replay["global"], *self._runs.values()] if channels is None
+                    else [self._replay[c] if c == "global" else self._runs.get(c, ()) for c in channels])
+            backlog = sorted((ev for buf in bufs for ev in buf
+                              if ev["seq"] > since and sub.wants(ev)), key=lambda ev: ev["seq"])
+            sub.events.extend(backlog[-EVENT_BACKLOG:])     # before publishers can see sub, so seq stays in order
+            self._subs = self._subs + (sub,)
+        return sub
+
+    def unsubscribe(self, sub: _Subscriber) -> None:
+        with self._lock:
+            self._subs = tuple(s for s in self._subs if s is not sub)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": len(self._subs),
+                "published":   self.published,
+                "delivered":   self.delivered,
+                "dropped":     self.dropped,
+                "backlog":     sum(len(s.events) for s in self._subs),
+                "run_channels": len(self._runs),
+            }
+
+
+_events = _EventBus()
 
-_log_buffer = collections.deque(maxlen=500)
-_log_subscribers: list = []
-_log_lock = threading.Lock()
 
+def _is_stream_request(record: logging.LogRecord) -> bool:
+    """werkzeug's access-log line for an SSE connection (logging it would echo forever)."""
+    if record.name != 'werkzeug' or not record.args:
+        return False
+    parts = str(record.args[0]).split(' ')
+    return len(parts) > 1 and parts[1].startswith(('/logs', '/events'))
 
-class _BrowserLogHandler(logging.Handler):
+
+class _EventLogHandler(logging.Handler):
     def emit(self, record):
         try:
-            msg = self.format(record)
-            if '/logs' in msg:          # suppress SSE endpoint's own traffic
+            if _is_stream_request(record):
                 return
-            _log_buffer.append(msg)
-            with _log_lock:
-                for q in list(_log_subscribers):
-                    try:
-                        q.put_nowait(msg)
-                    except queue.Full:
-                        pass
+            _events.publish("log", getattr(_run_context, 'run_id', None) or "global",
+                            level=record.levelname, message=self.format(record))
         except Exception:
             pass
 
 
-_browser_handler = _BrowserLogHandler()
-_browser_handler.setFormatter(logging.Formatter('%(levelname)s  %(message)s'))
-_browser_handler.setLevel(logging.DEBUG)
-logging.getLogger('werkzeug').addHandler(_browser_handler)
-app.logger.addHandler(_browser_handler)
+_event_handler = _EventLogHandler()
+_event_handler.setFormatter(logging.Formatter('%(levelname)s  %(message)s'))
+_event_handler.setLevel(logging.DEBUG)
+logging.getLogger('werkzeug').addHandler(_event_handler)
+app.logger.addHandler(_event_handler)
 
 # ── Paths ──────────────────────────────────────────────────────────────────
+# BASE_DIR, PLUGIN_DIR and PRESETS_DIR live in pipeline.py.
 
-BASE_DIR     = os.path.dirname(os.path.abspath(__file__))
-PLUGIN_DIR   = os.path.join(BASE_DIR, 'plugins')
 HISTORY_DIR  = os.path.join(BASE_DIR, 'history')
 SESSION_FILE = os.path.join(BASE_DIR, 'presets', 'last_session.json')
 CONFIG_FILE  = os.path.join(BASE_DIR, 'config_info.json')
 DEFAULT_WS   = os.path.join(BASE_DIR, 'workspaces')
-PRESETS_DIR       = os.path.join(BASE_DIR, 'presets')
 PRESETS_META_FILE = os.path.join(BASE_DIR, 'presets', 'presets_meta.json')
 HISTORY_META = os.path.join(HISTORY_DIR, 'meta.json')
 MAX_HISTORY  = 50
@@ -68,326 +216,243 @@ MAX_SESSIONS = 5
 for path in [PLUGIN_DIR, DEFAULT_WS, HISTORY_DIR, PRESETS_DIR]:
     os.makedirs(path, exist_ok=True)
 
-for _ext, _mime in [
-    ('.gcode', 'text/x-gcode'),
-    ('.nc',    'text/x-gcode'),
-    ('.ngc',   'text/x-gcode'),
-    ('.cnc',   'text/x-gcode'),
-    ('.gbr',   'text/x-gerber'),
-]:
-    mimetypes.add_type(_mime, _ext)
+# ── Config / workspace routes ──────────────────────────────────────────────
 
-# ── Payload ────────────────────────────────────────────────────────────────
+# config_info.json is parsed once and cached; each get_config() call costs a
+# single stat() and re-reads the file only when its mtime changes (e.g. the
+# user edited it by hand).  All writes go through update_config().
 
-@dataclass
-class Payload:
-    """
-    The universal pipeline token passed between every plugin step.
-
-    data      — the actual content:
-                  list[str]  for text files (one entry per line, newlines preserved)
-                  bytes      for binary files (images, audio, video, etc.)
-                  any        for richer types a plugin may introduce (numpy array,
-                             PIL Image, etc.) — the next plugin must understand it.
-    mime_type — IANA media type, e.g. "text/plain", "image/png", "audio/wav".
-                Plugins update this when they change the data format.
-    filename  — original filename; used for default output naming and MIME guessing.
-    meta      — free-form dict for inter-step communication.
-                Examples: {"layer_count": 12}, {"sample_rate": 44100}, {"crf": 23}
-    """
-    data:      Any
-    mime_type: str  = "text/plain"
-    filename:  str  = ""
-    meta:      dict = field(default_factory=dict)
+_config_cache: dict = {"mtime": None, "data": None}
+_config_lock = threading.Lock()
 
 
-def payload_from_file(path: str) -> Payload:
-    """Read a file from disk into a Payload, auto-detecting its MIME type."""
-    mime, _ = mimetypes.guess_type(path)
-    mime = mime or "application/octet-stream"
-    filename = os.path.basename(path)
+def _load_config_locked() -> dict[str, Any]:
+    try:
+        mtime = os.stat(CONFIG_FILE).st_mtime_ns
+    except OSError:
+        return {"workspace": DEFAULT_WS}
+    if _config_cache["mtime"] != mtime:
+        try:
+            with open(CONFIG_FILE, 'r') as f:
+                cfg = json.load(f)
+        except (json.JSONDecodeError, IOError):
+            return {"workspace": DEFAULT_WS}
+        _config_cache["mtime"] = mtime
+        _config_cache["data"]  = cfg
+        # Promote stored API key into the environment on first read
+        if not os.environ.get('ANTHROPIC_API_KEY') and cfg.get('api_key'):
+            os.environ['ANTHROPIC_API_KEY'] = cfg['api_key']
+    return _config_cache["data"]
 
-    # Treat text/* and a few common text-encoded formats as line lists
-    is_text = (
-        mime.startswith("text/")
-        or mime in ("application/json", "application/xml", "application/javascript")
-    )
 
-    if is_text:
-        with open(path, "r", errors="replace") as f:
-            data = f.readlines()
-    else:
-        with open(path, "rb") as f:
-            data = f.read()
+def get_config() -> dict[str, Any]:
+    with _config_lock:
+        return dict(_load_config_locked())
+
 
-    return Payload(data=data, mime_type=mime, filename=filename)
+def update_config(**changes) -> dict[str, Any]:
+    """Merge changes into the config and write it atomically (temp file + os.replace)."""
+    with _config_lock:
+        cfg = {**_load_config_locked(), **changes}
+        tmp = CONFIG_FILE + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(cfg, f, indent=4)
+        os.replace(tmp, CONFIG_FILE)
+        _config_cache["mtime"] = os.stat(CONFIG_FILE).st_mtime_ns
+        _config_cache["data"]  = cfg
+        return dict(cfg)
 
 
-def payload_to_file(payload: Payload, path: str):
-    """Write a Payload back to disk in the appropriate mode."""
-    if isinstance(payload.data, list):
-        with open(path, "w") as f:
-            f.writelines(payload.data)
-    elif isinstance(payload.data, (bytes, bytearray)):
-        with open(path, "wb") as f:
-            f.write(payload.data)
+# ── Conditional responses ─────────────────────────────────────────────────
+
+def conditional_json(etag: str, build):
+    """
+    Answer with 304 if the client already holds etag, otherwise jsonify(build()).
+    build is only called on a miss.  no-cache makes browsers revalidate every
+    time, so an unchanged resource costs one empty round trip.
+    """
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
     else:
-        # Last resort: coerce to string (covers numpy arrays printed, etc.)
-        with open(path, "w") as f:
-            f.write(str(payload.data))
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
 
 
-# ── Plugin loader ──────────────────────────────────────────────────────────
-#
-# Plugin files live in /plugins/*.py.
-#
-# Each file may declare a module-level PLUGIN_META dict that applies to all
-# functions in the file.  Individual functions may also carry a .plugin_meta
-# attribute (set via the @plugin decorator below) that overrides file-level
-# metadata for that specific function.
+# ── Session management ────────────────────────────────────────────────────
 #
-# Minimal PLUGIN_META example:
+# Sessions are tracked in <workspace>/sessions_index.json so that listing and
+# pruning never walk the workspace (which may be a slow network share):
 #
-#   PLUGIN_META = {
-#       "label":       "Convert G00/G01 → G1",
-#       "description": "Normalises move commands and rounds to 2 decimal places.",
-#       "accepts":     ["text/plain", "text/x-gcode"],
-#       "outputs":     ["text/plain", "text/x-gcode"],
-#       "requires":    [],           # pip package names
-#       "external":    [],           # system binary names (checked with shutil.which)
-#       "language":    "python",     # informational
-#       "tags":        ["gcode"],
-#   }
+#   {"<session_dir>": {"created": 1730000000.0, "last_access": 1730000100.0,
+#                      "files": {"part.gcode": 12345}, "bytes": 12345}}
 #
-# Plugin function signature (new style):
-#   def my_step(payload: Payload) -> Payload: ...
+# The index is cached in memory and re-read only when its mtime changes, so
+# another machine sharing the workspace is picked up on the next call.  If it
+# is missing it is rebuilt once from the session.json files on disk.
 #
-# Legacy text-only signature (backwards compatible, auto-wrapped):
-#   def my_step(lines: list[str]) -> list[str]: ...
-
-DEFAULT_META = {
-    "label":       None,          # falls back to "module.function" key
-    "description": "",
-    "accepts":     ["text/plain"],
-    "outputs":     ["text/plain"],
-    "requires":    [],
-    "external":    [],
-    "language":    "python",
-    "tags":        [],
-}
-
-
-def _is_legacy(fn) -> bool:
-    """Return True if fn looks like a legacy list[str] -> list[str] plugin."""
-    try:
-        params = list(inspect.signature(fn).parameters.values())
-        if not params:
-            return False
-        ann = params[0].annotation
-        if ann is inspect.Parameter.empty:
-            return True
-        # Direct class reference (normal import)
-        if ann is Payload:
-            return False
-        # String annotation — occurs when the plugin uses
-        # `from __future__ import annotations` or quotes the type: "Payload"
-        if isinstance(ann, str) and ann in ("Payload", "app.Payload"):
-            return False
-        return True
-    except (ValueError, TypeError):
-        return True
-
-
-def _wrap_legacy(fn):
-    """Wrap fn(list[str], ...) -> list[str] into fn(Payload, **kwargs) -> Payload."""
-    orig_sig    = inspect.signature(fn)
-    orig_params = set(orig_sig.parameters.keys())
-
-    def wrapped(payload: Payload, **kwargs) -> Payload:
-        relevant = {k: v for k, v in kwargs.items() if k in orig_params}
-        payload.data = fn(payload.data, **relevant)
-        return payload
-
-    wrapped.__name__   = fn.__name__
-    wrapped.__doc__    = fn.__doc__
-    wrapped._legacy    = True
-    wrapped._orig_sig  = orig_sig
-    return wrapped
+# Pruning is least-recently-used first and honours three config keys:
+#   max_sessions (default MAX_SESSIONS), session_max_age_days (0 = off),
+#   session_disk_budget_mb (0 = off).
 
+SESSION_INDEX_NAME = 'sessions_index.json'
 
-def _discover_fn_args(fn) -> list:
-    """Return [{name, type, default, label}] for every kwarg beyond the first param."""
-    sig    = getattr(fn, '_orig_sig', None) or inspect.signature(fn)
-    params = list(sig.parameters.values())
-    result = []
-    for p in params[1:]:
-        if p.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD):
-            continue
-        if p.default is inspect.Parameter.empty:
-            continue
-        result.append({
-            "name":    p.name,
-            "type":    type(p.default).__name__,
-            "default": p.default,
-            "label":   p.name.replace('_', ' ').title(),
-        })
-    return result
 
+class _SessionIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key  = None
+        self._data: dict = {}
 
-def _coerce_arg(value, default):
-    """Coerce a JSON-decoded value to the same type as the parameter default."""
-    try:
-        return type(default)(value)
-    except (ValueError, TypeError):
-        return value
-
-
-def get_plugins() -> dict:
-    """
-    Scan the plugins directory and return a dict keyed by module stem (one entry
-    per plugin file).  Legacy "module.function" keys are also stored with
-    _ui_hidden=True so saved pipelines built before this change still execute.
-
-    {
-      "gcode_utils": {
-        "funcs":       [<callable>, ...],   # all public fns in file order
-        "meta":        { label, description, accepts, outputs, ... },
-        "deps_ok":     True,
-        "missing_deps": [],
-        "_ui_hidden":  False,
-        "func_count":  N,
-      },
-      "gcode_utils.remove_comments": { ..., "_ui_hidden": True },  # legacy compat
-      ...
-    }
-    """
-    plugins = {}
-    if not os.path.exists(PLUGIN_DIR):
-        return plugins
-
-    for filename in sorted(os.listdir(PLUGIN_DIR)):
-        if not filename.endswith('.py') or filename == '__init__.py':
-            continue
-        module_name = filename[:-3]
-        path = os.path.join(PLUGIN_DIR, filename)
+    def _load_locked(self) -> tuple[str, dict]:
+        ws   = get_config()['workspace']
+        path = os.path.join(ws, SESSION_INDEX_NAME)
+        try:
+            st  = os.stat(path)
+            key = (ws, st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = (ws, None, None)
+        if key != self._key:
+            try:
+                if key[1] is None:
+                    raise FileNotFoundError(path)
+                with open(path, 'r') as f:
+                    self._data = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._data = self._rebuild(ws)
+                if not self._save_locked(ws):
+                    self._key = key     # unwritable: keep serving the rebuild, don't rescan per call
+                return ws, self._data
+            self._key = key
+        return ws, self._data
+
+    def _save_locked(self, ws: str) -> bool:
+        path = os.path.join(ws, SESSION_INDEX_NAME)
+        try:
+            os.makedirs(ws, exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self._data, f)
+            os.replace(tmp, path)
+            st = os.stat(path)
+            self._key = (ws, st.st_mtime_ns, st.st_size)
+            return True
+        except OSError as e:
+            print(f"[sessions] Failed to write index: {e}")
+            return False
 
+    @staticmethod
+    def _rebuild(ws: str) -> dict:
+        """One-time scan used only when the index file is missing or unreadable."""
+        data = {}
         try:
-            spec   = importlib.util.spec_from_file_location(module_name, path)
-            if spec is None or spec.loader is None:
+            entries = list(os.scandir(ws))
+        except OSError:
+            return data
+        for de in entries:
+            meta_path = os.path.join(de.path, 'session.json')
+            if not de.is_dir() or not os.path.exists(meta_path):
                 continue
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-        except Exception as e:
-            print(f"[plugins] Failed to import {filename}: {e}")
-            continue
-
-        file_meta = {**DEFAULT_META, **getattr(module, 'PLUGIN_META', {})}
-
-        # Module-level deps are checked once (they apply to all functions)
-        missing = []
-        for pkg in file_meta.get("requires", []):
             try:
-                importlib.import_module(pkg.replace("-", "_"))
-            except ImportError:
-                missing.append(f"pip:{pkg}")
-        for binary in file_meta.get("external", []):
-            if shutil.which(binary) is None:
-                missing.append(f"bin:{binary}")
-        deps_ok = len(missing) == 0
-
-        module_funcs = []
-        module_args  = {}   # {name: arg_dict}, deduplicated across all fns in module
-        for fn_name, fn in inspect.getmembers(module, inspect.isfunction):
-            if fn_name.startswith('_'):
-                continue
-            callable_fn = _wrap_legacy(fn) if _is_legacy(fn) else fn
-            module_funcs.append(callable_fn)
-
-            # Collect discoverable args from this function
-            for arg in _discover_fn_args(callable_fn):
-                if arg["name"] not in module_args:
-                    module_args[arg["name"]] = arg
-
-            # Per-function key: used by "Add Step" picker and for backwards
-            # compatibility with pipelines saved before the one-entry-per-file change.
-            fn_meta = {**file_meta, **getattr(fn, 'plugin_meta', {})}
-            if fn_meta["label"] is None:
-                fn_meta["label"] = f"{module_name}.{fn_name}"
-            fn_meta["args"] = _discover_fn_args(callable_fn)
-            plugins[f"{module_name}.{fn_name}"] = {
-                "funcs":       [callable_fn],
-                "meta":        fn_meta,
-                "module":      module_name,
-                "deps_ok":     deps_ok,
-                "missing_deps": missing,
-                "_ui_hidden":  True,
-                "func_count":  1,
+                with open(meta_path) as mf:
+                    names = json.load(mf).get('files', [])
+            except (OSError, json.JSONDecodeError):
+                names = []
+            files = {}
+            for n in names:
+                try:
+                    files[n] = os.path.getsize(os.path.join(de.path, n))
+                except OSError:
+                    pass
+            mtime = de.stat().st_mtime
+            data[de.name] = {
+                "created":     mtime,
+                "last_access": mtime,
+                "files":       files,
+                "bytes":       sum(files.values()),
             }
-
-        if not module_funcs:
-            continue
-
-        mod_meta = {**file_meta}
-        if mod_meta["label"] is None:
-            mod_meta["label"] = module_name.replace('_', ' ').title()
-
-        # Allow PLUGIN_META["args"] to override labels/add hints for individual args
-        for override in file_meta.get("args", []):
-            name = override.get("name")
-            if name and name in module_args:
-                module_args[name].update(override)
-
-        mod_meta["args"] = list(module_args.values())
-
-        plugins[module_name] = {
-            "funcs":       module_funcs,
-            "meta":        mod_meta,
-            "deps_ok":     deps_ok,
-            "missing_deps": missing,
-            "_ui_hidden":  False,
-            "func_count":  len(module_funcs),
-        }
-
-    return plugins
+        return data
+
+    def register(self, name: str):
+        with self._lock:
+            ws, data = self._load_locked()
+            now = time.time()
+            data.setdefault(name, {"created": now, "last_access": now, "files": {}, "bytes": 0})
+            self._save_locked(ws)
+
+    def record(self, name: str, filename: str, size: int):
+        """Note that filename in session name now has size bytes, and mark the session used."""
+        with self._lock:
+            ws, data = self._load_locked()
+            now   = time.time()
+            entry = data.setdefault(name, {"created": now, "files": {}, "bytes": 0})
+            entry["files"][filename] = size
+            entry["bytes"]       = sum(entry["files"].values())
+            entry["last_access"] = now
+            self._save_locked(ws)
+
+    def sessions(self) -> list:
+        """Return [(name, entry)] sorted least-recently-used first."""
+        with self._lock:
+            _, data = self._load_locked()
+            return sorted(((k, dict(v)) for k, v in data.items()),
+                          key=lambda kv: kv[1].get("last_access", 0))
+
+    def prune(self, reserve: int = 0) -> list:
+        """
+        Drop sessions that exceed the count (leaving room for reserve new
+        ones), age or disk budget limits.  Returns the removed paths.
+        """
+        max_count, max_age, budget = _prune_limits(get_config())
+        with self._lock:
+            ws, data = self._load_locked()
+            order    = sorted(data, key=lambda k: data[k].get("last_access", 0))
+            now      = time.time()
+            total    = sum(e.get("bytes", 0) for e in data.values())
+            victims  = []
+            for name in order:
+                entry = data[name]
+                over_count  = len(order) - len(victims) > max_count - reserve
+                too_old     = max_age > 0 and now - entry.get("last_access", now) > max_age
+                over_budget = budget > 0 and total > budget
+                if not (over_count or too_old or over_budget):
+                    continue
+                victims.append(name)
+                total -= entry.get("bytes", 0)
+            for name in victims:
+                del data[name]
+            if victims:
+                self._save_locked(ws)
+        paths = [os.path.join(ws, name) for name in victims]
+        for p in paths:
+            shutil.rmtree(p, ignore_errors=True)
+        return paths
+
+
+def _prune_limits(cfg: dict) -> tuple:
+    """(max sessions, max age in s, disk budget in bytes) from config; defaults if invalid."""
+    try:
+        return (max(1, int(cfg.get('max_sessions', MAX_SESSIONS))),
+                float(cfg.get('session_max_age_days', 0)) * 86400,
+                float(cfg.get('session_disk_budget_mb', 0)) * 1024 * 1024)
+    except (TypeError, ValueError):
+        print("[sessions] Invalid max_sessions / session_max_age_days / session_disk_budget_mb "
+              "in config; using defaults")
+        return MAX_SESSIONS, 0.0, 0.0
 
 
-# ── Config / workspace routes ──────────────────────────────────────────────
-
-def get_config() -> dict[str, Any]:
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                cfg = json.load(f)
-            # Promote stored API key into the environment on first read
-            if not os.environ.get('ANTHROPIC_API_KEY') and cfg.get('api_key'):
-                os.environ['ANTHROPIC_API_KEY'] = cfg['api_key']
-            return cfg
-        except (json.JSONDecodeError, IOError):
-            pass
-    return {"workspace": DEFAULT_WS}
+_session_index = _SessionIndex()
 
 
-# ── Session management ────────────────────────────────────────────────────
-
 def list_session_dirs():
-    """Return session dirs inside the workspace sorted oldest first."""
+    """Return session dirs inside the workspace sorted least-recently-used first."""
     ws = get_config()['workspace']
-    result = []
-    try:
-        for d in os.listdir(ws):
-            full = os.path.join(ws, d)
-            if os.path.isdir(full) and os.path.exists(os.path.join(full, 'session.json')):
-                result.append((os.path.getmtime(full), full))
-    except OSError:
-        pass
-    result.sort()
-    return [p for _, p in result]
+    return [os.path.join(ws, name) for name, _ in _session_index.sessions()]
 
 
 def prune_sessions():
-    sessions = list_session_dirs()
-    while len(sessions) >= MAX_SESSIONS:
-        shutil.rmtree(sessions.pop(0), ignore_errors=True)
+    _session_index.prune(reserve=1)
 
 
 def new_session_dir(filename):
@@ -399,6 +464,7 @@ def new_session_dir(filename):
     name = f"{ts}_{safe}"
     path = os.path.join(ws, name)
     os.makedirs(path, exist_ok=True)
+    _session_index.register(name)
     return name, path
 
 
@@ -427,25 +493,36 @@ def readme():
         return '# README not found', 404, {'Content-Type': 'text/plain; charset=utf-8'}
 
 
+@app.route('/events')
 @app.route('/logs')
-def log_stream():
+def event_stream():
+    """
+    Server-sent events.  Query: types=log,step,job (default: all; /logs → log),
+    run=<id>[,<id>] to follow specific runs (default: every channel), and
+    since=<seq> (or Last-Event-ID) to resume.  Each frame carries a batch:
+    data: {"events": [...], "dropped": n} where dropped counts events this
+    subscriber lost to backpressure since the previous frame.
+    """
+    default = 'log' if request.path == '/logs' else ','.join(EVENT_TYPES)
+    types   = [t for t in request.args.get('types', default).split(',') if t in EVENT_TYPES]
+    runs    = [r for r in request.args.get('run', '').split(',') if r]
+    try:
+        since = int(request.args.get('since') or request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        since = 0
+    sub = _events.subscribe(types or EVENT_TYPES, runs or None, since)
+
     def generate():
-        q = queue.Queue(maxsize=200)
-        with _log_lock:
-            _log_subscribers.append(q)
         try:
-            for line in list(_log_buffer):
-                yield f"data: {json.dumps(line)}\n\n"
             while True:
-                try:
-                    msg = q.get(timeout=15)
-                    yield f"data: {json.dumps(msg)}\n\n"
-                except queue.Empty:
+                batch, dropped = sub.take(EVENT_KEEPALIVE)
+                if not batch and not dropped:
                     yield ": keepalive\n\n"
+                    continue
+                head = f"id: {batch[-1]['seq']}\n" if batch else ""
+                yield head + f"data: {json.dumps({'events': batch, 'dropped': dropped})}\n\n"
         finally:
-            with _log_lock:
-                if q in _log_subscribers:
-                    _log_subscribers.remove(q)
+            _events.unsubscribe(sub)
 
     return app.response_class(
         generate(),
@@ -453,11 +530,15 @@ def log_stream():
         headers={
             'Cache-Control': 'no-cache',
             'X-Accel-Buffering': 'no',
-            'Connection': 'keep-alive',
         }
     )
 
 
+@app.route('/events/stats')
+def event_stats():
+    return jsonify(_events.stats())
+
+
 @app.route('/get_workspace', methods=['GET'])
 def get_workspace_route():
     return jsonify(get_config())
@@ -468,11 +549,7 @@ def set_workspace():
     path = request.json.get('path')
     if not path:
         return jsonify({"error": "No path provided"}), 400
-    config = get_config()
-    config['workspace'] = path
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
-    return jsonify(config)
+    return jsonify(update_config(workspace=path))
 
 
 @app.route('/set_api_key', methods=['POST'])
@@ -480,14 +557,60 @@ def set_api_key():
     key = (request.json or {}).get('key', '').strip()
     if not key:
         return jsonify({"error": "No key provided"}), 400
-    config = get_config()
-    config['api_key'] = key
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+    update_config(api_key=key)
     os.environ['ANTHROPIC_API_KEY'] = key
     return jsonify({"status": "ok"})
 
 
+_session_locks: dict = {}
+_session_locks_guard = threading.Lock()
+
+
+def _session_lock(session_name: str) -> threading.RLock:
+    """
+    Return the lock that serialises one session's session.json updates and
+    the writes to its files and their undo history.  Re-entrant, since a
+    result write records the file in session.json while holding it.
+    """
+    with _session_locks_guard:
+        return _session_locks.setdefault(session_name, threading.RLock())
+
+
+def record_session_file(session_path: str, session_name: str, filename: str):
+    """Add filename to the session's session.json (read-modify-write under the session lock)."""
+    meta_path = os.path.join(session_path, 'session.json')
+    with _session_lock(session_name):
+        try:
+            with open(meta_path) as mf:
+                meta = json.load(mf)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = {"files": [], "session_dir": session_name}
+        if "files" not in meta:
+            meta["files"] = [meta.get("filename", filename)]
+        if filename not in meta["files"]:
+            meta["files"].append(filename)
+        tmp = meta_path + '.tmp'
+        with open(tmp, 'w') as mf:
+            json.dump(meta, mf)
+        os.replace(tmp, meta_path)
+    try:
+        _session_index.record(session_name, filename,
+                              os.path.getsize(os.path.join(session_path, filename)))
+    except OSError:
+        pass
+
+
+def _resolve_upload_session(existing_dir: str, filename: str):
+    """Return (session_name, session_path), creating a new session if existing_dir is empty."""
+    if existing_dir:
+        session_name = os.path.basename(existing_dir)
+        session_path = os.path.join(get_config()['workspace'], session_name)
+        if not os.path.isdir(session_path):
+            return None, None
+        return session_name, session_path
+    return new_session_dir(filename)
+
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
     if 'file' not in request.files:
@@ -498,28 +621,12 @@ def upload_file():
     filename     = os.path.basename(f.filename)
     existing_dir = request.form.get('session_dir', '').strip()
 
-    if existing_dir:
-        session_name = os.path.basename(existing_dir)
-        session_path = os.path.join(get_config()['workspace'], session_name)
-        if not os.path.isdir(session_path):
-            return jsonify({"error": "Session not found"}), 404
-    else:
-        session_name, session_path = new_session_dir(filename)
+    session_name, session_path = _resolve_upload_session(existing_dir, filename)
+    if session_path is None:
+        return jsonify({"error": "Session not found"}), 404
 
     f.save(os.path.join(session_path, filename))
-
-    meta_path = os.path.join(session_path, 'session.json')
-    try:
-        with open(meta_path) as mf:
-            meta = json.load(mf)
-    except (FileNotFoundError, json.JSONDecodeError):
-        meta = {"files": [], "session_dir": session_name}
-    if "files" not in meta:
-        meta["files"] = [meta.get("filename", filename)]
-    if filename not in meta["files"]:
-        meta["files"].append(filename)
-    with open(meta_path, 'w') as mf:
-        json.dump(meta, mf)
+    record_session_file(session_path, session_name, filename)
 
     return jsonify({
         "status":      "success",
@@ -528,6 +635,167 @@ def upload_file():
     })
 
 
+# ── Chunked uploads ────────────────────────────────────────────────────────
+#
+#   POST /upload/init      { filename, size, session_dir? }
+#                          → { upload_id, session_dir, filename, offset }
+#   PUT  /upload/chunk?upload_id=…&offset=N      raw bytes as the body,
+#                          optional X-Chunk-SHA256 header → { offset }
+#   POST /upload/finalize  { upload_id, sha256? } → same shape as /upload
+#
+# Chunks are streamed straight into "<filename>.part" inside the session dir
+# and must arrive in order: a chunk whose offset is not the current end of
+# the part file gets 409 with the offset the server actually has.  Because
+# the part file is the source of truth, an interrupted upload resumes by
+# calling init again with the same session_dir / filename / size, even
+# across a server restart.  Different files upload independently, so the
+# client can run several in parallel.
+
+UPLOAD_BLOCK = 1024 * 1024
+
+_uploads: dict = {}
+_uploads_lock = threading.Lock()
+
+
+def _upload_entry(upload_id: str):
+    with _uploads_lock:
+        return _uploads.get(upload_id)
+
+
+def _hash_file(path: str, limit: int):
+    """SHA-256 of the first limit bytes of path (used to resume a part file)."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while limit > 0:
+            block = f.read(min(UPLOAD_BLOCK, limit))
+            if not block:
+                break
+            h.update(block)
+            limit -= len(block)
+    return h
+
+
+@app.route('/upload/init', methods=['POST'])
+def upload_init():
+    data     = request.json or {}
+    filename = os.path.basename(str(data.get('filename', '')).strip())
+    try:
+        size = int(data.get('size', -1))
+    except (TypeError, ValueError):
+        size = -1
+    if not filename or size < 0:
+        return jsonify({"error": "Missing filename or size"}), 400
+
+    session_name, session_path = _resolve_upload_session(
+        str(data.get('session_dir', '')).strip(), filename)
+    if session_path is None:
+        return jsonify({"error": "Session not found"}), 404
+
+    upload_id = hashlib.sha1(f"{session_name}/{filename}".encode()).hexdigest()[:20]
+    part_path = os.path.join(session_path, filename + '.part')
+
+    with _uploads_lock:
+        entry = _uploads.get(upload_id)
+        if entry is None or entry["size"] != size:
+            entry = {
+                "session_dir": session_name,
+                "session_path": session_path,
+                "filename":    filename,
+                "size":        size,
+                "part":        part_path,
+                "lock":        threading.Lock(),
+                "hash":        None,
+            }
+            _uploads[upload_id] = entry
+
+    with entry["lock"]:
+        have = os.path.getsize(part_path) if os.path.exists(part_path) else -1
+        if have < 0 or have > size:
+            open(part_path, 'wb').close()
+            have = 0
+        if entry["hash"] is None or entry.get("offset") != have:
+            entry["hash"]   = _hash_file(part_path, have)
+            entry["offset"] = have
+
+    return jsonify({
+        "upload_id":   upload_id,
+        "session_dir": session_name,
+        "filename":    filename,
+        "offset":      have,
+    })
+
+
+@app.route('/upload/chunk', methods=['PUT', 'POST'])
+def upload_chunk():
+    entry = _upload_entry(request.args.get('upload_id', ''))
+    if entry is None:
+        return jsonify({"error": "Unknown upload_id — call /upload/init"}), 404
+    try:
+        offset = int(request.args.get('offset', ''))
+    except ValueError:
+        return jsonify({"error": "Missing offset"}), 400
+    expected = (request.headers.get('X-Chunk-SHA256') or '').strip().lower()
+
+    with entry["lock"]:
+        if offset != entry["offset"]:
+            return jsonify({"error": "Offset mismatch", "offset": entry["offset"]}), 409
+        file_hash  = entry["hash"].copy()
+        chunk_hash = hashlib.sha256()
+        written    = 0
+        try:
+            with open(entry["part"], 'r+b') as f:
+                f.seek(offset)
+                while True:
+                    block = request.stream.read(UPLOAD_BLOCK)
+                    if not block:
+                        break
+                    if offset + written + len(block) > entry["size"]:
+                        f.truncate(offset)
+                        return jsonify({"error": "Chunk exceeds declared size",
+                                        "offset": offset}), 400
+                    f.write(block)
+                    file_hash.update(block)
+                    chunk_hash.update(block)
+                    written += len(block)
+                if expected and chunk_hash.hexdigest() != expected:
+                    f.truncate(offset)
+                    return jsonify({"error": "Chunk checksum mismatch", "offset": offset}), 422
+        except OSError as e:
+            return jsonify({"error": str(e), "offset": offset}), 500
+        entry["hash"]    = file_hash
+        entry["offset"] += written
+        return jsonify({"offset": entry["offset"]})
+
+
+@app.route('/upload/finalize', methods=['POST'])
+def upload_finalize():
+    data  = request.json or {}
+    entry = _upload_entry(data.get('upload_id', ''))
+    if entry is None:
+        return jsonify({"error": "Unknown upload_id — call /upload/init"}), 404
+    expected = str(data.get('sha256', '')).strip().lower()
+
+    with entry["lock"]:
+        if entry["offset"] != entry["size"]:
+            return jsonify({"error": "Upload incomplete", "offset": entry["offset"]}), 409
+        digest = entry["hash"].hexdigest()
+        if expected and digest != expected:
+            return jsonify({"error": "Checksum mismatch", "sha256": digest}), 422
+        dest = os.path.join(entry["session_path"], entry["filename"])
+        os.replace(entry["part"], dest)
+        forget_line_index(dest)
+        with _uploads_lock:
+            _uploads.pop(data['upload_id'], None)
+
+    record_session_file(entry["session_path"], entry["session_dir"], entry["filename"])
+    return jsonify({
+        "status":      "success",
+        "filename":    entry["filename"],
+        "session_dir": entry["session_dir"],
+        "sha256":      digest,
+    })
+
+
 @app.route('/list_workspaces', methods=['GET'])
 def list_workspaces():
     current = get_config()['workspace']
@@ -571,7 +839,12 @@ def download_output():
     path = os.path.join(get_config()['workspace'], session_dir, filename)
     if not os.path.exists(path):
         return jsonify({"error": "File not found"}), 404
-    return send_file(path, as_attachment=True, download_name=filename)
+    # Strong validator from the file version; send_file answers If-None-Match
+    # with 304 and Range / If-Range with 206 partial content.
+    resp = send_file(path, as_attachment=True, download_name=filename,
+                     conditional=True, etag=_file_version(os.stat(path)))
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
 
 
 @app.route('/save_preset', methods=['POST'])
@@ -589,46 +862,219 @@ def save_preset():
     return jsonify({"status": "success", "filename": basename})
 
 
-def read_presets_meta() -> dict:
+# ── Preset usage stats ─────────────────────────────────────────────────────
+# Per-preset counters live in memory behind a lock, so concurrent /preset_event
+# calls (e.g. parallel batch runs) never lose an increment.  Changes mark the
+# store dirty and a background thread writes presets_meta.json atomically at
+# most once every PRESET_STATS_FLUSH_SECS (and once more at exit).
+#
+#   {"uses": 3, "successes": 2, "last_used": "...",
+#    "runs": 2, "total_seconds": 1.84, "total_bytes": 5242880}
+#
+# runs / total_seconds / total_bytes cover successful runs that reported
+# timing, and drive the throughput ranking in the Library.
+
+PRESET_STATS_FLUSH_SECS = 2.0
+
+
+class _PresetStats:
+    def __init__(self, path: str):
+        self.path    = path
+        self._lock   = threading.Lock()
+        self._dirty  = threading.Event()
+        self._writer = None
+        try:
+            with open(path, 'r') as f:
+                self._data: dict = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._data = {}
+
+    def record(self, filename: str, event: str, seconds: float = 0.0, size: int = 0):
+        with self._lock:
+            entry = self._data.setdefault(filename, {"uses": 0, "successes": 0, "last_used": None})
+            if event == 'loaded':
+                entry['uses'] += 1
+                entry['last_used'] = datetime.now().isoformat(timespec='seconds')
+            elif event == 'success':
+                entry['successes'] += 1
+                if seconds > 0:
+                    entry['runs']          = entry.get('runs', 0) + 1
+                    entry['total_seconds'] = round(entry.get('total_seconds', 0.0) + seconds, 3)
+                    entry['total_bytes']   = entry.get('total_bytes', 0) + max(0, int(size))
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, daemon=True)
+                self._writer.start()
+        self._dirty.set()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self._data.items()}
+
+    def _write_loop(self):
+        while True:
+            self._dirty.wait()
+            time.sleep(PRESET_STATS_FLUSH_SECS)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if not self._dirty.is_set():
+                return
+            self._dirty.clear()
+            data = json.dumps(self._data, indent=4)
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[presets] Failed to write usage stats: {e}")
+            self._dirty.set()
+
+
+_preset_stats = _PresetStats(PRESETS_META_FILE)
+atexit.register(_preset_stats.flush)
+
+
+# ── Preset catalog ─────────────────────────────────────────────────────────
+# In-memory index of every preset file.  Each entry is keyed by filename and
+# re-parsed only when the file's (mtime, size) changes; usage stats come from
+# the in-memory _preset_stats store.  /list_presets is then a scandir plus a
+# filter/sort over the index.
+
+PRESET_SORTS = {
+    "name":         (lambda p: p["filename"].lower(),      False),
+    "uses":         (lambda p: p["uses"],                  True),
+    "success_rate": (lambda p: -1 if p["success_rate"] is None else p["success_rate"], True),
+    "last_used":    (lambda p: p["last_used"] or "",       True),
+    "step_count":   (lambda p: p["step_count"],            True),
+    "throughput":   (lambda p: p["throughput"] or 0,       True),
+}
+
+
+def _flatten_steps(steps: list):
+    """Yield every step dict, descending into fork branches."""
+    for step in steps:
+        if not isinstance(step, dict):
+            continue
+        yield step
+        for branch in step.get('branches') or []:
+            if isinstance(branch, dict):
+                yield from _flatten_steps(branch.get('steps') or [])
+
+
+def _summarise_preset(path: str) -> dict:
+    """Parse one preset file into its catalog entry (everything but usage stats)."""
     try:
-        with open(PRESETS_META_FILE, 'r') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {}
+        with open(path) as f:
+            steps = json.load(f)
+    except Exception:
+        steps = None
+    if not isinstance(steps, list):
+        steps = []
+    plugin_keys, args, words = [], {}, []
+    for step in _flatten_steps(steps):
+        key = step.get('pluginKey') or ''
+        if key and key not in plugin_keys:
+            plugin_keys.append(key)
+        set_args = {k: v for k, v in (step.get('args') or {}).items() if v is not None}
+        if set_args:
+            args.setdefault(key, {}).update(set_args)
+        words += [key, step.get('description') or '']
+    return {
+        "step_count":  len(steps),
+        "plugin_keys": plugin_keys,
+        "args":        args,
+        "_search":     ' '.join([os.path.basename(path)] + words).lower(),
+    }
 
 
-def write_presets_meta(meta: dict):
-    with open(PRESETS_META_FILE, 'w') as f:
-        json.dump(meta, f, indent=4)
+class _PresetCatalog:
+    def __init__(self, presets_dir: str, meta_file: str):
+        self.dir        = presets_dir
+        self.meta_file  = meta_file
+        self._entries: dict = {}     # filename -> (stat_key, summary)
+        self._lock      = threading.Lock()
+
+    def refresh(self) -> list:
+        """Bring the index up to date with the presets folder and return all entries."""
+        meta_name = os.path.basename(self.meta_file)
+        with self._lock:
+            seen = set()
+            with os.scandir(self.dir) as it:
+                for de in it:
+                    if not de.name.endswith('.json') or de.name == meta_name or not de.is_file():
+                        continue
+                    st  = de.stat()
+                    key = (st.st_mtime_ns, st.st_size)
+                    seen.add(de.name)
+                    cached = self._entries.get(de.name)
+                    if cached is None or cached[0] != key:
+                        self._entries[de.name] = (key, _summarise_preset(de.path))
+            for gone in set(self._entries) - seen:
+                del self._entries[gone]
+
+            usage  = _preset_stats.snapshot()
+            result = []
+            for filename, (_, summary) in self._entries.items():
+                m    = usage.get(filename, {})
+                uses = m.get('uses', 0)
+                succ = m.get('successes', 0)
+                runs = m.get('runs', 0)
+                secs = m.get('total_seconds', 0.0)
+                result.append({
+                    **summary,
+                    'filename':     filename,
+                    'uses':         uses,
+                    'successes':    succ,
+                    'success_rate': round(succ / uses, 2) if uses > 0 else None,
+                    'last_used':    m.get('last_used'),
+                    'runs':         runs,
+                    'avg_seconds':  round(secs / runs, 3) if runs > 0 else None,
+                    'throughput':   round(m.get('total_bytes', 0) / secs) if secs > 0 else None,
+                })
+            return result
+
+    def known(self, filename: str) -> bool:
+        """Whether filename is a saved preset; a name not yet indexed rescans the folder."""
+        with self._lock:
+            if filename in self._entries:
+                return True
+        return any(e['filename'] == filename for e in self.refresh())
+
+    def query(self, q: str = '', plugin: str = '', sort: str = 'name') -> list:
+        entries = self.refresh()
+        if q:
+            terms   = q.lower().split()
+            entries = [e for e in entries if all(t in e['_search'] for t in terms)]
+        if plugin:
+            entries = [
+                e for e in entries
+                if any(k == plugin or k.startswith(plugin + '.') for k in e['plugin_keys'])
+            ]
+        key_fn, reverse = PRESET_SORTS.get(sort, PRESET_SORTS['name'])
+        entries.sort(key=lambda e: e['filename'].lower())       # stable tie-break
+        entries.sort(key=key_fn, reverse=reverse)
+        return [{k: v for k, v in e.items() if not k.startswith('_')} for e in entries]
+
+
+_preset_catalog = _PresetCatalog(PRESETS_DIR, PRESETS_META_FILE)
 
 
 @app.route('/list_presets', methods=['GET'])
 def list_presets():
+    """
+    GET /list_presets?q=<text>&plugin=<key or module>&sort=<name|uses|success_rate|last_used|step_count|throughput>
+
+    All parameters are optional; q matches filename, plugin keys and step
+    descriptions (every whitespace-separated term must match).
+    """
     try:
-        meta  = read_presets_meta()
-        files = sorted(f for f in os.listdir(PRESETS_DIR)
-                       if f.endswith('.json') and f != 'presets_meta.json')
-        result = []
-        for filename in files:
-            m    = meta.get(filename, {})
-            uses = m.get('uses', 0)
-            succ = m.get('successes', 0)
-            # Count steps by reading the file
-            try:
-                with open(os.path.join(PRESETS_DIR, filename)) as pf:
-                    steps = json.load(pf)
-                step_count = len(steps) if isinstance(steps, list) else 0
-            except Exception:
-                step_count = 0
-            result.append({
-                'filename':     filename,
-                'uses':         uses,
-                'successes':    succ,
-                'success_rate': round(succ / uses, 2) if uses > 0 else None,
-                'step_count':   step_count,
-                'last_used':    m.get('last_used'),
-            })
-        return jsonify(result)
+        return jsonify(_preset_catalog.query(
+            q      = request.args.get('q', '').strip(),
+            plugin = request.args.get('plugin', '').strip(),
+            sort   = request.args.get('sort', 'name'),
+        ))
     except Exception:
         return jsonify([])
 
@@ -640,31 +1086,41 @@ def get_preset(filename):
     if not os.path.exists(path):
         return jsonify({"error": "Not found"}), 404
     try:
-        with open(path, 'r') as f:
-            return jsonify(json.load(f))
+        with open(path, 'rb') as f:
+            raw = f.read()
+        return conditional_json(hashlib.sha1(raw).hexdigest(), lambda: json.loads(raw))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
 @app.route('/preset_event', methods=['POST'])
 def preset_event():
-    filename = os.path.basename(request.json.get('filename', '').strip())
-    event    = request.json.get('event', '')
+    """
+    POST { "filename": "x.json", "event": "loaded" | "success",
+           "duration_ms": 1234, "bytes": 56789 }      # timing optional, success only
+    """
+    data     = request.json or {}
+    filename = os.path.basename(data.get('filename', '').strip())
+    event    = data.get('event', '')
     if not filename or event not in ('loaded', 'success'):
         return jsonify({"error": "Invalid request"}), 400
-    meta = read_presets_meta()
-    entry = meta.setdefault(filename, {"uses": 0, "successes": 0, "last_used": None})
-    if event == 'loaded':
-        entry['uses'] += 1
-        entry['last_used'] = datetime.now().isoformat(timespec='seconds')
-    elif event == 'success':
-        entry['successes'] += 1
-    write_presets_meta(meta)
+    try:
+        duration_ms = float(data.get('duration_ms', 0))
+        size        = max(0, int(data.get('bytes', 0)))
+        if not math.isfinite(duration_ms):
+            raise ValueError(duration_ms)
+        seconds = max(0.0, duration_ms) / 1000
+    except (TypeError, ValueError, OverflowError):
+        return jsonify({"error": "Invalid duration_ms or bytes"}), 400
+    _preset_stats.record(filename, event, seconds, size)
     return jsonify({"status": "ok"})
 
 
 # ── File-content history ──────────────────────────────────────────────────
-# Stores raw byte snapshots of a file before each /execute run.
+# Each undo/redo entry is either:
+#   bytes                   a full snapshot of the file (taken before /execute)
+#   {"patches": [...]}      line patches (start, delete, insert_bytes) that
+#                           restore the file, recorded by patch-based edits
 # Keyed by "session_dir/filename".  Pure in-memory; lost on server restart.
 
 _file_histories: dict = {}
@@ -685,60 +1141,69 @@ def _fh_limit():
     return max(1, int(get_config().get("file_undo_limit", 10)))
 
 
-def fh_push_snapshot(session_dir, filename, path):
-    """Snapshot the current file contents before overwriting it."""
-    try:
-        with open(path, "rb") as f:
-            snapshot = f.read()
-    except OSError:
-        return
+def _fh_push(session_dir, filename, entry):
     key = _fh_key(session_dir, filename)
     limit = _fh_limit()
     with _file_hist_lock:
         fh = _fh_get(key)
-        fh["past"].append(snapshot)
+        fh["past"].append(entry)
         fh["future"].clear()
         if len(fh["past"]) > limit:
             fh["past"].pop(0)
             fh["hit_limit"] = True
 
 
-def fh_undo(session_dir, filename, path):
-    key = _fh_key(session_dir, filename)
-    with _file_hist_lock:
-        fh = _fh_get(key)
-        if not fh["past"]:
-            return False
-        try:
-            with open(path, "rb") as f:
-                current = f.read()
-        except OSError:
-            return False
-        prev = fh["past"].pop()
-        fh["future"].append(current)
+def fh_push_snapshot(session_dir, filename, path):
+    """Snapshot the current file contents before overwriting it."""
+    try:
+        with open(path, "rb") as f:
+            snapshot = f.read()
+    except OSError:
+        return
+    _fh_push(session_dir, filename, snapshot)
+
+
+def fh_push_patch(session_dir, filename, reverse_patches):
+    """Record the reverse of a patch-based edit as the undo entry."""
+    _fh_push(session_dir, filename, {"patches": reverse_patches})
+
+
+def _fh_restore(entry, path):
+    """Put entry's contents into path and return the entry that undoes that."""
+    if isinstance(entry, dict):
+        return {"patches": apply_line_patches(path, entry["patches"])}
+    with open(path, "rb") as f:
+        current = f.read()
     with open(path, "wb") as f:
-        f.write(prev)
-    return True
+        f.write(entry)
+    forget_line_index(path)
+    return current
 
 
-def fh_redo(session_dir, filename, path):
+def _fh_step(session_dir, filename, path, source, dest):
     key = _fh_key(session_dir, filename)
-    with _file_hist_lock:
+    with _session_lock(session_dir), _file_hist_lock:
         fh = _fh_get(key)
-        if not fh["future"]:
+        if not fh[source]:
             return False
+        entry = fh[source][-1]
         try:
-            with open(path, "rb") as f:
-                current = f.read()
-        except OSError:
+            inverse = _fh_restore(entry, path)
+        except (OSError, ValueError):
             return False
-        nxt = fh["future"].pop()
-        fh["past"].append(current)
-    with open(path, "wb") as f:
-        f.write(nxt)
+        fh[source].pop()
+        fh[dest].append(inverse)
     return True
 
 
+def fh_undo(session_dir, filename, path):
+    return _fh_step(session_dir, filename, path, "past", "future")
+
+
+def fh_redo(session_dir, filename, path):
+    return _fh_step(session_dir, filename, path, "future", "past")
+
+
 def fh_reset(session_dir):
     with _file_hist_lock:
         keys = [k for k in _file_histories if k.startswith(f"{session_dir}/")]
@@ -808,99 +1273,205 @@ def set_file_undo_limit():
         limit = max(1, int((request.json or {}).get('limit', 10)))
     except (TypeError, ValueError):
         return jsonify({"error": "Invalid limit"}), 400
-    config = get_config()
-    config['file_undo_limit'] = limit
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(config, f, indent=4)
+    update_config(file_undo_limit=limit)
     return jsonify({"status": "ok", "limit": limit})
 
 
 # ── History routes ─────────────────────────────────────────────────────────
+#
+# The pipeline undo ring (MAX_HISTORY states) is held in memory and served
+# from there.  Every change is recorded as one JSON line in HISTORY_JOURNAL:
+#
+#   {"op": "push", "state": [...]}                 new state, drops redo tail
+#   {"op": "seek", "pointer": N}                   undo / redo
+#   {"op": "snapshot", "states": [...], "pointer": N}
+#
+# Records are queued and written by a background thread in batches (one
+# write + fsync per batch).  Once the journal holds more than
+# HISTORY_COMPACT_AT records it is rewritten as a single snapshot record via
+# a temp file and os.replace, so a crash leaves either the old or the new
+# journal.  On startup the journal is replayed; a torn final line is dropped.
+
+HISTORY_JOURNAL    = os.path.join(HISTORY_DIR, 'journal.jsonl')
+HISTORY_FLUSH_SECS = 0.5
+HISTORY_COMPACT_AT = MAX_HISTORY * 4
+
+
+class _HistoryRing:
+    def __init__(self, journal_path: str, capacity: int):
+        self.path     = journal_path
+        self.capacity = capacity
+        self.states: list = []
+        self.pointer  = -1
+        self._records = 0          # records currently in the journal file
+        self._pending: list = []   # records not yet written
+        self._lock    = threading.Lock()   # guards states / pointer / pending
+        self._io_lock = threading.Lock()   # serialises journal writes
+        self._wake    = threading.Event()
+        self._writer  = None
+        self._load()
+
+    # -- state transitions (shared by live calls and journal replay) --------
+
+    def _apply(self, rec: dict):
+        op = rec.get("op")
+        if op == "push":
+            del self.states[self.pointer + 1:]
+            self.states.append(rec["state"])
+            if len(self.states) > self.capacity:
+                del self.states[:len(self.states) - self.capacity]
+            self.pointer = len(self.states) - 1
+        elif op == "seek":
+            self.pointer = max(-1, min(int(rec["pointer"]), len(self.states) - 1))
+        elif op == "snapshot":
+            self.states  = list(rec["states"])[-self.capacity:]
+            self.pointer = max(-1, min(int(rec["pointer"]), len(self.states) - 1))
+
+    def _record(self, rec: dict):
+        """Apply rec and queue it for the writer.  Caller holds self._lock."""
+        self._apply(rec)
+        self._pending.append(rec)
+        if self._writer is None:
+            self._writer = threading.Thread(target=self._write_loop, daemon=True)
+            self._writer.start()
+        self._wake.set()
+
+    # -- public API ----------------------------------------------------------
+
+    def push(self, state) -> dict:
+        with self._lock:
+            self._record({"op": "push", "state": state})
+            return self.status()
+
+    def step(self, delta: int):
+        """Move the pointer by delta; return {state, pointer, count}, or None at either end."""
+        with self._lock:
+            target = self.pointer + delta
+            if target < 0 or target >= len(self.states) or delta == 0:
+                return None
+            self._record({"op": "seek", "pointer": target})
+            return {"state": self.states[target], "pointer": target, "count": len(self.states)}
+
+    def status(self) -> dict:
+        return {
+            "can_undo": self.pointer > 0,
+            "can_redo": self.pointer < len(self.states) - 1,
+            "pointer":  self.pointer,
+            "count":    len(self.states),
+        }
 
-def read_history_meta():
-    if os.path.exists(HISTORY_META):
-        try:
-            with open(HISTORY_META, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, IOError):
-            pass
-    return {"pointer": -1, "count": 0}
-
-
-def write_history_meta(meta):
-    with open(HISTORY_META, 'w') as f:
-        json.dump(meta, f)
+    # -- persistence ---------------------------------------------------------
 
+    def _load(self):
+        if not os.path.exists(self.path):
+            self._migrate_legacy()
+            return
+        good_end = 0
+        try:
+            with open(self.path, 'rb') as f:
+                for raw in f:
+                    if not raw.endswith(b'\n'):
+                        break                      # torn write at crash time
+                    try:
+                        rec = json.loads(raw)
+                    except ValueError:
+                        break
+                    self._apply(rec)
+                    self._records += 1
+                    good_end += len(raw)
+            if good_end != os.path.getsize(self.path):
+                with open(self.path, 'r+b') as f:
+                    f.truncate(good_end)
+        except OSError as e:
+            print(f"[history] Failed to read journal: {e}")
 
-def history_path(index):
-    return os.path.join(HISTORY_DIR, f'session_{index:04d}.json')
+    def _migrate_legacy(self):
+        """Import the old meta.json + session_NNNN.json ring, if present."""
+        try:
+            with open(HISTORY_META, 'r') as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        pointer, count = meta.get("pointer", -1), meta.get("count", 0)
+        for absolute in range(max(0, pointer - count + 1), pointer + 1):
+            p = os.path.join(HISTORY_DIR, f'session_{absolute % MAX_HISTORY:04d}.json')
+            try:
+                with open(p, 'r') as f:
+                    self._apply({"op": "push", "state": json.load(f)})
+            except (OSError, json.JSONDecodeError):
+                continue
+        if self.states:
+            self._pending.append(self._snapshot_record())
+            self.flush()
+
+    def _snapshot_record(self) -> dict:
+        return {"op": "snapshot", "states": list(self.states), "pointer": self.pointer}
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait()
+            time.sleep(HISTORY_FLUSH_SECS)   # let a burst of edits coalesce
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self._io_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+                if not batch:
+                    return
+                compact = self._records + len(batch) > HISTORY_COMPACT_AT
+                if compact:
+                    batch = [self._snapshot_record()]
+            data = ''.join(json.dumps(rec, separators=(',', ':')) + '\n' for rec in batch)
+            try:
+                if compact:
+                    tmp = self.path + '.tmp'
+                    with open(tmp, 'w') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, self.path)
+                    self._records = 1
+                else:
+                    with open(self.path, 'a') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self._records += len(batch)
+            except OSError as e:
+                print(f"[history] Failed to write journal: {e}")
+
+
+_history = _HistoryRing(HISTORY_JOURNAL, MAX_HISTORY)
+atexit.register(_history.flush)
 
 
 @app.route('/history/push', methods=['POST'])
 def history_push():
-    meta        = read_history_meta()
-    new_pointer = meta["pointer"] + 1
-    file_index  = new_pointer % MAX_HISTORY
-
-    with open(history_path(file_index), 'w') as f:
-        json.dump(request.json, f, indent=4)
-
-    meta["pointer"] = new_pointer
-    meta["count"]   = min(new_pointer + 1, MAX_HISTORY)
-    write_history_meta(meta)
-    return jsonify({"status": "success", "pointer": new_pointer, "count": meta["count"]})
+    status = _history.push(request.json)
+    return jsonify({"status": "success", "pointer": status["pointer"], "count": status["count"]})
 
 
 @app.route('/history/undo', methods=['GET'])
 def history_undo():
-    meta    = read_history_meta()
-    pointer = meta["pointer"]
-    if pointer <= 0:
+    result = _history.step(-1)
+    if result is None:
         return jsonify({"error": "Nothing to undo", "at_start": True}), 400
-
-    target = pointer - 1
-    p      = history_path(target % MAX_HISTORY)
-    if not os.path.exists(p):
-        return jsonify({"error": "History file missing"}), 500
-
-    with open(p, 'r') as f:
-        state = json.load(f)
-
-    meta["pointer"] = target
-    write_history_meta(meta)
-    return jsonify({"state": state, "pointer": target, "count": meta["count"]})
+    return jsonify(result)
 
 
 @app.route('/history/redo', methods=['GET'])
 def history_redo():
-    meta    = read_history_meta()
-    pointer = meta["pointer"]
-    count   = meta["count"]
-    if pointer >= count - 1:
+    result = _history.step(1)
+    if result is None:
         return jsonify({"error": "Nothing to redo", "at_end": True}), 400
-
-    target = pointer + 1
-    p      = history_path(target % MAX_HISTORY)
-    if not os.path.exists(p):
-        return jsonify({"error": "History file missing"}), 500
-
-    with open(p, 'r') as f:
-        state = json.load(f)
-
-    meta["pointer"] = target
-    write_history_meta(meta)
-    return jsonify({"state": state, "pointer": target, "count": meta["count"]})
+    return jsonify(result)
 
 
 @app.route('/history/status', methods=['GET'])
 def history_status():
-    meta = read_history_meta()
-    return jsonify({
-        "can_undo": meta["pointer"] > 0,
-        "can_redo": meta["pointer"] < meta["count"] - 1,
-        "pointer":  meta["pointer"],
-        "count":    meta["count"],
-    })
+    return jsonify(_history.status())
 
 
 # ── Plugin routes ──────────────────────────────────────────────────────────
@@ -937,7 +1508,11 @@ def open_plugins_folder():
 
 @app.route('/list_plugins', methods=['GET'])
 def list_plugins():
-    plugins = get_plugins()
+    return conditional_json(f"plugins-{plugin_registry_version()}", _list_plugins)
+
+
+def _list_plugins():
+    plugins = plugin_catalog()
     result  = []
     for key, info in plugins.items():
         if info.get("_ui_hidden"):
@@ -954,8 +1529,9 @@ def list_plugins():
             "missing_deps": info["missing_deps"],
             "func_count":   info["func_count"],
             "args":         m.get("args", []),
+            "batch":        bool(m.get("batch")),
         })
-    return jsonify(result)
+    return result
 
 
 @app.route('/list_functions', methods=['GET'])
@@ -965,7 +1541,11 @@ def list_functions():
     Used by the "Add Processing Step" picker so users browse individual operations.
     Each entry includes a `module` key for filtering by session-enabled modules.
     """
-    plugins = get_plugins()
+    return conditional_json(f"functions-{plugin_registry_version()}", _list_functions)
+
+
+def _list_functions():
+    plugins = plugin_catalog()
     result  = []
     for key, info in plugins.items():
         if not info.get("_ui_hidden"):
@@ -983,13 +1563,245 @@ def list_functions():
             "missing_deps": info["missing_deps"],
             "func_count":   1,
             "args":         m.get("args", []),
+            "batch":        bool(m.get("batch")),
         })
-    return jsonify(result)
+    return result
+
+
+# ── Line-offset index ──────────────────────────────────────────────────────
+# One buffered binary pass records the byte offset of every
+# LINE_INDEX_STRIDE-th line start.  A range read seeks to the nearest indexed
+# line and reads forward, so serving lines [start, start + count) costs
+# O(count + stride) no matter how large the file is.  The same pass hashes
+# the content, which is the version token edits are checked against.  Indexes
+# are cached per path (LRU, LINE_INDEX_CACHE entries) and rebuilt when
+# (mtime, size) changes; every write made here drops the cached index too, so
+# an edit that keeps the size within one mtime tick is not missed.
+
+LINE_INDEX_STRIDE = 64
+LINE_INDEX_BLOCK  = 1024 * 1024
+LINE_INDEX_CACHE  = 16
+PREVIEW_MAX_LINES = 2000
+
+
+@dataclass
+class LineIndex:
+    version:     str            # hash of the content; changes whenever the file does
+    size:        int
+    total_lines: int
+    offsets:     array          # offsets[i] = byte offset of line i * LINE_INDEX_STRIDE
+    stamp:       str            # _file_version() when indexed
+    newline:     bytes = b'\n'  # b'\r' for files with old Mac (CR-only) line endings
+
+
+_line_indexes: collections.OrderedDict = collections.OrderedDict()
+_line_index_lock = threading.Lock()
+
+
+def _file_version(st: os.stat_result) -> str:
+    return f"{st.st_mtime_ns:x}-{st.st_size:x}"
+
+
+def _build_line_index(path: str, stamp: str) -> LineIndex:
+    digest = hashlib.blake2b(digest_size=12)
+    with open(path, 'rb') as f:
+        offsets, newlines, pos, last = _scan_lines(f, b'\n', digest)
+        newline = b'\n'
+        if not newlines and pos:
+            # No LF anywhere: split on CR, as universal newlines would
+            f.seek(0)
+            cr = _scan_lines(f, b'\r')
+            if cr[1]:
+                newline = b'\r'
+                offsets, newlines, pos, last = cr
+    total = newlines + (1 if pos and last != newline else 0)
+    return LineIndex(version=digest.hexdigest(), size=pos, total_lines=total, offsets=offsets, stamp=stamp,
+                     newline=newline)
+
+
+def _scan_lines(f, newline: bytes, digest=None) -> tuple:
+    """One pass over f: (stride offsets, newline count, size, last byte)."""
+    offsets  = array('Q', [0])
+    newlines = 0
+    pos      = 0
+    last     = b''
+    while True:
+        block = f.read(LINE_INDEX_BLOCK)
+        if not block:
+            break
+        if digest is not None:
+            digest.update(block)
+        parts = block.split(newline)
+        if len(parts) > 1:
+            # Offsets (relative to block) just past each newline, i.e. the
+            # starts of lines newlines+1, newlines+2, ...
+            starts = list(accumulate(map((1).__add__, map(len, parts[:-1]))))
+            first  = -(newlines + 1) % LINE_INDEX_STRIDE
+            offsets.extend(pos + s for s in starts[first::LINE_INDEX_STRIDE])
+            newlines += len(parts) - 1
+        pos += len(block)
+        last = block[-1:]
+    return offsets, newlines, pos, last
+
+
+def get_line_index(path: str) -> LineIndex:
+    """Return the cached line index for path, rebuilding it if the file changed."""
+    stamp = _file_version(os.stat(path))
+    with _line_index_lock:
+        idx = _line_indexes.get(path)
+        if idx is not None and idx.stamp == stamp:
+            _line_indexes.move_to_end(path)
+            return idx
+    idx = _build_line_index(path, stamp)
+    with _line_index_lock:
+        _line_indexes[path] = idx
+        _line_indexes.move_to_end(path)
+        while len(_line_indexes) > LINE_INDEX_CACHE:
+            _line_indexes.popitem(last=False)
+    return idx
+
+
+def forget_line_index(path: str) -> None:
+    """Drop path's cached index; call after writing the file."""
+    with _line_index_lock:
+        _line_indexes.pop(path, None)
+
+
+def _readline(f, newline: bytes) -> bytes:
+    """f.readline() for either line ending an index can have."""
+    if newline == b'\n':
+        return f.readline()
+    start, line = f.tell(), b''
+    while True:
+        chunk = f.read(io.DEFAULT_BUFFER_SIZE)
+        cut   = chunk.find(newline) + 1
+        if cut:
+            line += chunk[:cut]
+            f.seek(start + len(line))
+            return line
+        line += chunk
+        if not chunk:
+            return line
+
+
+def read_line_range(path: str, idx: LineIndex, start: int, count: int) -> list[str]:
+    """
+    Return decoded lines [start, start + count) with newlines preserved
+    (CR-only endings read back as "\n", as universal newlines did).
+    """
+    start = max(0, start)
+    slot  = start // LINE_INDEX_STRIDE
+    if count <= 0 or slot >= len(idx.offsets):
+        return []
+    lines = []
+    with open(path, 'rb') as f:
+        f.seek(idx.offsets[slot])
+        for _ in range(start - slot * LINE_INDEX_STRIDE):
+            if not _readline(f, idx.newline):
+                return []
+        for _ in range(count):
+            raw = _readline(f, idx.newline)
+            if not raw:
+                break
+            if idx.newline != b'\n' and raw.endswith(idx.newline):
+                raw = raw[:-1] + b'\n'
+            lines.append(raw.decode(TEXT_ENCODING, errors='replace'))
+    return lines
+
+
+def line_offset(path: str, idx: LineIndex, line: int) -> int:
+    """Byte offset at which line starts (idx.size for line >= total_lines)."""
+    if line >= idx.total_lines:
+        return idx.size
+    slot = line // LINE_INDEX_STRIDE
+    with open(path, 'rb') as f:
+        f.seek(idx.offsets[slot])
+        for _ in range(line - slot * LINE_INDEX_STRIDE):
+            _readline(f, idx.newline)
+        return f.tell()
+
+
+def _copy_range(src, dst, start: int, end):
+    src.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        block = src.read(LINE_INDEX_BLOCK if remaining is None else min(LINE_INDEX_BLOCK, remaining))
+        if not block:
+            break
+        dst.write(block)
+        if remaining is not None:
+            remaining -= len(block)
+
+
+def _splice_file(path: str, edits: list):
+    """Replace byte ranges [(start, end, data)] (sorted, non-overlapping) in path."""
+    if all(end - start == len(data) for start, end, data in edits):
+        with open(path, 'r+b') as f:
+            for start, _, data in edits:
+                f.seek(start)
+                f.write(data)
+    else:
+        tmp = path + '.tmp'
+        with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+            pos = 0
+            for start, end, data in edits:
+                _copy_range(src, dst, pos, start)
+                dst.write(data)
+                pos = end
+            _copy_range(src, dst, pos, None)
+        os.replace(tmp, path)
+    forget_line_index(path)
+
+
+def apply_line_patches(path: str, patches: list) -> list:
+    """
+    Apply [(start, delete, insert_bytes)] to path: lines [start, start + delete)
+    are replaced by insert_bytes.  Line numbers refer to the file before any
+    patch is applied and ranges must not overlap.  Only the touched byte ranges
+    are read; equal-length edits are written in place.  Inserted "\n" endings
+    become "\r" in a CR-only file, matching what the preview shows.
+
+    Returns the reverse patches (against the patched file) that restore it.
+    """
+    idx      = get_line_index(path)
+    edits    = []
+    reverse  = []
+    shift    = 0
+    prev_end = 0
+    with open(path, 'rb') as f:
+        for start, delete, insert in sorted(patches, key=lambda p: p[0]):
+            insert = insert.replace(b'\n', idx.newline)
+            end = min(start + delete, idx.total_lines)
+            if start < prev_end or start > idx.total_lines or delete < 0:
+                raise ValueError(f"patch at line {start} is out of range or overlaps")
+            if insert and end < idx.total_lines and not insert.endswith(idx.newline):
+                raise ValueError(f"patch at line {start}: inserted text must end with a newline")
+            a = line_offset(path, idx, start)
+            b = line_offset(path, idx, end)
+            if insert and a == b == idx.size and a > 0:
+                f.seek(a - 1)
+                if f.read(1) != idx.newline:
+                    raise ValueError("cannot append after an unterminated last line; replace it instead")
+            f.seek(a)
+            old = f.read(b - a)
+            new_lines = insert.count(idx.newline) + (1 if insert and not insert.endswith(idx.newline) else 0)
+            edits.append((a, b, insert))
+            reverse.append((start + shift, new_lines, old))
+            shift   += new_lines - (end - start)
+            prev_end = end
+    _splice_file(path, edits)
+    return reverse
 
 
 @app.route('/preview_file', methods=['GET'])
 def preview_file():
-    """Return file contents for the in-app preview panel (text) or metadata (binary)."""
+    """
+    Return file contents for the in-app preview panel (text) or metadata (binary).
+
+    GET /preview_file?session_dir=…&filename=…&start=0&count=2000
+    Text responses carry total_lines and a version token; the UI pages through
+    large files by requesting further ranges.  full=1 returns the whole file.
+    """
     session_dir = os.path.basename(request.args.get('session_dir', ''))
     filename    = request.args.get('filename', '')
     workspace   = get_config()['workspace']
@@ -997,53 +1809,71 @@ def preview_file():
     if not os.path.exists(path):
         return jsonify({"error": "File not found"}), 404
 
-    mime, _ = mimetypes.guess_type(path)
-    mime = mime or "application/octet-stream"
+    mime = guess_mime(path)
     is_text = (
         mime.startswith("text/")
         or mime in ("application/json", "application/xml", "application/javascript")
     )
 
-    MAX_LINES = 2000
-    full = request.args.get('full') == '1'
-    if is_text:
-        try:
-            with open(path, "r", errors="replace", newline="") as f:
-                lines = f.readlines()
-            truncated = len(lines) > MAX_LINES
-            return jsonify({
-                "type":        "text",
-                "content":     "".join(lines if full else lines[:MAX_LINES]),
-                "total_lines": len(lines),
-                "truncated":   truncated and not full,
-                "mime_type":   mime,
-            })
-        except OSError as e:
-            return jsonify({"error": str(e)}), 500
-    else:
+    if not is_text:
         return jsonify({
             "type":      "binary",
             "mime_type": mime,
             "size":      os.path.getsize(path),
         })
 
+    full = request.args.get('full') == '1'
+    try:
+        start = max(0, int(request.args.get('start', 0)))
+        count = min(PREVIEW_MAX_LINES, max(0, int(request.args.get('count', PREVIEW_MAX_LINES))))
+    except ValueError:
+        return jsonify({"error": "Invalid start or count"}), 400
+    try:
+        idx = get_line_index(path)
+        if full:
+            start, count = 0, idx.total_lines
+        lines = read_line_range(path, idx, start, count)
+    except OSError as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "type":        "text",
+        "content":     "".join(lines),
+        "start":       start,
+        "count":       len(lines),
+        "total_lines": idx.total_lines,
+        "truncated":   start + len(lines) < idx.total_lines,
+        "mime_type":   mime,
+        "version":     idx.version,
+    })
+
 
 @app.route('/update_file', methods=['POST'])
 def update_file():
-    """Replace a session text file, recording the previous contents for undo."""
+    """
+    Edit a session text file, recording the change for undo.
+
+    Patch mode (preferred):
+      { session_dir, filename, version, patches: [{start, delete, insert}] }
+      version is the token from /preview_file; a stale token gets 409 with the
+      current version.  Only the touched lines are rewritten and the reverse
+      patch is kept as the undo entry.
+    Full mode:
+      { session_dir, filename, content }   replaces the whole file.
+    Both return { status, version }.
+    """
     data = request.json or {}
     session_dir = os.path.basename(data.get('session_dir', '').strip())
     filename = os.path.basename(data.get('filename', '').strip())
     content = data.get('content')
-    if not session_dir or not filename or not isinstance(content, str):
-        return jsonify({"error": "Missing session_dir, filename, or content"}), 400
+    patches = data.get('patches')
+    if not session_dir or not filename or not (isinstance(content, str) or isinstance(patches, list)):
+        return jsonify({"error": "Missing session_dir, filename, or content/patches"}), 400
 
     path = os.path.join(get_config()['workspace'], session_dir, filename)
     if not os.path.isfile(path):
         return jsonify({"error": "File not found"}), 404
 
-    mime, _ = mimetypes.guess_type(path)
-    mime = mime or "application/octet-stream"
+    mime = guess_mime(path)
     is_text = (
         mime.startswith("text/")
         or mime in ("application/json", "application/xml", "application/javascript")
@@ -1051,16 +1881,44 @@ def update_file():
     if not is_text:
         return jsonify({"error": "Binary files cannot be edited as text"}), 415
 
+    if isinstance(patches, list):
+        try:
+            parsed = [
+                (int(p['start']), int(p.get('delete', 0)),
+                 str(p.get('insert', '')).encode(TEXT_ENCODING, errors='replace'))
+                for p in patches
+            ]
+        except (KeyError, TypeError, ValueError, AttributeError):
+            return jsonify({"error": "Malformed patches"}), 400
+        with _session_lock(session_dir):
+            current = get_line_index(path).version
+            if data.get('version') != current:
+                return jsonify({"error": "File changed since it was loaded", "version": current}), 409
+            parsed = [p for p in parsed if p[1] or p[2]]
+            if parsed:
+                try:
+                    reverse = apply_line_patches(path, parsed)
+                except ValueError as e:
+                    return jsonify({"error": str(e)}), 400
+                except OSError as e:
+                    return jsonify({"error": str(e)}), 500
+                fh_push_patch(session_dir, filename, reverse)
+                _session_index.record(session_dir, filename, os.path.getsize(path))
+            return jsonify({"status": "ok", "version": get_line_index(path).version})
+
     try:
-        with open(path, "r", errors="replace", newline="") as f:
-            current = f.read()
-        if current != content:
-            fh_push_snapshot(session_dir, filename, path)
-            with open(path, "w", newline="") as f:
-                f.write(content)
+        with _session_lock(session_dir):
+            with open(path, "r", errors="replace", newline="") as f:
+                current = f.read()
+            if current != content:
+                fh_push_snapshot(session_dir, filename, path)
+                with open(path, "w", newline="") as f:
+                    f.write(content)
+                forget_line_index(path)
+                _session_index.record(session_dir, filename, os.path.getsize(path))
     except OSError as e:
         return jsonify({"error": str(e)}), 500
-    return jsonify({"status": "ok"})
+    return jsonify({"status": "ok", "version": get_line_index(path).version})
 
 
 @app.route('/settings_info', methods=['GET'])
@@ -1076,20 +1934,118 @@ def settings_info():
         "plugin_dir":      PLUGIN_DIR,
         "plugin_count":    plugin_count,
         "file_undo_limit": int(cfg.get('file_undo_limit', 10)),
+        "run_deadline_secs": float(cfg.get('run_deadline_secs', 0)),
+        **_plugin_limits(cfg),
     })
 
 
 # ── Execution route ────────────────────────────────────────────────────────
+#
+# Steps run in sandboxed worker processes (pipeline.PluginSandbox) with the
+# per-step limits from config_info.json; "plugin_sandbox": false runs them
+# inline in the server as before.  The sandbox is rebuilt when limits change.
+# With it on, plugin code never runs in the server: runs are checked against
+# the catalog (validate_steps), and new or changed plugin files are scanned
+# for the catalog by a sandbox worker.
+
+_sandbox_lock  = threading.Lock()
+_sandbox_state = {"key": None, "sandbox": None}
+
+
+def _plugin_limits(cfg: dict) -> dict:
+    return {
+        "plugin_sandbox":   bool(cfg.get('plugin_sandbox', True)),
+        "plugin_workers":   int(cfg.get('plugin_workers', SANDBOX_WORKERS)),
+        "plugin_step_secs": float(cfg.get('plugin_step_secs', SANDBOX_STEP_SECS)),
+        "plugin_memory_mb": int(cfg.get('plugin_memory_mb', SANDBOX_MEMORY_MB)),
+    }
+
+
+def _plugin_sandbox():
+    """The sandbox for the current limits, or None when sandboxing is off."""
+    limits = _plugin_limits(get_config())
+    key    = tuple(limits.values())
+    with _sandbox_lock:
+        if _sandbox_state["key"] != key:
+            if _sandbox_state["sandbox"]:
+                _sandbox_state["sandbox"].close()
+            _sandbox_state["key"]     = key
+            _sandbox_state["sandbox"] = PluginSandbox(
+                limits["plugin_workers"], limits["plugin_step_secs"], limits["plugin_memory_mb"],
+            ) if limits["plugin_sandbox"] else None
+        return _sandbox_state["sandbox"]
+
+
+def _scan_plugin(filename: str):
+    """The registry's scanner: filename's entries from a sandbox worker, or None to import it here."""
+    sandbox = _plugin_sandbox()
+    return sandbox.manifest(filename) if sandbox else None
+
+
+def _reset_sandbox() -> None:
+    """Replace the sandbox's workers, so the next run re-imports every plugin."""
+    with _sandbox_lock:
+        if _sandbox_state["sandbox"]:
+            _sandbox_state["sandbox"].close()
+        _sandbox_state["key"], _sandbox_state["sandbox"] = None, None
+
+
+_active_runs_lock = threading.Lock()
+_active_runs: dict = {}     # run_id -> {CancelToken} for /execute calls in progress
+
+
+@app.route('/cancel', methods=['POST'])
+def cancel_run():
+    """POST {"run_id"}: ask a running /execute to stop at its next check."""
+    run_id = str((request.json or {}).get('run_id') or '')
+    with _active_runs_lock:
+        tokens = list(_active_runs.get(run_id, ()))
+    if not tokens:
+        return jsonify({"error": f"No run in progress with id '{run_id}'"}), 404
+    for token in tokens:
+        token.cancel()
+    _events.publish("job", run_id, status="cancelling")
+    return jsonify({"status": "cancelling", "run_id": run_id})
+
+
+@atexit.register
+def _close_sandbox():
+    if _sandbox_state["sandbox"]:
+        _sandbox_state["sandbox"].close()
+
+
+@app.route('/set_plugin_limits', methods=['POST'])
+def set_plugin_limits():
+    """POST any of {plugin_sandbox, plugin_workers, plugin_step_secs, plugin_memory_mb}."""
+    body = request.json or {}
+    try:
+        limits = _plugin_limits({**get_config(), **{k: v for k, v in body.items() if k in _plugin_limits({})}})
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid limit"}), 400
+    if limits["plugin_workers"] < 1 or limits["plugin_step_secs"] < 0 or limits["plugin_memory_mb"] < 0:
+        return jsonify({"error": "Limits must be positive (0 turns a limit off)"}), 400
+    update_config(**limits)
+    return jsonify({"status": "ok", **limits})
+
 
 @app.route('/execute', methods=['POST'])
 def execute_scripts():
     """
-    POST { "filename": "part.gcode", "scripts": [{"pluginKey": "..."}, ...] }
+    POST { "filename": "part.gcode", "scripts": [{"pluginKey": "..."}, ...],
+           "run_id": "optional-client-id", "deadline_secs": 0 }
+
+    Progress is published on the event bus under the run id ("job" status and
+    per-step "step" events), so clients can follow it on /events?run=<id>.
+    POST /cancel {"run_id"} stops the run at its next check; so does passing
+    deadline_secs (default: run_deadline_secs in the config, 0 = none).  A
+    cancelled run answers 409 (504 for a deadline) and writes nothing: the
+    file and its undo history stay as they were.
 
     Pipeline:
       1. Load file → Payload
       2. For each active step: call plugin(payload) → new payload
-      3. Write final payload back to the same file
+      3. Write final payload back to the same file; a closing fork writes each
+         branch's result to its own file in the session instead
 
     Errors in individual steps are caught; execution halts at the first failure
     and reports which steps completed successfully before the crash.
@@ -1098,6 +2054,9 @@ def execute_scripts():
     filename    = data.get('filename')
     session_dir = os.path.basename(data.get('session_dir', ''))
     scripts     = data.get('scripts', [])
+    run_id      = str(data.get('run_id') or '')
+    if not RUN_ID_RE.fullmatch(run_id):
+        run_id = os.urandom(8).hex()
 
     workspace   = get_config()['workspace']
     target_path = (
@@ -1108,74 +2067,322 @@ def execute_scripts():
     if not os.path.exists(target_path):
         return jsonify({"error": f"File not found in workspace: {filename}"}), 404
 
-    plugins = get_plugins()
-
     # Pre-flight: validate all keys and check deps before touching the file
-    active_steps = []
-    for step in scripts:
-        key = step.get('pluginKey')
-        if key not in plugins:
-            return jsonify({"error": f"Unknown plugin: '{key}'"}), 400
-        info = plugins[key]
-        if not info["deps_ok"]:
-            return jsonify({
-                "error":        f"Plugin '{key}' has unsatisfied dependencies.",
-                "missing_deps": info["missing_deps"],
-            }), 400
-        active_steps.append((key, info["funcs"], info["meta"], step.get('args', {})))
+    try:
+        active_steps = validate_steps(scripts)
+    except StepError as e:
+        return jsonify(e.report()), e.status
+
+    cancel = _cancel_token(data)
+    if cancel is None:
+        return jsonify({"error": "Invalid deadline_secs"}), 400
+
+    _events.publish("job", run_id, status="running", filename=filename,
+                    session_dir=session_dir, steps=len(active_steps))
+    track_step, finish = _run_metrics(_preset_label(data))
+    started = time.perf_counter()
+    with _tracked_run(run_id, cancel):
+        body, code = _execute_steps(run_id, filename, session_dir, target_path, scripts, active_steps,
+                                    cancel, track_step)
+    status = "cancelled" if body.get("cancelled") else "failed" if "error" in body else "success"
+    finish(status, time.perf_counter() - started, body.get("bytes", 0))
+    _events.publish("job", run_id, status=status, filename=filename, error=body.get("error"),
+                    duration_ms=body.get("duration_ms"))
+    return jsonify(body), code
+
+
+def _cancel_token(data: dict):
+    """The run's CancelToken, with deadline_secs from the request or config; None if invalid."""
+    try:
+        deadline_secs = float(data.get('deadline_secs') or get_config().get('run_deadline_secs', 0))
+    except (TypeError, ValueError):
+        return None
+    return CancelToken(max(0.0, deadline_secs))
+
 
+@contextmanager
+def _tracked_run(run_id, cancel):
+    """Tag logs with run_id and make the run cancellable through /cancel while it lasts."""
+    _run_context.run_id = run_id
+    with _active_runs_lock:
+        _active_runs.setdefault(run_id, set()).add(cancel)
     try:
-        payload  = payload_from_file(target_path)
-        step_log = []
-
-        for key, funcs, meta, step_args in active_steps:
-            accepted = meta.get("accepts", [])
-            if accepted and payload.mime_type not in accepted:
-                step_log.append({
-                    "step":    key,
-                    "warning": (
-                        f"type mismatch — plugin accepts {accepted}, "
-                        f"payload is '{payload.mime_type}'"
-                    ),
-                })
+        yield
+    finally:
+        _run_context.run_id = None
+        with _active_runs_lock:
+            tokens = _active_runs.get(run_id, set())
+            tokens.discard(cancel)
+            if not tokens:
+                _active_runs.pop(run_id, None)
+
+
+def _execute_steps(run_id, filename, session_dir, target_path, scripts, active_steps, cancel, track_step):
+    """Run validated steps against target_path; returns (response body, status)."""
+    try:
+        started  = time.perf_counter()
+        in_bytes = os.path.getsize(target_path)
 
-            for fn in funcs:
-                try:
-                    # Resolve which of the step's args this fn accepts
-                    sig        = getattr(fn, '_orig_sig', None) or inspect.signature(fn)
-                    fn_params  = dict(list(sig.parameters.items())[1:])  # skip first param
-                    fn_kwargs  = {
-                        k: _coerce_arg(v, fn_params[k].default)
-                        for k, v in step_args.items()
-                        if k in fn_params and fn_params[k].default is not inspect.Parameter.empty
-                    }
-                    payload = fn(payload, **fn_kwargs)
-                except ValueError as e:
-                    return jsonify({
-                        "error":     f"Step '{key}' → '{fn.__name__}': bad input — {e}",
-                        "completed": [s["step"] for s in step_log if "warning" not in s],
-                    }), 400
-                except Exception as e:
-                    return jsonify({
-                        "error":     f"Step '{key}' → '{fn.__name__}': {type(e).__name__}: {e}",
-                        "trace":     traceback.format_exc(),
-                        "completed": [s["step"] for s in step_log if "warning" not in s],
-                    }), 500
-
-            step_log.append({"step": key, "status": "ok"})
-
-        fh_push_snapshot(session_dir, filename, target_path)
-        payload_to_file(payload, target_path)
+        def on_step(ev):
+            track_step(ev)
+            _events.publish("step", run_id, filename=filename, **ev)
 
-        return jsonify({
-            "status":    "success",
-            "message":   f"Processed {len(active_steps)} step(s) on '{filename}'.",
-            "steps":     step_log,
-            "mime_type": payload.mime_type,
-        })
+        sandbox  = _plugin_sandbox()
+        if sandbox:
+            payload, step_log, outputs = sandbox.run(target_path, scripts, on_step, cancel)
+        else:
+            payload, step_log, outputs = run_steps(payload_from_file(target_path), resolve_steps(scripts),
+                                                   on_step, cancel=cancel)
+        cancel.check(completed=[s["step"] for s in step_log if "warning" not in s])   # last chance; nothing written yet
 
+        changed, written = _write_outputs(session_dir, filename, target_path, payload, outputs)
+        return {
+            "status":      "success",
+            "message":     f"Processed {len(active_steps)} step(s) on '{filename}'.",
+            "steps":       step_log,
+            "mime_type":   payload.mime_type if payload is not None else None,
+            "outputs":     written,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "bytes":       in_bytes,
+            "changed":     changed,
+            "run_id":      run_id,
+        }, 200
+
+    except StepError as e:
+        return e.report(), e.status
     except Exception as e:
-        return jsonify({"error": str(e), "trace": traceback.format_exc()}), 500
+        return {"error": str(e), "trace": traceback.format_exc()}, 500
+
+
+@app.route('/execute_batch', methods=['POST'])
+def execute_batch():
+    """
+    POST { "filenames": ["a.gcode", "b.gcode"], "session_dir": "...", "scripts": [...],
+           "run_id": "optional-client-id", "deadline_secs": 0 }
+
+    Runs the pipeline over the files as one batch (pipeline.run_batch): batch
+    steps get every file in one call, the other steps run file by file as on
+    /execute.  Each file's result is written as /execute writes it, and
+    "results" holds one entry per file, with "error" for files that failed.
+    Step events carry the file they belong to; a batch step's have none.
+    Cancelling stops the whole batch and writes nothing.
+    """
+    data        = request.json or {}
+    session_dir = os.path.basename(data.get('session_dir', ''))
+    filenames   = [os.path.basename(str(name)) for name in data.get('filenames') or []]
+    scripts     = data.get('scripts', [])
+    run_id      = str(data.get('run_id') or '')
+    if not RUN_ID_RE.fullmatch(run_id):
+        run_id = os.urandom(8).hex()
+
+    workspace = get_config()['workspace']
+    folder    = os.path.join(workspace, session_dir) if session_dir else workspace
+    missing   = [name for name in filenames if not os.path.exists(os.path.join(folder, name))]
+    if not filenames or missing:
+        return jsonify({"error": f"File not found in workspace: {', '.join(missing) or '(none given)'}"}), 404
+
+    try:
+        active_steps = validate_steps(scripts)
+    except StepError as e:
+        return jsonify(e.report()), e.status
+    cancel = _cancel_token(data)
+    if cancel is None:
+        return jsonify({"error": "Invalid deadline_secs"}), 400
+
+    _events.publish("job", run_id, status="running", filenames=filenames,
+                    session_dir=session_dir, steps=len(active_steps))
+    track_step, finish = _run_metrics(_preset_label(data))
+    started = time.perf_counter()
+    with _tracked_run(run_id, cancel):
+        body, code = _execute_batch(run_id, filenames, session_dir, folder, scripts, active_steps,
+                                    cancel, track_step)
+    status = ("cancelled" if body.get("cancelled") else
+              "failed" if "error" in body or body.get("failures") else "success")
+    finish(status, time.perf_counter() - started, body.get("bytes", 0))
+    _events.publish("job", run_id, status=status, filenames=filenames, error=body.get("error"),
+                    duration_ms=body.get("duration_ms"))
+    return jsonify(body), code
+
+
+def _execute_batch(run_id, filenames, session_dir, folder, scripts, active_steps, cancel, track_step):
+    """Run validated steps over the files as one batch; returns (response body, status)."""
+    try:
+        started  = time.perf_counter()
+        paths    = [os.path.join(folder, name) for name in filenames]
+        in_bytes = sum(os.path.getsize(path) for path in paths)
+
+        def on_step(ev):
+            track_step(ev)
+            item = ev.pop("item", None)
+            _events.publish("step", run_id, filename=filenames[item] if item is not None else None, **ev)
+
+        sandbox = _plugin_sandbox()
+        if sandbox:
+            items = sandbox.run_batch(paths, scripts, on_step, cancel)
+        else:
+            items = run_batch([payload_from_file(path) for path in paths], resolve_steps(scripts), on_step,
+                              cancel=cancel)
+        cancel.check()      # last chance; nothing written yet
+
+        results = []
+        for name, path, item in zip(filenames, paths, items):
+            if isinstance(item, StepError):
+                results.append({"filename": name, **item.report()})
+                continue
+            payload, step_log, outputs = item
+            try:
+                changed, written = _write_outputs(session_dir, name, path, payload, outputs)
+            except StepError as e:
+                results.append({"filename": name, **e.report()})
+                continue
+            results.append({
+                "filename":  name,
+                "status":    "success",
+                "steps":     step_log,
+                "mime_type": payload.mime_type if payload is not None else None,
+                "outputs":   written,
+                "changed":   changed,
+            })
+
+        failures = sum("error" in r for r in results)
+        return {
+            "status":      "success",
+            "message":     f"Processed {len(active_steps)} step(s) on {len(filenames) - failures}/{len(filenames)} file(s).",
+            "results":     results,
+            "failures":    failures,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+            "bytes":       in_bytes,
+            "run_id":      run_id,
+        }, 200
+
+    except StepError as e:
+        return e.report(), e.status
+    except Exception as e:
+        return {"error": str(e), "trace": traceback.format_exc()}, 500
+
+
+def _write_outputs(session_dir, filename, target_path, payload, outputs) -> tuple:
+    """Write a run's result over target_path and its branch outputs beside it; returns (changed, outputs)."""
+    names = [branch_output_name(filename, branch, output) for branch, output, _ in outputs]
+    changed = payload is not None and not payload_unchanged(payload, target_path)
+    if changed:
+        _write_result(session_dir, filename, target_path, payload)
+
+    written = []
+    for out_name, (branch, _, result) in zip(names, outputs):
+        out_path = os.path.join(os.path.dirname(target_path), out_name)
+        if not payload_unchanged(result, out_path):
+            _write_result(session_dir, out_name, out_path, result)
+        written.append({"branch": branch, "filename": out_name, "mime_type": result.mime_type})
+    return changed, written
+
+
+def _write_result(session_dir, filename, path, payload):
+    """Write a run's payload to path, keeping undo history and the session listing current."""
+    with _session_lock(session_dir):
+        fh_push_snapshot(session_dir, filename, path)
+        payload_to_file(payload, path)
+        forget_line_index(path)
+        if session_dir:
+            record_session_file(os.path.dirname(path), session_dir, filename)
+            _session_index.record(session_dir, filename, os.path.getsize(path))
+
+
+@app.route('/sweep', methods=['POST'])
+def sweep_scripts():
+    """
+    POST { "filename": "part.gcode", "session_dir": "...", "scripts": [...],
+           "sweep": {"inject_laser_power_on_z_moves": {"power": [0.2, 0.5, 0.8]}},
+           "mode": "grid" | "list", "jobs": 0, "run_id": "optional-client-id", "deadline_secs": 0 }
+
+    Runs the pipeline once per combination (see pipeline.expand_sweep), writing
+    <stem>__<label><ext> per run and <stem>__sweep.csv into the session.  The
+    input file is left as it is.  Returns the summary rows.  Runs go through
+    the plugin sandbox when it is on, jobs at most one per sandbox worker.
+    POST /cancel with the run_id stops the sweep (409; 504 for a deadline).
+    Outputs are staged and only moved into the session (each with an undo
+    snapshot, as /execute takes) once the sweep has finished, so a sweep
+    that is cancelled or fails writes nothing.
+    """
+    data        = request.json
+    filename    = os.path.basename(data.get('filename') or '')
+    session_dir = os.path.basename(data.get('session_dir', ''))
+    workspace   = get_config()['workspace']
+    folder      = os.path.join(workspace, session_dir) if session_dir else workspace
+    target_path = os.path.join(folder, filename)
+    if not filename or not os.path.exists(target_path):
+        return jsonify({"error": f"File not found in workspace: {filename}"}), 404
+
+    try:
+        validate_steps(data.get('scripts', []))
+        prefix, columns, runs = expand_sweep(data.get('scripts', []), data.get('sweep'),
+                                             data.get('mode') or "grid", plugin_catalog())
+    except StepError as e:
+        return jsonify(e.report()), e.status
+
+    try:
+        jobs = int(data.get('jobs') or 0)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid jobs"}), 400
+    cancel = _cancel_token(data)
+    if cancel is None:
+        return jsonify({"error": "Invalid deadline_secs"}), 400
+    run_id = str(data.get('run_id') or '')
+    if not RUN_ID_RE.fullmatch(run_id):
+        run_id = os.urandom(8).hex()
+
+    started = time.perf_counter()
+    preset  = _preset_label(data)
+    _events.publish("job", run_id, status="running", filename=filename,
+                    session_dir=session_dir, sweep_runs=len(runs))
+    staging = tempfile.mkdtemp(prefix='.sweep-', dir=folder)
+    try:
+        with _tracked_run(run_id, cancel):
+            rows = run_sweep(target_path, staging, prefix, runs, jobs, _plugin_sandbox(), cancel)
+        with _session_lock(session_dir):
+            for name in [r["output"] for r in rows if r["status"] == "ok"]:
+                fh_push_snapshot(session_dir, name, os.path.join(folder, name))
+                os.replace(os.path.join(staging, name), os.path.join(folder, name))
+    except StepError as e:
+        report = {**e.report(), "run_id": run_id}
+        status = "cancelled" if report.get("cancelled") else "failed"
+        for _ in runs:              # not every combination ran; none is counted as a success
+            _run_metrics(preset)[1](status, None, 0)
+        _events.publish("job", run_id, status=status, filename=filename, error=str(e))
+        return jsonify(report), e.status
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+    # Each combination counts as one run; steps run in sweep workers are not timed per step.
+    size = os.path.getsize(target_path)
+    for row in rows:
+        ok = row["status"] == "ok"
+        _run_metrics(preset)[1]("success" if ok else "failed", row["duration_ms"] / 1000 if ok else None,
+                                size if ok else 0)
+
+    summary = sweep_summary_name(filename)
+    write_sweep_summary(rows, columns, os.path.join(folder, summary))
+    for name in [r["output"] for r in rows if r["status"] == "ok"] + [summary]:
+        forget_line_index(os.path.join(folder, name))
+    if session_dir:
+        for name in [r["output"] for r in rows if r["status"] == "ok"] + [summary]:
+            record_session_file(folder, session_dir, name)
+            _session_index.record(session_dir, name, os.path.getsize(os.path.join(folder, name)))
+
+    failed = sum(r["status"] != "ok" for r in rows)
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)
+    _events.publish("job", run_id, status="failed" if failed else "success", filename=filename,
+                    duration_ms=duration_ms)
+    return jsonify({
+        "status":      "success" if not failed else "partial",
+        "message":     f"Swept {len(runs)} combination(s) on '{filename}'"
+                       + (f"; {failed} failed." if failed else "."),
+        "columns":     columns,
+        "runs":        rows,
+        "summary":     summary,
+        "duration_ms": duration_ms,
+        "run_id":      run_id,
+    })
 
 
 # ── AI plugin generation ───────────────────────────────────────────────────
@@ -1277,11 +2484,198 @@ def save_plugin():
     dest = os.path.join(PLUGIN_DIR, filename)
     with open(dest, 'w', encoding='utf-8') as f:
         f.write(code)
+    _plugin_registry.invalidate()
     return jsonify({"status": "ok", "filename": filename})
 
 
+@app.route('/reload_plugins', methods=['POST'])
+def reload_plugins():
+    """Re-import every plugin, e.g. after installing a package one of them requires."""
+    _reset_sandbox()
+    plugins = _plugin_registry.reload()
+    return jsonify({"status": "ok", "plugins": sum(1 for p in plugins.values() if not p["_ui_hidden"])})
+
+
+# ── Streaming ZIP ─────────────────────────────────────────────────────────
+# Minimal ZIP writer that yields bytes as entries are produced, so a batch
+# download starts immediately and never holds the archive in memory.
+#
+# Serial mode compresses each file on the fly and writes sizes/CRC in a data
+# descriptor after the entry.  Parallel mode compresses upcoming files on a
+# thread pool (zlib releases the GIL) into spooled temp files while the
+# current entry is being sent; those entries carry their sizes up front.
+# ZIP64 records are written only when sizes, offsets or entry counts need them.
+
+ZIP_BLOCK       = 1024 * 1024
+ZIP_SPOOL_BYTES = 8 * 1024 * 1024
+ZIP_MAX_WORKERS = min(4, os.cpu_count() or 1)
+ZIP64_LIMIT     = 0xFFFFFFFF
+ZIP_UTF8_FLAG   = 0x0800
+ZIP_DESCRIPTOR  = 0x0008
+
+
+def _dos_datetime(ts: float) -> tuple[int, int]:
+    t = time.localtime(ts)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((max(1980, t.tm_year) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+def _compress_stream(path: str, level):
+    """Yield (compressed_block, raw_len, crc) for a file; level None means store."""
+    comp = zlib.compressobj(level, zlib.DEFLATED, -15) if level is not None else None
+    crc  = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(ZIP_BLOCK)
+            if not block:
+                break
+            crc = zlib.crc32(block, crc)
+            yield (comp.compress(block) if comp else block), len(block), crc
+    if comp:
+        yield comp.flush(), 0, crc
+
+
+def _compress_to_spool(path: str, level):
+    """Compress a whole file into a spooled temp file; return (spool, crc, csize, usize)."""
+    spool = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_BYTES)
+    crc = csize = usize = 0
+    for data, raw_len, crc in _compress_stream(path, level):
+        spool.write(data)
+        csize += len(data)
+        usize += raw_len
+    spool.seek(0)
+    return spool, crc, csize, usize
+
+
+def _z32(value: int) -> int:
+    """32-bit field value, or the 0xFFFFFFFF marker when ZIP64 holds the real one."""
+    return 0xFFFFFFFF if value >= ZIP64_LIMIT else value
+
+
+class _ZipStream:
+    def __init__(self):
+        self.offset  = 0
+        self.central = []
+
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+
+    def _local_header(self, name: bytes, method: int, dostime: tuple, flags: int,
+                      crc: int, csize: int, usize: int, zip64: bool) -> bytes:
+        extra = struct.pack('<HHQQ', 1, 16, usize, csize) if zip64 else b''
+        if zip64:
+            csize = usize = 0xFFFFFFFF
+        return struct.pack('<IHHHHHIIIHH', 0x04034B50, 45 if zip64 else 20, flags, method,
+                           dostime[0], dostime[1], crc, csize, usize, len(name), len(extra)) \
+            + name + extra
+
+    def stream_entry(self, arcname: str, path: str, level):
+        """Yield one entry, compressing as it goes (sizes go in a data descriptor)."""
+        st     = os.stat(path)
+        name   = arcname.encode('utf-8')
+        method = zlib.DEFLATED if level is not None else 0
+        zip64  = st.st_size >= ZIP64_LIMIT - ZIP_BLOCK
+        flags  = ZIP_UTF8_FLAG | ZIP_DESCRIPTOR
+        dt     = _dos_datetime(st.st_mtime)
+        start  = self.offset
+        yield self._emit(self._local_header(name, method, dt, flags, 0, 0, 0, zip64))
+        crc = csize = usize = 0
+        for data, raw_len, crc in _compress_stream(path, level):
+            usize += raw_len
+            csize += len(data)
+            if data:
+                yield self._emit(data)
+        fmt = '<IIQQ' if zip64 else '<IIII'
+        yield self._emit(struct.pack(fmt, 0x08074B50, crc, csize, usize))
+        self.central.append((name, method, dt, flags, crc, csize, usize, start))
+
+    def spooled_entry(self, arcname: str, path: str, level, spool, crc, csize, usize):
+        """Yield one entry whose compressed bytes are already in spool."""
+        name   = arcname.encode('utf-8')
+        method = zlib.DEFLATED if level is not None else 0
+        zip64  = csize >= ZIP64_LIMIT or usize >= ZIP64_LIMIT
+        dt     = _dos_datetime(os.stat(path).st_mtime)
+        start  = self.offset
+        yield self._emit(self._local_header(name, method, dt, ZIP_UTF8_FLAG, crc, csize, usize, zip64))
+        with spool:
+            while True:
+                data = spool.read(ZIP_BLOCK)
+                if not data:
+                    break
+                yield self._emit(data)
+        self.central.append((name, method, dt, ZIP_UTF8_FLAG, crc, csize, usize, start))
+
+    def finish(self):
+        cd_start = self.offset
+        for name, method, dt, flags, crc, csize, usize, start in self.central:
+            extra_vals = [v for v in (usize, csize, start) if v >= ZIP64_LIMIT]
+            extra = (struct.pack('<HH', 1, 8 * len(extra_vals))
+                     + b''.join(struct.pack('<Q', v) for v in extra_vals)) if extra_vals else b''
+            yield self._emit(struct.pack(
+                '<IHHHHHHIIIHHHHHII', 0x02014B50, 45 if extra else 20, 45 if extra else 20,
+                flags, method, dt[0], dt[1], crc,
+                _z32(csize), _z32(usize),
+                len(name), len(extra), 0, 0, 0, 0, _z32(start)) + name + extra)
+        cd_size = self.offset - cd_start
+        count   = len(self.central)
+        if count >= 0xFFFF or cd_size >= ZIP64_LIMIT or cd_start >= ZIP64_LIMIT:
+            eocd64 = self.offset
+            yield self._emit(struct.pack('<IQHHIIQQQQ', 0x06064B50, 44, 45, 45, 0, 0,
+                                         count, count, cd_size, cd_start))
+            yield self._emit(struct.pack('<IIQI', 0x07064B50, 0, eocd64, 1))
+        yield self._emit(struct.pack('<IHHHHIIH', 0x06054B50, 0, 0,
+                                     min(count, 0xFFFF), min(count, 0xFFFF),
+                                     _z32(cd_size), _z32(cd_start), 0))
+
+
+def stream_zip(files: list, level, workers: int = 0):
+    """
+    Yield a ZIP archive of [(arcname, path)].  level is None for store or a
+    zlib level 0-9; workers > 1 compresses upcoming files in parallel.
+    """
+    zs = _ZipStream()
+    if workers <= 1 or level is None or len(files) < 2:
+        for arcname, path in files:
+            yield from zs.stream_entry(arcname, path, level)
+    else:
+        pool    = ThreadPoolExecutor(max_workers=workers)
+        pending = collections.deque()
+        try:
+            todo = iter(files)
+            for arcname, path in todo:
+                pending.append((arcname, path, pool.submit(_compress_to_spool, path, level)))
+                if len(pending) > workers:
+                    break
+            while pending:
+                arcname, path, fut = pending.popleft()
+                nxt = next(todo, None)
+                if nxt is not None:
+                    pending.append((*nxt, pool.submit(_compress_to_spool, nxt[1], level)))
+                yield from zs.spooled_entry(arcname, path, level, *fut.result())
+        finally:
+            # Closed early (client went away): drop the work and the spools nobody will send.
+            for _, _, fut in pending:
+                fut.cancel()
+                fut.add_done_callback(_discard_spool)
+            pool.shutdown(wait=False)
+    yield from zs.finish()
+
+
+def _discard_spool(fut) -> None:
+    if not fut.cancelled() and fut.exception() is None:
+        fut.result()[0].close()
+
+
 @app.route('/download_batch', methods=['GET'])
 def download_batch():
+    """
+    GET /download_batch?session_dir=…&compression=deflate|store&level=6&workers=N
+
+    Streams the zip as it is built.  workers defaults to one per CPU (max 4)
+    for deflate and is clamped to that; workers=1 compresses serially.
+    """
     session_dir = os.path.basename(request.args.get('session_dir', '').strip())
     if not session_dir:
         return jsonify({"error": "Missing session_dir"}), 400
@@ -1294,26 +2688,380 @@ def download_batch():
         files = meta.get('files', [])
     except Exception:
         files = []
-    if not files:
+    entries = [(fname, os.path.join(session_path, fname)) for fname in files
+               if os.path.isfile(os.path.join(session_path, fname))]
+    if not entries:
         return jsonify({"error": "No files in session"}), 404
 
-    buf = io.BytesIO()
-    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for fname in files:
-            fpath = os.path.join(session_path, fname)
-            if os.path.isfile(fpath):
-                zf.write(fpath, fname)
-    buf.seek(0)
+    compression = request.args.get('compression', 'deflate')
+    if compression not in ('deflate', 'store'):
+        return jsonify({"error": "compression must be 'deflate' or 'store'"}), 400
+    try:
+        level   = min(9, max(0, int(request.args.get('level', 6))))
+        workers = min(ZIP_MAX_WORKERS, max(1, int(request.args.get('workers', ZIP_MAX_WORKERS))))
+    except ValueError:
+        return jsonify({"error": "Invalid level or workers"}), 400
+    if compression == 'store':
+        level = None
+
     zip_name = f"{session_dir}_output.zip"
-    return send_file(buf, as_attachment=True, download_name=zip_name,
-                     mimetype='application/zip')
+    return app.response_class(
+        stream_zip(entries, level, workers),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename="{zip_name}"'},
+    )
+
+
+# ── Metrics ────────────────────────────────────────────────────────────────
+#
+# GET /metrics answers in the Prometheus text format.  Counters and
+# histograms live in dicts keyed by label values behind one lock, so an
+# update costs a lookup and an add.  Gauges (event bus, file history, runs in
+# progress) are read only when scraped.  Routes are labelled by their rule
+# ("/session/<sid>"), never the raw path, so label sets stay bounded.
+
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRICS_RUN_BUCKETS     = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _Metrics:
+    def __init__(self):
+        self._lock   = threading.Lock()
+        self._kinds  = {}   # name → (kind, help, label names, buckets)
+        self._values = {}   # name → {label values: count | [bucket counts..., count, sum]}
+
+    def declare(self, name: str, kind: str, help_: str, labels: tuple = (), buckets: tuple = ()) -> None:
+        self._kinds[name]  = (kind, help_, labels, buckets)
+        self._values[name] = {}
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1) -> None:
+        series = self._values[name]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + value
+
+    def set(self, name: str, labels: tuple, value: float) -> None:
+        """Overwrite a counter mirrored from elsewhere (e.g. the event bus totals)."""
+        with self._lock:
+            self._values[name][labels] = value
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        buckets = self._kinds[name][3]
+        series  = self._values[name]
+        with self._lock:
+            row = series.get(labels)
+            if row is None:
+                row = series[labels] = [0] * (len(buckets) + 1) + [0.0]
+            row[bisect_left(buckets, value)] += 1
+            row[-1] += value
+
+    def render(self, gauges: list) -> str:
+        """Every declared metric, then gauges [(name, help, value)], as exposition text."""
+        out = []
+        with self._lock:
+            snapshot = {name: {k: list(v) if isinstance(v, list) else v for k, v in series.items()}
+                        for name, series in self._values.items()}
+        for name, (kind, help_, labels, buckets) in self._kinds.items():
+            out.append(f"# HELP {name} {help_}\n# TYPE {name} {kind}\n")
+            for values, v in sorted(snapshot[name].items()):
+                tags = [f'{k}="{_metric_label(x)}"' for k, x in zip(labels, values)]
+                if kind != "histogram":
+                    out.append(f"{name}{_metric_tags(tags)} {_metric_value(v)}\n")
+                    continue
+                for bound, cumulative in zip((*buckets, "+Inf"), accumulate(v[:-1])):
+                    le = 'le="%s"' % (bound if bound == "+Inf" else f"{bound:g}")
+                    out.append(f"{name}_bucket{_metric_tags(tags + [le])} {cumulative}\n")
+                out.append(f"{name}_count{_metric_tags(tags)} {sum(v[:-1])}\n")
+                out.append(f"{name}_sum{_metric_tags(tags)} {v[-1]:.6f}\n")
+        for name, help_, value in gauges:
+            out.append(f"# HELP {name} {help_}\n# TYPE {name} gauge\n{name} {_metric_value(value)}\n")
+        return "".join(out)
+
+
+def _metric_value(value) -> str:
+    """A sample value in full: ints exactly, floats as repr (":g" would round to 6 digits)."""
+    if isinstance(value, int):
+        return str(int(value))
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return "NaN" if math.isnan(value) else repr(float(value))
+
+
+def _metric_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _metric_tags(tags: list) -> str:
+    return "{" + ",".join(tags) + "}" if tags else ""
+
+
+_metrics = _Metrics()
+_metrics.declare("pyauto_http_requests_total", "counter", "HTTP requests by route, method and status.",
+                 ("route", "method", "status"))
+_metrics.declare("pyauto_http_request_duration_seconds", "histogram",
+                 "Time to produce a response (streams: until headers), by route.",
+                 ("route",), METRICS_LATENCY_BUCKETS)
+_metrics.declare("pyauto_runs_total", "counter",
+                 "Pipeline runs (/execute, /execute_batch, each /sweep combination) by preset and outcome.",
+                 ("preset", "status"))
+_metrics.declare("pyauto_run_duration_seconds", "histogram", "Pipeline run wall time by preset.",
+                 ("preset",), METRICS_RUN_BUCKETS)
+_metrics.declare("pyauto_step_runs_total", "counter", "Plugin step executions by step and outcome.",
+                 ("step", "status"))
+_metrics.declare("pyauto_step_duration_seconds", "histogram", "Wall time of successful plugin steps.",
+                 ("step",), METRICS_RUN_BUCKETS)
+_metrics.declare("pyauto_processed_bytes_total", "counter", "Input bytes read by pipeline runs.")
+_metrics.declare("pyauto_events_published_total", "counter", "Events published on the event bus.")
+_metrics.declare("pyauto_events_dropped_total", "counter",
+                 "Events dropped because a slow subscriber's backlog was full.")
+
+
+def _run_metrics(preset: str):
+    """on_step wrapper and finish(status, seconds or None, bytes) for one run's metrics."""
+    running = {}
+
+    def on_step(ev):
+        if ev.get("status") == "running":
+            running[(ev.get("branch"), ev.get("item"))] = ev["step"]
+        elif ev.get("status") == "ok":
+            running.pop((ev.get("branch"), ev.get("item")), None)
+            _metrics.inc("pyauto_step_runs_total", (ev["step"], "ok"))
+            _metrics.observe("pyauto_step_duration_seconds", (ev["step"],), ev.get("duration_ms", 0) / 1000)
+
+    def finish(status: str, seconds: float, size: int) -> None:
+        for step in running.values():   # started but never finished: these failed or were stopped
+            _metrics.inc("pyauto_step_runs_total", (step, "cancelled" if status == "cancelled" else "failed"))
+        _metrics.inc("pyauto_runs_total", (preset, status))
+        if seconds is not None:
+            _metrics.observe("pyauto_run_duration_seconds", (preset,), seconds)
+        if size:
+            _metrics.inc("pyauto_processed_bytes_total", (), size)
+
+    return on_step, finish
+
+
+def _preset_label(data: dict) -> str:
+    """
+    The saved preset a run came from, for metric labels: "" for an unsaved
+    pipeline and "other" for a name the preset catalog does not know, so
+    clients cannot grow the label set.
+    """
+    name = os.path.basename(str(data.get('preset') or ''))
+    if not name:
+        return ""
+    filename = name if name.endswith('.json') else name + '.json'
+    try:
+        return filename[:-5] if _preset_catalog.known(filename) else "other"
+    except OSError:
+        return "other"
+
+
+@app.before_request
+def _metrics_start():
+    request.environ['pyauto.started'] = time.perf_counter()
+
+
+@app.after_request
+def _metrics_finish(response):
+    started = request.environ.get('pyauto.started')
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "<unmatched>"
+        _metrics.inc("pyauto_http_requests_total", (route, request.method, str(response.status_code)))
+        _metrics.observe("pyauto_http_request_duration_seconds", (route,), time.perf_counter() - started)
+    return response
+
+
+def _file_history_usage() -> tuple:
+    """(entries, bytes) held by the undo/redo history of every open file."""
+    entries = size = 0
+    with _file_hist_lock:
+        for fh in _file_histories.values():
+            for entry in (*fh["past"], *fh["future"]):
+                entries += 1
+                if isinstance(entry, dict):
+                    size += sum(len(part) for patch in entry["patches"] for part in patch
+                                if isinstance(part, (bytes, str)))
+                else:
+                    size += len(entry)
+    return entries, size
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Server and pipeline metrics in the Prometheus text format (version 0.0.4)."""
+    bus = _events.stats()
+    _metrics.set("pyauto_events_published_total", (), bus["published"])
+    _metrics.set("pyauto_events_dropped_total", (), bus["dropped"])
+    with _active_runs_lock:
+        active = len(_active_runs)
+    hist_entries, hist_bytes = _file_history_usage()
+    body = _metrics.render([
+        ("pyauto_sse_subscribers",       "Open /events and /logs streams.",                   bus["subscribers"]),
+        ("pyauto_event_backlog",         "Events queued for subscribers, not yet sent.",      bus["backlog"]),
+        ("pyauto_active_runs",           "Runs in progress (by run id).",                     active),
+        ("pyauto_file_history_entries",  "Undo/redo entries held in memory.",                 hist_entries),
+        ("pyauto_file_history_bytes",    "Bytes held by undo/redo snapshots and patches.",    hist_bytes),
+    ])
+    return app.response_class(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# ── Serving ────────────────────────────────────────────────────────────────
+# `python app.py` serves on a pooled, multi-threaded WSGI server from the
+# standard library.  Threads rather than forked workers: the event bus, upload
+# tracking, session locks and the write-behind history/stats all live in this
+# process and must be shared by every request.  Ordinary requests queue for
+# the pool (up to SERVE_BACKLOG waiting; beyond that they get 503 at once).
+# /events and /logs streams and /cancel never wait behind it: the request line
+# is peeked on the connection's own thread, and those requests are served
+# right there, so open streams cannot use up the pool and a busy pool cannot
+# hold up a cancel.  Connection threads are capped at SERVE_MAX_CONNS; past
+# that, one thread answers new connections with 503 (and closes them outright
+# once SERVE_BACKLOG are waiting for it).
+
+SERVE_WORKERS     = 16
+SERVE_BACKLOG     = 64          # requests waiting for a worker before new ones get 503
+SERVE_MAX_STREAMS = 32          # open /events and /logs streams
+SERVE_MAX_CONNS   = 256         # connection threads (peeking, streaming or waiting on the pool)
+SERVE_STREAMS     = ('/events', '/logs')
+SERVE_READ_SECS   = 10          # for a new connection's request line to arrive
+
+_access_log = logging.getLogger('werkzeug')
+
+
+def serve(host: str = '127.0.0.1', port: int = 5000, workers: int = SERVE_WORKERS) -> None:
+    import queue
+    import socket
+    from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+    pool     = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='http')
+    queued   = threading.BoundedSemaphore(workers + SERVE_BACKLOG)
+    conns    = threading.BoundedSemaphore(SERVE_MAX_CONNS)
+    refusals = queue.Queue(SERVE_BACKLOG)
+    streams  = threading.BoundedSemaphore(SERVE_MAX_STREAMS)
+    busy     = json.dumps({"error": "Server busy, try again"}).encode()
+
+    class _Handler(WSGIRequestHandler):
+        def log_request(self, code='-', size='-'):
+            # Same record shape as werkzeug's, so the /events filter applies.
+            _access_log.info(f'{self.address_string()} - - "%s" %s %s', self.requestline, code, size)
+
+    class _PooledServer(WSGIServer):
+        daemon_threads = True
+
+        def process_request(self, request, client_address):
+            if not conns.acquire(blocking=False):
+                try:
+                    refusals.put_nowait(request)    # answered off the accept loop
+                except queue.Full:
+                    self.shutdown_request(request)  # past even that: just close
+                return
+            threading.Thread(target=self._route, args=(request, client_address),
+                             name='http-conn', daemon=True).start()
+
+        def _route(self, request, client_address):
+            try:
+                path = self._peek_path(request)
+                if path == '/cancel':
+                    self._process(request, client_address)
+                elif path in SERVE_STREAMS:
+                    if streams.acquire(blocking=False):
+                        self._process(request, client_address, streams)
+                    else:
+                        self._refuse(request)
+                elif queued.acquire(blocking=False):
+                    pool.submit(self._process, request, client_address, queued)
+                else:
+                    self._refuse(request)
+            finally:
+                conns.release()
+
+        def _process(self, request, client_address, slot=None):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+                if slot is not None:
+                    slot.release()
+
+        @staticmethod
+        def _peek_path(request) -> str:
+            """The request's path, read without consuming it; "" if it does not arrive in time."""
+            request.settimeout(SERVE_READ_SECS)
+            try:
+                head = request.recv(1024, socket.MSG_PEEK)
+            except OSError:
+                return ""
+            finally:
+                request.settimeout(None)
+            parts = head.split(b'\r\n', 1)[0].split(b' ')
+            return parts[1].split(b'?', 1)[0].decode('latin-1') if len(parts) > 2 else ""
+
+        def _refuse(self, request):
+            try:
+                request.settimeout(0.5)
+                request.recv(65536)     # take the request, so closing does not reset the reply away
+                request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nContent-Type: application/json\r\n"
+                                b"Retry-After: 1\r\nContent-Length: %d\r\n\r\n%s" % (len(busy), busy))
+            except OSError:
+                pass
+            self.shutdown_request(request)
+
+    if _access_log.level == logging.NOTSET:
+        _access_log.setLevel(logging.INFO)
+        _access_log.addHandler(logging.StreamHandler())
+
+    # Load the plugin catalog before accepting requests.  Plugin modules are
+    # imported by sandbox workers, never here: the catalog comes from the
+    # manifest, files that are new or changed since it was written are
+    # scanned by a worker, and later edits are scanned in the background.
+    _plugin_registry.scanner = _scan_plugin
+    plugins = _plugin_registry.settled()
+    print(f"[serve] {sum(1 for p in plugins.values() if not p['_ui_hidden'])} plugin(s) listed")
+    reaped = reap_shared_segments()
+    if reaped:
+        print(f"[serve] removed {reaped} shared-memory segment(s) left by a crashed run")
+
+    httpd = _PooledServer((host, port), _Handler)
+    httpd.set_app(app)
+
+    def refuse_excess():
+        while True:
+            httpd._refuse(refusals.get())
+
+    threading.Thread(target=refuse_excess, name='http-refuse', daemon=True).start()
+    print(f"[serve] http://{host}:{port}  ({workers} workers)")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        pool.shutdown(wait=False)
 
 
 if __name__ == '__main__':
+    import argparse
     import socket as _socket
+
+    parser = argparse.ArgumentParser(prog='app.py', description='PY-AUTOMATE server')
+    sub    = parser.add_subparsers(dest='command')
+    sp     = sub.add_parser('serve', help='serve the web UI (default)')
+    for p in (parser, sp):
+        p.add_argument('--host', default='127.0.0.1')
+        p.add_argument('--port', type=int, default=5000)
+        p.add_argument('--workers', type=int, default=SERVE_WORKERS,
+                       help='request threads (log/progress streams and /cancel do not use them)')
+        p.add_argument('--dev', action='store_true',
+                       help="Flask's debug server with the auto-reloader")
+    args = parser.parse_args()
+
     if not os.environ.get('WERKZEUG_RUN_MAIN'):
         with _socket.socket(_socket.AF_INET, _socket.SOCK_STREAM) as _s:
-            if _s.connect_ex(('localhost', 5000)) == 0:
-                print("Server already running on port 5000 — exiting to avoid duplicate.")
+            if _s.connect_ex(('localhost', args.port)) == 0:
+                print(f"Server already running on port {args.port} — exiting to avoid duplicate.")
                 raise SystemExit(0)
-    app.run(debug=True, port=5000)
+    if args.dev:
+        app.run(debug=True, host=args.host, port=args.port)
+    else:
+        serve(args.host, args.port, max(1, args.workers))
@@ -0,0 +1,82 @@
+"""
+Startup benchmark: time from launching `python app.py` to the first answered
+request.
+
+    python bench_startup.py [--runs 5] [--path /list_functions] [--budget-ms 1500] [--cold]
+
+Each run starts the server on a free port, polls `path` until it answers 200,
+records the elapsed wall time and stops the server.  --cold deletes the plugin
+manifest before every run, so each plugin is imported as on a first launch.
+Exits 1 if the median time is over --budget-ms, so this script can gate a change.
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import statistics
+import subprocess
+import urllib.request
+import urllib.error
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MANIFEST = os.path.join(BASE_DIR, 'plugins', '.manifest.json')
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def time_to_first_response(path: str, timeout: float = 30.0) -> float:
+    port    = _free_port()
+    url     = f"http://127.0.0.1:{port}{path}"
+    started = time.perf_counter()
+    proc    = subprocess.Popen(
+        [sys.executable, os.path.join(BASE_DIR, 'app.py'), '--port', str(port)],
+        cwd=BASE_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"server exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=timeout) as resp:
+                    if resp.status == 200:
+                        resp.read()
+                        return (time.perf_counter() - started) * 1000
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        raise TimeoutError(f"no response from {url} within {timeout}s")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--path', default='/list_functions', help='request that counts as "first response"')
+    parser.add_argument('--budget-ms', type=float, default=0, help='fail if the median exceeds this')
+    parser.add_argument('--cold', action='store_true', help='drop the plugin manifest before each run')
+    args = parser.parse_args()
+
+    times = []
+    for i in range(args.runs):
+        if args.cold and os.path.exists(MANIFEST):
+            os.remove(MANIFEST)
+        times.append(time_to_first_response(args.path))
+        print(f"run {i + 1}: {times[-1]:.0f} ms")
+
+    median = statistics.median(times)
+    print(f"time to first response ({args.path}): "
+          f"min {min(times):.0f} ms, median {median:.0f} ms, max {max(times):.0f} ms")
+    if args.budget_ms and median > args.budget_ms:
+        print(f"over budget: {median:.0f} ms > {args.budget_ms:.0f} ms")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
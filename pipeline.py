@@ -0,0 +1,2723 @@
+"""
+Pipeline core: Payload, the plugin registry and the step executor.
+
+Shared by the web app (app.py) and the headless runner, so it must not import
+Flask — `python app.py run ...` starts from here and never loads the web stack.
+"""
+import io
+import os
+import atexit
+import sys
+import time
+import re
+import copy
+import contextvars
+import math
+import json
+import glob
+import queue
+import pickle
+import signal
+import subprocess
+import hashlib
+import threading
+import importlib.util
+import inspect
+import types
+import traceback
+import mimetypes
+import shutil
+import locale
+from array import array
+from bisect import bisect_right
+from collections.abc import MutableSequence
+from itertools import accumulate, count
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+# ── Paths ──────────────────────────────────────────────────────────────────
+
+BASE_DIR    = os.path.dirname(os.path.abspath(__file__))
+PLUGIN_DIR  = os.path.join(BASE_DIR, 'plugins')
+PRESETS_DIR = os.path.join(BASE_DIR, 'presets')
+
+TEXT_ENCODING = locale.getpreferredencoding(False)   # same default as open()
+
+EXTRA_MIME_TYPES = [
+    ('.gcode', 'text/x-gcode'),
+    ('.nc',    'text/x-gcode'),
+    ('.ngc',   'text/x-gcode'),
+    ('.cnc',   'text/x-gcode'),
+    ('.gbr',   'text/x-gerber'),
+]
+_mime_ready = False
+
+
+def guess_mime(path: str) -> str:
+    """MIME type for path.  The system mimetypes database is read on first use, not at import."""
+    global _mime_ready
+    if not _mime_ready:
+        for ext, mime in EXTRA_MIME_TYPES:
+            mimetypes.add_type(mime, ext)
+        _mime_ready = True
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+# ── Text lines ─────────────────────────────────────────────────────────────
+#
+# TextLines is the default representation of a text payload: the raw file
+# bytes plus an array of line start offsets (4–8 bytes per line) instead of
+# one str object per line.  Lines are decoded when accessed.  Slices and
+# concatenations are new views over the same buffers and copy no text;
+# only lines added from Python strings are encoded into a buffer of their own.
+# CRLF endings read back as "\n", as readlines() did, but the original bytes
+# are what payload_to_file writes out.  The first write (append, index
+# assignment, insert, ...) turns the view into a plain list of str in place,
+# so plugins written for list[str] keep working and only they pay for it.
+
+LINE_SCAN_BLOCK   = 1024 * 1024
+LINE_DECODE_BLOCK = 4096        # lines decoded per chunk when iterating
+
+
+def _line_offsets(buf) -> array:
+    """Start offset of every line in buf, plus len(buf) as the final end."""
+    size = len(buf)
+    offs = array('I' if size < 2 ** 32 else 'Q', [0])
+    view = memoryview(buf)
+    for start in range(0, size, LINE_SCAN_BLOCK):
+        parts = bytes(view[start:start + LINE_SCAN_BLOCK]).split(b'\n')
+        ends  = accumulate(map((1).__add__, map(len, parts[:-1])), initial=start)
+        next(ends)
+        offs.extend(ends)
+    if offs[-1] != size:
+        offs.append(size)           # last line has no trailing newline
+    return offs
+
+
+class TextLines(MutableSequence):
+    """
+    Copy-on-write sequence of lines (str, newline kept) over byte buffers.
+
+    Supports len, indexing, iteration, slicing (a view), + with another
+    TextLines or a list of str (a view plus the new lines), and == against
+    any sequence of str.  The list methods that write (item assignment,
+    del, insert, append, extend, sort, ...) first copy the lines into a
+    list held by this object; edited reports whether that has happened.
+    The line index of a freshly loaded buffer is built on first random access,
+    so a payload that is only iterated or converted never pays for it.
+    """
+    __slots__ = ('_raw', '_parts', '_ends', '_lines', 'encoding')
+
+    def __init__(self, parts=(), encoding: str = TEXT_ENCODING):
+        # parts: (buf, offsets, lo, hi) — lines lo..hi-1 of buf; line i is buf[offsets[i]:offsets[i + 1]]
+        self._raw     = None            # whole buffer whose offsets are not built yet
+        self._parts   = tuple(p for p in parts if p[3] > p[2])
+        self._ends    = list(accumulate(hi - lo for _, _, lo, hi in self._parts))
+        self._lines   = None            # list[str] once written to
+        self.encoding = encoding
+
+    @classmethod
+    def from_buffer(cls, buf, encoding: str = TEXT_ENCODING) -> "TextLines":
+        lines = cls((), encoding)
+        if len(buf):
+            lines._raw = buf
+        return lines
+
+    @classmethod
+    def from_lines(cls, lines, encoding: str = TEXT_ENCODING) -> "TextLines":
+        return cls.from_buffer(''.join(lines).encode(encoding, errors='replace'), encoding)
+
+    def _index(self) -> None:
+        if self._raw is not None:
+            offsets = _line_offsets(self._raw)
+            self._parts = ((self._raw, offsets, 0, len(offsets) - 1),)
+            self._ends  = [len(offsets) - 1]
+            self._raw   = None
+
+    def _decode(self, raw) -> str:
+        line = str(raw, self.encoding, 'replace')
+        return line[:-2] + '\n' if line.endswith('\r\n') else line
+
+    @property
+    def edited(self) -> bool:
+        return self._lines is not None
+
+    def _edit(self) -> list:
+        if self._lines is None:
+            self._lines = self.tolist()
+            self._raw, self._parts, self._ends = None, (), []
+        return self._lines
+
+    def __setitem__(self, index, value):
+        self._edit()[index] = value
+
+    def __delitem__(self, index):
+        del self._edit()[index]
+
+    def insert(self, index, value):
+        self._edit().insert(index, value)
+
+    def append(self, value):
+        self._edit().append(value)
+
+    def extend(self, values):
+        self._edit().extend(values)
+
+    def sort(self, *, key=None, reverse=False):
+        self._edit().sort(key=key, reverse=reverse)
+
+    def __iadd__(self, other):
+        if self._lines is None:
+            return self + other     # still a view: nothing is copied
+        self._lines.extend(other)
+        return self
+
+    def __len__(self) -> int:
+        if self._lines is not None:
+            return len(self._lines)
+        self._index()
+        return self._ends[-1] if self._ends else 0
+
+    def __getitem__(self, index):
+        if self._lines is not None:
+            return self._lines[index]
+        n = len(self)
+        if isinstance(index, slice):
+            start, stop, step = index.indices(n)
+            if step != 1:
+                return TextLines.from_lines([self[i] for i in range(start, stop, step)], self.encoding)
+            return self._slice(start, max(start, stop))
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('TextLines index out of range')
+        k = bisect_right(self._ends, index)
+        buf, offsets, lo, _ = self._parts[k]
+        i = lo + index - (self._ends[k - 1] if k else 0)
+        return self._decode(buf[offsets[i]:offsets[i + 1]])
+
+    def _slice(self, start: int, stop: int) -> "TextLines":
+        parts, base = [], 0
+        for (buf, offsets, lo, hi), end in zip(self._parts, self._ends):
+            a, b = max(start, base), min(stop, end)
+            if a < b:
+                parts.append((buf, offsets, lo + a - base, lo + b - base))
+            base = end
+        return TextLines(parts, self.encoding)
+
+    def __iter__(self):
+        if self._lines is not None:
+            yield from self._lines
+            return
+        # Decode a block at a time; StringIO splits lines and folds CRLF in C.
+        if self._raw is not None:
+            view = memoryview(self._raw)
+            tail = b''
+            for start in range(0, len(view), LINE_SCAN_BLOCK):
+                block = tail + bytes(view[start:start + LINE_SCAN_BLOCK])
+                cut   = block.rfind(b'\n') + 1
+                block, tail = block[:cut], block[cut:]
+                yield from io.StringIO(str(block, self.encoding, 'replace'), newline=None)
+            if tail:
+                yield from io.StringIO(str(tail, self.encoding, 'replace'), newline=None)
+            return
+        for buf, offsets, lo, hi in self._parts:
+            for i in range(lo, hi, LINE_DECODE_BLOCK):
+                j = min(hi, i + LINE_DECODE_BLOCK)
+                yield from io.StringIO(str(buf[offsets[i]:offsets[j]], self.encoding, 'replace'), newline=None)
+
+    def __add__(self, other):
+        if self._lines is not None:
+            return TextLines.from_lines(self._lines, self.encoding) + other
+        self._index()
+        if isinstance(other, TextLines) and other.edited:
+            other = other._lines
+        if isinstance(other, TextLines):
+            other._index()
+            return TextLines(self._parts + other._parts, self.encoding)
+        if isinstance(other, (list, tuple)):
+            return self + TextLines.from_lines(other, self.encoding)
+        return NotImplemented
+
+    def __radd__(self, other):
+        if isinstance(other, (list, tuple)):
+            return TextLines.from_lines(other, self.encoding) + self
+        return NotImplemented
+
+    def __eq__(self, other):
+        if not isinstance(other, (TextLines, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"<TextLines {len(self)} lines, {self.nbytes} bytes>"
+
+    @property
+    def nbytes(self) -> int:
+        return sum(len(chunk) for chunk in self.buffers())
+
+    def buffers(self):
+        """Yield the raw bytes of the view as zero-copy memoryview chunks."""
+        if self._lines is not None:     # edited: encode the list once
+            yield memoryview(''.join(self._lines).encode(self.encoding, errors='replace'))
+            return
+        if self._raw is not None:
+            yield memoryview(self._raw)
+        for buf, offsets, lo, hi in self._parts:
+            yield memoryview(buf)[offsets[lo]:offsets[hi]]
+
+    def __reduce__(self):
+        # Pickles (for worker processes) as one bytes copy of the view.
+        return (TextLines.from_buffer, (b''.join(self.buffers()), self.encoding))
+
+    def tolist(self) -> list:
+        if self._lines is not None:
+            return list(self._lines)
+        if self._raw is not None:   # untouched file: one decode, like readlines()
+            return io.StringIO(str(self._raw, self.encoding, 'replace'), newline=None).readlines()
+        return list(iter(self))     # list(self) would ask len() and build the index
+
+
+# ── Mapped files ───────────────────────────────────────────────────────────
+
+MMAP_MIN_BYTES = 8 * 1024 * 1024    # "auto" maps files at least this big
+WRITE_BLOCK    = 1024 * 1024
+
+_BARE_CR = re.compile(rb'\r(?!\n)')
+
+
+class MappedFile:
+    """
+    Read-only memory-mapped file contents: the data of a large binary payload.
+
+    Pages are read from disk only when touched, so a step that inspects a
+    header never loads the rest.  Random access and slicing:
+
+        len(data), data[i], data[a:b] (bytes), data.find(b"IEND")
+        data.read(offset, size)       — bytes copy of a range
+        data.view(start, stop)        — zero-copy memoryview (release it when done)
+        bytes(data) / data.tobytes()  — the whole content
+
+    A step that changes the content returns new bytes as payload.data.
+    """
+    __slots__ = ('_mm', 'path')
+
+    def __init__(self, path: str):
+        import mmap
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self._mm)
+
+    def __getitem__(self, index):
+        return self._mm[index]
+
+    def __bytes__(self) -> bytes:
+        return self._mm[:]
+
+    def __repr__(self) -> str:
+        return f"<MappedFile {self.path!r} {len(self)} bytes>"
+
+    def find(self, sub: bytes, start: int = 0, end: int = None) -> int:
+        return self._mm.find(sub, start, len(self._mm) if end is None else end)
+
+    def read(self, offset: int, size: int) -> bytes:
+        return self._mm[offset:offset + size]
+
+    def view(self, start: int = 0, stop: int = None) -> memoryview:
+        return memoryview(self._mm)[start:stop]
+
+    def tobytes(self) -> bytes:
+        return self._mm[:]
+
+    @property
+    def buffer(self):
+        """The underlying mmap, for APIs that accept any buffer (re, zlib, hashlib…)."""
+        return self._mm
+
+    def close(self) -> None:
+        try:
+            self._mm.close()
+        except BufferError:
+            pass                        # a view is still alive; the GC will unmap it
+
+
+# ── Payload ────────────────────────────────────────────────────────────────
+
+@dataclass
+class Payload:
+    """
+    The universal pipeline token passed between every plugin step.
+
+    data      — the actual content:
+                  TextLines  for text files as loaded (a copy-on-write sequence
+                             of lines, newlines preserved, used like a list[str]);
+                             steps may return a list[str] instead, and legacy
+                             plugins always get one
+                  bytes      for binary files (images, audio, video, etc.)
+                  MappedFile for large binary files (see payload_from_file)
+                  any        for richer types a plugin may introduce (numpy array,
+                             PIL Image, etc.) — the next plugin must understand it.
+    mime_type — IANA media type, e.g. "text/plain", "image/png", "audio/wav".
+                Plugins update this when they change the data format.
+    filename  — original filename; used for default output naming and MIME guessing.
+    meta      — free-form dict for inter-step communication.
+                Examples: {"layer_count": 12}, {"sample_rate": 44100}, {"crf": 23}
+    origin    — set by payload_from_file: (path, stat stamp, data as loaded,
+                mapping or None).  Lets payload_to_file skip unchanged writes.
+    """
+    data:      Any
+    mime_type: str  = "text/plain"
+    filename:  str  = ""
+    meta:      dict = field(default_factory=dict)
+    origin:    Any  = field(default=None, repr=False, compare=False)
+
+
+def _stat_stamp(path: str):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def payload_from_file(path: str, mode: str = "auto") -> Payload:
+    """
+    Read a file from disk into a Payload, auto-detecting its MIME type.
+
+    mode — "read": load into memory; "mmap": map the file read-only (text
+    becomes a TextLines view over the mapping, binary a MappedFile);
+    "auto": map files of MMAP_MIN_BYTES or more.
+    """
+    mime = guess_mime(path)
+    filename = os.path.basename(path)
+    stamp = _stat_stamp(path)
+    mapped = None
+    if mode == "mmap" or (mode == "auto" and stamp[1] >= MMAP_MIN_BYTES):
+        if stamp[1]:                    # empty files cannot be mapped
+            mapped = MappedFile(path)
+
+    # Treat text/* and a few common text-encoded formats as line lists
+    is_text = (
+        mime.startswith("text/")
+        or mime in ("application/json", "application/xml", "application/javascript")
+    )
+
+    if is_text:
+        if mapped:
+            raw = mapped.buffer
+        else:
+            with open(path, "rb") as f:
+                raw = f.read()
+        if raw.find(b"\r") != -1 and _BARE_CR.search(raw):
+            # Bare-CR line endings: let universal newlines split them as before
+            data = io.StringIO(str(raw[:], TEXT_ENCODING, "replace"), newline=None).readlines()
+        else:
+            data = TextLines.from_buffer(raw)
+    elif mapped:
+        data = mapped
+    else:
+        with open(path, "rb") as f:
+            data = f.read()
+
+    origin = (os.path.abspath(path), stamp, data, mapped)
+    return Payload(data=data, mime_type=mime, filename=filename, origin=origin)
+
+
+def payload_unchanged(payload: Payload, path: str) -> bool:
+    """True if path still holds exactly payload.data as it was loaded from it."""
+    if not payload.origin:
+        return False
+    src, stamp, data, _ = payload.origin
+    try:
+        return (payload.data is data and not getattr(data, "edited", False)
+                and src == os.path.abspath(path)
+                and _stat_stamp(path) == stamp)
+    except OSError:
+        return False
+
+
+def payload_to_file(payload: Payload, path: str) -> bool:
+    """
+    Write a Payload back to disk in the appropriate mode.  Returns False (and
+    touches nothing) when the data is unchanged since it was loaded from path.
+    The file is replaced atomically, which also keeps a mapping of the old
+    contents valid while the new ones are written from it.
+    """
+    if payload_unchanged(payload, path):
+        return False
+    data = payload.data
+    tmp  = f"{path}.tmp{os.getpid()}-{threading.get_ident()}"
+    try:
+        if isinstance(data, TextLines):
+            with open(tmp, "wb") as f:
+                f.writelines(data.buffers())    # no view outlives the write
+        elif isinstance(data, MappedFile):
+            with open(tmp, "wb") as f:
+                for start in range(0, len(data), WRITE_BLOCK):
+                    f.write(data.read(start, WRITE_BLOCK))
+        elif isinstance(data, list):
+            with open(tmp, "w") as f:
+                f.writelines(data)
+        elif isinstance(data, (bytes, bytearray)):
+            with open(tmp, "wb") as f:
+                f.write(data)
+        else:
+            # Last resort: coerce to string (covers numpy arrays printed, etc.)
+            with open(tmp, "w") as f:
+                f.write(str(data))
+        mapped = payload.origin[3] if payload.origin else None
+        if mapped and payload.origin[0] == os.path.abspath(path):
+            mapped.close()              # Windows cannot replace a mapped file
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return True
+
+
+# ── Shared-memory transport ────────────────────────────────────────────────
+#
+# Hands a payload to another process without pickling its data: the sender
+# copies the bytes once into a multiprocessing.shared_memory segment and sends
+# a small handle; the receiver maps the segment and wraps it without a copy
+# (text as TextLines, binary as a SharedBuffer).  Payloads under
+# SHM_MIN_BYTES, and data that is not plain text or bytes, travel inline.
+#
+# Lifecycle: segments are named pyauto_<creator pid>_<n>.  The receiver calls
+# release_shared(handle) once it has attached (or the sender does, after all
+# receivers have): that unlinks the name, and the memory goes away with the
+# last mapping.  Names a process created and never released are unlinked at
+# its exit.  A process that dies mid-handoff leaves its name in /dev/shm;
+# reap_shared_segments() removes names whose creator is no longer running.
+# The multiprocessing resource tracker is kept out of it: this module owns
+# the cleanup, and the tracker (one per process tree, told about every
+# attach) would otherwise warn about, or unlink, names already handed on.
+
+SHM_MIN_BYTES = 1024 * 1024
+SHM_DIR       = '/dev/shm'
+SHM_NAME_RE   = re.compile(r'pyauto_(\d+)_\d+')
+
+_shm_lock    = threading.Lock()
+_shm_counter = count(1)
+_shm_open    = {}       # name -> SharedMemory mapped by this process
+_shm_created = set()    # names created here and not yet released
+_shm_parked  = []       # released segments whose buffer still had views; closed later
+
+
+class SharedBuffer(MappedFile):
+    """
+    Binary payload data received through shared memory.  Same API as
+    MappedFile (slicing, find, read, view, tobytes); slices are bytes copies.
+    """
+    __slots__ = ()
+
+    def __init__(self, view: memoryview, name: str):
+        self._mm  = view
+        self.path = name
+
+    def __getitem__(self, index):
+        item = self._mm[index]
+        return item.tobytes() if isinstance(item, memoryview) else item
+
+    def __bytes__(self) -> bytes:
+        return self._mm.tobytes()
+
+    def __repr__(self) -> str:
+        return f"<SharedBuffer {self.path!r} {len(self)} bytes>"
+
+    def find(self, sub: bytes, start: int = 0, end: int = None) -> int:
+        size = len(self._mm)            # the segment may be page-rounded past the data
+        return self._mm.obj.find(sub, start, size if end is None else min(end, size))
+
+    def read(self, offset: int, size: int) -> bytes:
+        return self._mm[offset:offset + size].tobytes()
+
+    def tobytes(self) -> bytes:
+        return self._mm.tobytes()
+
+    @property
+    def buffer(self):
+        return self._mm
+
+    def close(self) -> None:
+        try:
+            self._mm.release()
+        except BufferError:
+            pass
+
+
+def _shm_segment(name: str = None, size: int = 0):
+    """Create a segment of size bytes (name None) or attach to an existing one."""
+    from multiprocessing import shared_memory
+
+    with _shm_lock:
+        if name in _shm_open:
+            return _shm_open[name]
+        if name is None:
+            if not _shm_created:
+                atexit.register(_release_created)
+            name = f"pyauto_{os.getpid()}_{next(_shm_counter)}"
+            segment = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1), **_SHM_UNTRACKED)
+            _shm_created.add(name)
+        else:
+            segment = shared_memory.SharedMemory(name=name, **_SHM_UNTRACKED)
+        if not _SHM_UNTRACKED and os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(segment._name, "shared_memory")
+        _shm_open[name] = segment
+        return segment
+
+
+_SHM_UNTRACKED = {"track": False} if sys.version_info >= (3, 13) else {}
+
+
+def _shm_unlink(name: str) -> None:
+    """Remove a segment's name; already gone is fine.  (Windows has no names to remove.)"""
+    if os.name != 'posix':
+        return
+    import _posixshmem
+    try:
+        _posixshmem.shm_unlink('/' + name)
+    except FileNotFoundError:
+        pass
+
+
+def _splits_cleanly(lines: list) -> bool:
+    """True if lines re-split from their joined text would come back the same."""
+    last = len(lines) - 1
+    return all(isinstance(line, str) and (i == last or line.endswith('\n')) for i, line in enumerate(lines))
+
+
+def _portable(payload: Payload) -> Payload:
+    """Copy of payload that pickles: no origin, mapped data read into bytes."""
+    data = payload.data
+    if isinstance(data, (MappedFile, memoryview)):
+        data = bytes(data)
+    return Payload(data, payload.mime_type, payload.filename, payload.meta)
+
+
+def payload_to_shared(payload: Payload) -> dict:
+    """Put payload in shared memory (or inline, if small) and return a picklable handle."""
+    data = payload.data
+    if isinstance(data, list) and _splits_cleanly(data):
+        data = TextLines.from_lines(data)
+    if isinstance(data, TextLines):
+        kind, encoding, chunks = "text", data.encoding, list(data.buffers())
+    elif isinstance(data, (bytes, bytearray, memoryview)):
+        kind, encoding, chunks = "bytes", None, [memoryview(data)]
+    elif isinstance(data, MappedFile):
+        kind, encoding, chunks = "bytes", None, [data.view()]
+    else:
+        kind, chunks = None, []
+    size = sum(len(c) for c in chunks)
+    if kind is None or size < SHM_MIN_BYTES:
+        for chunk in chunks:
+            chunk.release()
+        return {"inline": _portable(payload)}
+
+    segment = _shm_segment(size=size)
+    pos = 0
+    for chunk in chunks:
+        segment.buf[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+        chunk.release()
+    return {
+        "shm":       segment.name,
+        "size":      size,
+        "kind":      kind,
+        "encoding":  encoding,
+        "mime_type": payload.mime_type,
+        "filename":  payload.filename,
+        "meta":      payload.meta,
+    }
+
+
+def payload_from_shared(handle: dict) -> Payload:
+    """The Payload a handle describes; shared data is mapped, not copied."""
+    if "inline" in handle:
+        return handle["inline"]
+    segment = _shm_segment(handle["shm"])
+    view    = segment.buf[:handle["size"]]
+    if handle["kind"] == "text":
+        data = TextLines.from_buffer(view, handle["encoding"])
+    else:
+        data = SharedBuffer(view, handle["shm"])
+    return Payload(data, handle["mime_type"], handle["filename"], handle["meta"])
+
+
+def release_shared(handle: dict) -> None:
+    """Unlink a handle's segment and drop this process's mapping once nothing uses it."""
+    name = handle.get("shm")
+    if not name:
+        return
+    _shm_unlink(name)
+    with _shm_lock:
+        _shm_created.discard(name)
+        segment = _shm_open.pop(name, None)
+        if segment is not None:
+            _shm_parked.append(segment)
+        for segment in list(_shm_parked):
+            try:
+                segment.close()
+            except BufferError:
+                continue            # a payload still views it; retried on the next release
+            _shm_parked.remove(segment)
+
+
+def _release_created() -> None:
+    for name in list(_shm_created):
+        release_shared({"shm": name})
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass                        # exists, but belongs to someone else
+    return True
+
+
+def reap_shared_segments() -> int:
+    """Remove segments left behind by processes that died; returns how many."""
+    if not os.path.isdir(SHM_DIR):
+        return 0                    # Windows frees a segment with its last handle
+    removed = 0
+    for entry in os.listdir(SHM_DIR):
+        match = SHM_NAME_RE.fullmatch(entry)
+        if not match or int(match[1]) == os.getpid() or _pid_alive(int(match[1])):
+            continue
+        try:
+            os.remove(os.path.join(SHM_DIR, entry))
+            removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+# ── Plugin loader ──────────────────────────────────────────────────────────
+#
+# Plugin files live in /plugins/*.py.
+#
+# Each file may declare a module-level PLUGIN_META dict that applies to all
+# functions in the file.  Individual functions may also carry a .plugin_meta
+# attribute (set via the @plugin decorator below) that overrides file-level
+# metadata for that specific function.
+#
+# Minimal PLUGIN_META example:
+#
+#   PLUGIN_META = {
+#       "label":       "Convert G00/G01 → G1",
+#       "description": "Normalises move commands and rounds to 2 decimal places.",
+#       "accepts":     ["text/plain", "text/x-gcode"],
+#       "outputs":     ["text/plain", "text/x-gcode"],
+#       "requires":    [],           # pip package names
+#       "external":    [],           # system binary names (checked with shutil.which)
+#       "language":    "python",     # informational
+#       "tags":        ["gcode"],
+#   }
+#
+# Plugin function signature (new style):
+#   def my_step(payload: Payload) -> Payload: ...
+#
+# Legacy text-only signature (backwards compatible, auto-wrapped):
+#   def my_step(lines: list[str]) -> list[str]: ...
+#
+# Batch signature, for steps that gain from seeing every file at once (set
+# "batch": True in the function's plugin_meta, or in PLUGIN_META for all):
+#   def my_step(payloads: list[Payload]) -> list[Payload]: ...
+# run_batch calls it once with the whole batch; run_steps with a one-item list.
+#
+# Optional lifecycle hooks (never listed as steps):
+#   def setup(state): ...       # once per import, in every process that runs the plugin
+#   def teardown(state): ...    # before a re-import or removal, and at process exit
+# state is the module's PluginState, also bound as the module global
+# `plugin_state`, so steps can reach what setup() built.  Either hook may
+# omit the parameter.
+
+DEFAULT_META = {
+    "label":       None,          # falls back to "module.function" key
+    "description": "",
+    "accepts":     ["text/plain"],
+    "outputs":     ["text/plain"],
+    "requires":    [],
+    "external":    [],
+    "language":    "python",
+    "tags":        [],
+}
+
+
+def _is_legacy(fn) -> bool:
+    """Return True if fn looks like a legacy list[str] -> list[str] plugin."""
+    try:
+        params = list(inspect.signature(fn).parameters.values())
+        if not params:
+            return False
+        ann = params[0].annotation
+        if ann is inspect.Parameter.empty:
+            return True
+        # Direct class reference (normal import)
+        if ann is Payload:
+            return False
+        # String annotation — occurs when the plugin uses
+        # `from __future__ import annotations` or quotes the type: "Payload"
+        if isinstance(ann, str) and ann in ("Payload", "app.Payload", "pipeline.Payload"):
+            return False
+        return True
+    except (ValueError, TypeError):
+        return True
+
+
+def _wrap_legacy(fn):
+    """Wrap fn(list[str], ...) -> list[str] into fn(Payload, **kwargs) -> Payload."""
+    orig_sig    = inspect.signature(fn)
+    orig_params = set(orig_sig.parameters.keys())
+
+    def wrapped(payload: Payload, **kwargs) -> Payload:
+        relevant = {k: v for k, v in kwargs.items() if k in orig_params}
+        data = payload.data.tolist() if isinstance(payload.data, TextLines) else payload.data
+        payload.data = fn(data, **relevant)
+        return payload
+
+    wrapped.__name__   = fn.__name__
+    wrapped.__doc__    = fn.__doc__
+    wrapped._legacy    = True
+    wrapped._orig_sig  = orig_sig
+    return wrapped
+
+
+def _wrap_batch(fn):
+    """Wrap fn(list[Payload], ...) -> list[Payload], checking it returns one payload per input."""
+    def wrapped(payloads: list, **kwargs) -> list:
+        results = fn(list(payloads), **kwargs)
+        if not isinstance(results, list) or len(results) != len(payloads):
+            got = f"{len(results)} item(s)" if isinstance(results, list) else type(results).__name__
+            raise ValueError(f"batch step returned {got} for {len(payloads)} payload(s)")
+        return results
+
+    wrapped.__name__  = fn.__name__
+    wrapped.__doc__   = fn.__doc__
+    wrapped._batch    = True
+    wrapped._orig_sig = inspect.signature(fn)
+    return wrapped
+
+
+def _discover_fn_args(fn) -> list:
+    """Return [{name, type, default, label}] for every kwarg beyond the first param."""
+    sig    = getattr(fn, '_orig_sig', None) or inspect.signature(fn)
+    params = list(sig.parameters.values())
+    result = []
+    for p in params[1:]:
+        if p.kind in (inspect.Parameter.VAR_POSITIONAL, inspect.Parameter.VAR_KEYWORD):
+            continue
+        if p.default is inspect.Parameter.empty:
+            continue
+        result.append({
+            "name":    p.name,
+            "type":    type(p.default).__name__,
+            "default": p.default,
+            "label":   p.name.replace('_', ' ').title(),
+        })
+    return result
+
+
+def _coerce_arg(value, default):
+    """Coerce a JSON-decoded value to the same type as the parameter default."""
+    try:
+        return type(default)(value)
+    except (ValueError, TypeError):
+        return value
+
+
+PLUGIN_RELOAD_SECS     = 1.0    # how often the registry re-stats plugins/ for edits
+PLUGIN_SCAN_WAIT_SECS  = 60.0   # longest a run waits for a changed file's manifest
+PLUGIN_MANIFEST        = os.path.join(PLUGIN_DIR, '.manifest.json')
+PLUGIN_MANIFEST_FORMAT = 2      # bump when the shape of registry entries changes
+PLUGIN_HOOKS           = ("setup", "teardown")
+
+
+class PluginState(types.SimpleNamespace):
+    """Per-process scratch space for one plugin module (see setup()/teardown())."""
+
+
+_plugin_live = {}   # filename → (module, state) whose setup() ran; teardown() still due
+
+
+def _call_hook(module, name: str, state: PluginState) -> None:
+    hook = getattr(module, name, None)
+    if not callable(hook):
+        return
+    if inspect.signature(hook).parameters:
+        hook(state)
+    else:
+        hook()
+
+
+def _setup_plugin(module) -> PluginState:
+    state = PluginState(module=module.__name__, pid=os.getpid())
+    module.plugin_state = state
+    _call_hook(module, "setup", state)
+    return state
+
+
+def _teardown_plugin(filename: str) -> None:
+    module, state = _plugin_live.pop(filename, (None, None))
+    if module is None:
+        return
+    try:
+        _call_hook(module, "teardown", state)
+    except Exception as e:
+        print(f"[plugins] teardown() failed for {filename}: {e}")
+
+
+@atexit.register
+def _teardown_plugins() -> None:
+    for filename in list(_plugin_live):
+        _teardown_plugin(filename)
+
+
+def _load_plugin_file(filename: str) -> dict:
+    """
+    Import one plugin file and return its registry entries: one hidden
+    "module.function" entry per public function, then the module entry.
+    Returns {} if the file fails to import or has no public functions.  The
+    version it replaces is torn down only once this one has set up.
+    """
+    plugins = {}
+    module_name = filename[:-3]
+    path = os.path.join(PLUGIN_DIR, filename)
+
+    try:
+        spec   = importlib.util.spec_from_file_location(module_name, path)
+        if spec is None or spec.loader is None:
+            return {}
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    except Exception as e:
+        print(f"[plugins] Failed to import {filename}: {e}")
+        return {}
+    try:
+        state = _setup_plugin(module)
+    except Exception as e:
+        print(f"[plugins] setup() failed for {filename}: {e}")
+        return {}
+    _teardown_plugin(filename)      # the version being replaced, now that this one is up
+    _plugin_live[filename] = (module, state)
+
+    file_meta = {**DEFAULT_META, **getattr(module, 'PLUGIN_META', {})}
+
+    # Module-level deps are checked once (they apply to all functions)
+    missing = []
+    for pkg in file_meta.get("requires", []):
+        try:
+            importlib.import_module(pkg.replace("-", "_"))
+        except ImportError:
+            missing.append(f"pip:{pkg}")
+    for binary in file_meta.get("external", []):
+        if shutil.which(binary) is None:
+            missing.append(f"bin:{binary}")
+    deps_ok = len(missing) == 0
+
+    module_funcs = []
+    module_args  = {}   # {name: arg_dict}, deduplicated across all fns in module
+    for fn_name, fn in inspect.getmembers(module, inspect.isfunction):
+        if fn_name.startswith('_') or fn_name in PLUGIN_HOOKS or fn.__module__ in (__name__, "pipeline"):
+            continue    # private helpers, lifecycle hooks, and the plugin API imported from here
+        fn_meta = {**file_meta, **getattr(fn, 'plugin_meta', {})}
+        if fn_meta.get("batch"):
+            callable_fn = _wrap_batch(fn)   # its own entry only: the module step stays per-file
+        else:
+            callable_fn = _wrap_legacy(fn) if _is_legacy(fn) else fn
+            module_funcs.append(callable_fn)
+
+            # Collect discoverable args from this function
+            for arg in _discover_fn_args(callable_fn):
+                if arg["name"] not in module_args:
+                    module_args[arg["name"]] = arg
+
+        # Per-function key: used by "Add Step" picker and for backwards
+        # compatibility with pipelines saved before the one-entry-per-file change.
+        if fn_meta["label"] is None:
+            fn_meta["label"] = f"{module_name}.{fn_name}"
+        fn_meta["args"] = _discover_fn_args(callable_fn)
+        plugins[f"{module_name}.{fn_name}"] = {
+            "funcs":       [callable_fn],
+            "meta":        fn_meta,
+            "module":      module_name,
+            "deps_ok":     deps_ok,
+            "missing_deps": missing,
+            "_ui_hidden":  True,
+            "func_count":  1,
+        }
+
+    if not module_funcs:
+        return plugins              # batch-only files get no module entry
+
+    mod_meta = {**file_meta}
+    if mod_meta["label"] is None:
+        mod_meta["label"] = module_name.replace('_', ' ').title()
+
+    # Allow PLUGIN_META["args"] to override labels/add hints for individual args
+    for override in file_meta.get("args", []):
+        name = override.get("name")
+        if name and name in module_args:
+            module_args[name].update(override)
+
+    mod_meta["args"] = list(module_args.values())
+
+    plugins[module_name] = {
+        "funcs":       module_funcs,
+        "meta":        mod_meta,
+        "deps_ok":     deps_ok,
+        "missing_deps": missing,
+        "_ui_hidden":  False,
+        "func_count":  len(module_funcs),
+    }
+
+    return plugins
+
+
+class _PluginRegistry:
+    """
+    Plugin metadata and loaded modules, cached per file by (mtime_ns, size).
+
+    Listing plugins never needs their code: catalog() is answered from
+    plugins/.manifest.json for every file whose stamp still matches, so
+    plugin modules (and whatever heavy packages they import) are only loaded
+    when a run needs them — get(modules) imports just those.  The folder is
+    re-stat'ed at most every PLUGIN_RELOAD_SECS; added or changed files are
+    re-imported, so edits take effect without a restart.  reload() forces a
+    full re-import (e.g. after installing a missing package).
+
+    With a scanner set (the server sets one that asks a sandbox worker), the
+    manifest of an added or changed file is built by scanner(filename) on a
+    background thread instead, so listing never waits for, or runs, plugin
+    code; the file is left out of the catalog until its scan is done.  A
+    scanner returning None means "import it here".
+    """
+
+    def __init__(self):
+        self._lock     = threading.RLock()
+        self._files    = {}     # filename → {"stamp", "manifest", "entries" (None until imported)}
+        self._catalog  = {}
+        self._checked  = None
+        self._reloads  = 0
+        self._manifest = None   # on-disk manifest, read once
+        self._pending  = {}     # filename → Event set when its scan finishes
+        self._deps     = {}     # filename → _deps_installed() at the last refresh
+        self.scanner   = None   # filename → manifest entries (or None); see above
+        self.version   = ''
+
+    def catalog(self, modules=None) -> dict:
+        """
+        Registry entries without "funcs" — what the UI lists.  For the given
+        module stems, waits for scans still running.
+        """
+        self._maybe_refresh()
+        if modules is not None:
+            self._wait_scans(modules)
+        return self._catalog
+
+    def settled(self) -> dict:
+        """catalog() once every scan in progress has finished."""
+        self._maybe_refresh()
+        self._wait_scans()
+        return self._catalog
+
+    def _wait_scans(self, modules=None) -> None:
+        for name, done in list(self._pending.items()):
+            if modules is None or name[:-3] in modules:
+                done.wait(PLUGIN_SCAN_WAIT_SECS)
+
+    def manifest(self, name: str) -> dict:
+        """One file's entries without "funcs", importing it in this process (a scanner's job)."""
+        self.invalidate()
+        self.get({name[:-3]})
+        return (self._files.get(name) or {}).get("manifest") or {}
+
+    def get(self, modules=None) -> dict:
+        """Full entries (with "funcs") for the given module stems, or all."""
+        self._maybe_refresh()
+        files = self._files
+        wanted = [name for name in files if modules is None or name[:-3] in modules]
+        if any(files[name]["entries"] is None for name in wanted):
+            with self._lock:
+                for name in wanted:
+                    if self._files.get(name, {}).get("entries", {}) is None:
+                        self._import(name)
+                files = self._files
+        plugins = {}
+        for name in wanted:
+            plugins.update(files[name]["entries"] or {})
+        return plugins
+
+    def invalidate(self) -> None:
+        self._checked = None
+
+    def reload(self) -> dict:
+        with self._lock:
+            for name in list(_plugin_live):
+                _teardown_plugin(name)
+            self._files    = {}
+            self._manifest = {}
+            self._reloads += 1
+            self._refresh()
+            self._checked = time.monotonic()
+        if self.scanner is not None:
+            self._wait_scans()
+            return self._catalog
+        return self.get()
+
+    def _maybe_refresh(self) -> None:
+        checked = self._checked
+        if checked is None or time.monotonic() - checked >= PLUGIN_RELOAD_SECS:
+            with self._lock:
+                if self._checked is checked:
+                    self._refresh()
+                    self._checked = time.monotonic()
+
+    def _import(self, name: str, publish: bool = True) -> None:
+        self._install(name, _load_plugin_file(name), publish)
+
+    def _install(self, name: str, entries: dict, publish: bool = True, manifest: dict = None) -> None:
+        if manifest is None:
+            manifest = json.loads(json.dumps(      # JSON round trip: same shape as a cached manifest
+                {key: {k: v for k, v in info.items() if k != "funcs"} for key, info in entries.items()},
+                default=str))
+        rec = self._files[name]
+        self._files = {**self._files, name: {**rec, "entries": entries, "manifest": manifest}}
+        self._deps  = {**self._deps, name: _deps_installed(manifest)}      # as of this import
+        if publish and manifest != rec["manifest"]:
+            self._publish()
+
+    def _scan(self, name: str, stamp: list) -> None:
+        """Build name's manifest with the scanner, off the lock, and install it if the file is unchanged."""
+        done = self._pending[name] = threading.Event()
+
+        def scan():
+            entries, manifest = None, None
+            try:
+                manifest = self.scanner(name)
+                if manifest is None:
+                    entries = _load_plugin_file(name)
+            except Exception as e:
+                print(f"[plugins] Could not scan {name}: {e}")
+                manifest = {}
+            with self._lock:
+                rec = self._files.get(name)
+                if rec is not None and rec["stamp"] == stamp:
+                    self._install(name, entries, manifest=manifest)
+                if self._pending.get(name) is done:
+                    del self._pending[name]
+            done.set()
+
+        threading.Thread(target=scan, name='plugin-scan', daemon=True).start()
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(PLUGIN_MANIFEST) as f:
+                data = json.load(f)
+            if data.get("format") == PLUGIN_MANIFEST_FORMAT:
+                return data.get("files", {})
+        except (OSError, ValueError, AttributeError):
+            pass
+        return {}
+
+    def _refresh(self) -> None:
+        stamps = {}
+        try:
+            with os.scandir(PLUGIN_DIR) as it:
+                for de in it:
+                    if de.name.endswith('.py') and de.name != '__init__.py':
+                        st = de.stat()
+                        stamps[de.name] = [st.st_mtime_ns, st.st_size]
+        except OSError:
+            pass
+        deps = {name: _deps_installed(rec["manifest"]) for name, rec in self._files.items() if rec["manifest"]}
+        redo = {name for name, state in deps.items() if name in self._deps and self._deps[name] != state}
+        self._deps = deps
+        if self.version and not redo and stamps == {name: rec["stamp"] for name, rec in self._files.items()}:
+            return
+        if self._manifest is None:
+            self._manifest = self._read_manifest()
+
+        old, changed = self._files, []
+        self._files = {}
+        for name in sorted(stamps):
+            rec = old.get(name)
+            if rec and rec["stamp"] == stamps[name] and name not in redo:
+                self._files[name] = rec
+                continue
+            cached = self._manifest.get(name)
+            if not rec and cached and cached.get("stamp") == stamps[name]:
+                self._files[name] = {"stamp": stamps[name], "manifest": cached["entries"], "entries": None}
+                continue
+            self._files[name] = {"stamp": stamps[name], "manifest": None, "entries": None}
+            if self.scanner is None:
+                self._import(name, publish=False)
+            changed.append(name)
+        for name in set(old) - set(self._files):
+            _teardown_plugin(name)
+        if self.version and old:
+            print(f"[plugins] Reloaded {changed + sorted(set(old) - set(self._files))}")
+        self._publish()
+        if self.scanner is not None:
+            for name in changed:
+                self._scan(name, stamps[name])
+
+    def _publish(self) -> None:
+        """Rebuild the catalog and version from self._files and persist the manifest."""
+        catalog = {}
+        h = hashlib.sha1(f"{self._reloads};".encode())
+        for name, rec in self._files.items():
+            catalog.update(rec["manifest"] or {})
+            missing = sorted({d for info in (rec["manifest"] or {}).values() for d in info.get("missing_deps", [])})
+            h.update(f"{name}:{rec['stamp'][0]}:{rec['stamp'][1]}:{','.join(missing)};".encode())
+        self._catalog, self.version = catalog, h.hexdigest()[:20]
+
+        files = {name: {"stamp": rec["stamp"], "entries": rec["manifest"]}
+                 for name, rec in self._files.items() if rec["manifest"] is not None}
+        if files == self._manifest:
+            return
+        self._manifest = files
+        tmp = f"{PLUGIN_MANIFEST}.tmp{os.getpid()}"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({"format": PLUGIN_MANIFEST_FORMAT, "files": files}, f, default=str)
+            os.replace(tmp, PLUGIN_MANIFEST)
+        except OSError as e:
+            print(f"[plugins] Could not write manifest: {e}")
+
+
+def _deps_installed(manifest: dict) -> tuple:
+    """
+    Which of a file's required packages and binaries are installed now, found
+    without importing anything.  A change (e.g. after pip install) makes the
+    registry re-scan the file, so deps_ok is current without a reload.
+    """
+    entries = list(manifest.values())
+    meta = next((e["meta"] for e in entries if not e.get("_ui_hidden")), entries[0]["meta"] if entries else {})
+    found = []
+    for pkg in meta.get("requires", []):
+        try:
+            found.append(importlib.util.find_spec(pkg.replace("-", "_")) is not None)
+        except (ImportError, ValueError):
+            found.append(False)
+    return (*found, *(shutil.which(binary) is not None for binary in meta.get("external", [])))
+
+
+_plugin_registry = _PluginRegistry()
+
+
+def plugin_registry_version() -> str:
+    """Fingerprint of the registry (file names, mtimes, sizes, missing dependencies, forced reloads)."""
+    _plugin_registry.catalog()
+    return _plugin_registry.version
+
+
+def plugin_catalog() -> dict:
+    """get_plugins() without "funcs", served from the manifest — imports nothing that is unchanged."""
+    return _plugin_registry.catalog()
+
+
+def get_plugins(modules=None) -> dict:
+    """
+    Return the plugin registry, keyed by module stem (one entry per plugin
+    file).  Legacy "module.function" keys are also stored with _ui_hidden=True
+    so saved pipelines built before this change still execute.  Pass a set of
+    module stems to import only those.  Treat the result as read-only.
+
+    {
+      "gcode_utils": {
+        "funcs":       [<callable>, ...],   # all public fns in file order
+        "meta":        { label, description, accepts, outputs, ... },
+        "deps_ok":     True,
+        "missing_deps": [],
+        "_ui_hidden":  False,
+        "func_count":  N,
+      },
+      "gcode_utils.remove_comments": { ..., "_ui_hidden": True },  # legacy compat
+      ...
+    }
+    """
+    return _plugin_registry.get(modules)
+
+
+# ── Executor ───────────────────────────────────────────────────────────────
+
+class StepError(Exception):
+    """
+    A pipeline could not be resolved or a step failed.  status mirrors the HTTP
+    code /execute answers with; report() is the JSON error body.
+    """
+
+    def __init__(self, message: str, status: int = 500, trace: str = None, **extra):
+        super().__init__(message)
+        self.status = status
+        self.trace  = trace
+        self.extra  = extra
+
+    def report(self) -> dict:
+        body = {"error": str(self)}
+        if self.trace:
+            body["trace"] = self.trace
+        body.update(self.extra)
+        return body
+
+
+class Cancelled(StepError):
+    """The run was cancelled, or ran past its deadline, before it finished."""
+
+
+class CancelToken:
+    """
+    Cooperative cancellation for one run.  cancel() may be called from any
+    thread; run_steps checks the token between steps, and plugins with long
+    loops can poll check_cancelled().  deadline_secs > 0 cancels the run by
+    itself once that much time has passed.
+    """
+
+    def __init__(self, deadline_secs: float = 0):
+        self.deadline_secs = deadline_secs
+        self.deadline      = time.monotonic() + deadline_secs if deadline_secs else None
+        self.reason        = None       # "cancelled" or "deadline"
+        self._event        = threading.Event()
+
+    def cancel(self, reason: str = "cancelled") -> None:
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline")
+        return self._event.is_set()
+
+    def remaining(self):
+        """Seconds left before the deadline, or None without one."""
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def check(self, step: str = None, **extra) -> None:
+        """Raise Cancelled (carrying extra report fields) if the run should stop."""
+        if not self.cancelled:
+            return
+        where = f" at step '{step}'" if step else ""
+        if self.reason == "deadline":
+            raise Cancelled(f"Run stopped{where}: its {self.deadline_secs:g} s deadline passed", 504,
+                            cancelled=True, reason="deadline", **extra)
+        raise Cancelled(f"Run cancelled{where}", 409, cancelled=True, reason="cancelled", **extra)
+
+
+_current_cancel = contextvars.ContextVar('cancel', default=None)
+
+
+def cancel_requested() -> bool:
+    """For plugins: True once the run this step belongs to has been cancelled."""
+    token = _current_cancel.get()
+    return token is not None and token.cancelled
+
+
+def check_cancelled() -> None:
+    """For plugins: raise Cancelled if the current run has been cancelled (call it in long loops)."""
+    token = _current_cancel.get()
+    if token is not None:
+        token.check()
+
+
+# A saved step is either a plugin step or a fork:
+#
+#   {"pluginKey": "module.fn", "args": {...}, "isChecked": true}
+#   {"branches": [{"name": "laser",   "steps": [...], "output": "part_laser.gcode"},
+#                 {"name": "endmill", "steps": [...]}],
+#    "join": ""}
+#
+# A fork hands every branch the payload as it stands, shared copy-on-write:
+# the data is made immutable (lists become TextLines) and each branch gets its
+# own Payload and meta, so no branch can see another's edits.  Branches run
+# concurrently on threads.  Without a join the fork must be the last step and
+# each branch's result is a separate output file (its "output" name, or
+# <stem>_<branch><ext>); with "join": "concat" the branch results are
+# concatenated in branch order and the pipeline continues.
+
+FORK_JOINS     = ("", "concat")
+BRANCH_WORKERS = 4
+BRANCH_NAME_RE = re.compile(r'[A-Za-z0-9_-]{1,40}')
+
+
+@dataclass
+class Fork:
+    branches: list          # [(name, output name or "", resolved steps)]
+    join:     str = ""
+
+
+def _step_modules(scripts: list) -> set:
+    modules = set()
+    for step in scripts:
+        if isinstance(step.get('branches'), list):
+            for branch in step['branches']:
+                modules |= _step_modules(branch.get('steps') or [])
+        else:
+            modules.add(str(step.get('pluginKey')).split('.', 1)[0])
+    return modules
+
+
+def _resolve_fork(step: dict, plugins: dict) -> Fork:
+    join = step.get('join') or ""
+    if join not in FORK_JOINS:
+        raise StepError(f"Unknown fork join '{join}' (expected one of {list(FORK_JOINS)[1:]})", 400)
+    branches, names, outputs = [], set(), set()
+    for branch in step['branches']:
+        name   = str(branch.get('name') or f"b{len(branches) + 1}")
+        output = os.path.basename(str(branch.get('output') or ''))
+        if not BRANCH_NAME_RE.fullmatch(name) or name in names:
+            raise StepError(f"Fork branch names must be unique and use A-Z a-z 0-9 _ - (got '{name}')", 400)
+        if output and output in outputs:
+            raise StepError(f"Fork branches write the same output '{output}'", 400)
+        names.add(name)
+        outputs.add(output)
+        steps = resolve_steps(branch.get('steps') or [], plugins)
+        if join and steps and isinstance(steps[-1], Fork) and not steps[-1].join:
+            raise StepError(f"Branch '{name}' ends in a fork, so it has no result to join", 400)
+        branches.append((name, output, steps))
+    if not branches:
+        raise StepError("A fork needs at least one branch", 400)
+    return Fork(branches, join)
+
+
+def resolve_steps(scripts: list, plugins: dict = None) -> list:
+    """
+    Validate saved steps ([{"pluginKey", "args"}, ...] and forks) against the
+    registry before anything touches a file.  Returns [(key, funcs, meta,
+    args) or Fork, ...], skipping steps with isChecked false.  Without an
+    explicit registry, only the modules the steps use are imported.  Against
+    the catalog (see validate_steps), funcs is None.
+    """
+    if plugins is None:
+        plugins = get_plugins(_step_modules(scripts))
+    active_steps = []
+    for step in scripts:
+        if not step.get('isChecked', True):
+            continue
+        if isinstance(step.get('branches'), list):
+            active_steps.append(_resolve_fork(step, plugins))
+            continue
+        key = step.get('pluginKey')
+        if key not in plugins:
+            raise StepError(f"Unknown plugin: '{key}'", 400)
+        info = plugins[key]
+        if not info["deps_ok"]:
+            raise StepError(f"Plugin '{key}' has unsatisfied dependencies.", 400,
+                            missing_deps=info["missing_deps"])
+        active_steps.append((key, info.get("funcs"), info["meta"], step.get('args', {})))
+    for step in active_steps[:-1]:
+        if isinstance(step, Fork) and not step.join:
+            raise StepError("Only the last step can be a fork without a join", 400)
+    return active_steps
+
+
+def validate_steps(scripts: list) -> list:
+    """
+    resolve_steps against the plugin catalog: checks keys, dependencies and
+    forks without importing any plugin, for runs that happen in a sandbox.
+    """
+    return resolve_steps(scripts, _plugin_registry.catalog(_step_modules(scripts)))
+
+
+def branch_output_name(filename: str, branch: str, output: str = "") -> str:
+    """
+    File name for a fork branch's result: its own output name, or
+    <stem>_<branch><ext>. A branch may not write over the run's input.
+    """
+    if output == filename:
+        raise StepError(f"Fork branch '{branch}' output '{output}' would overwrite the input file", 400)
+    if output:
+        return output
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}_{branch}{ext}"
+
+
+def _share(payload: Payload) -> Payload:
+    """Freeze payload.data so branches can share it without copying."""
+    data = payload.data
+    if isinstance(data, TextLines) and data.edited:
+        data = data.tolist()
+    if isinstance(data, list) and _splits_cleanly(data):
+        data = TextLines.from_lines(data)
+    elif isinstance(data, bytearray):
+        data = bytes(data)
+    return Payload(data, payload.mime_type, payload.filename, payload.meta, payload.origin)
+
+
+def _branch_copy(shared: Payload) -> Payload:
+    """A branch's own Payload over shared data: same (frozen) data, private meta."""
+    data = shared.data
+    if isinstance(data, list):
+        data = list(data)
+    elif isinstance(data, TextLines):
+        data = data[:]              # its own view, so an edit copies only for this branch
+    return Payload(data, shared.mime_type, shared.filename,
+                   copy.deepcopy(shared.meta), shared.origin)
+
+
+def _join(results: list) -> Payload:
+    first = results[0]
+    meta  = {}
+    for p in results:
+        meta.update(p.meta)
+    if all(isinstance(p.data, (TextLines, list)) for p in results):
+        data = first.data
+        for p in results[1:]:
+            data = data + p.data
+    else:
+        data = b''.join(bytes(p.data) if not isinstance(p.data, str) else p.data.encode(TEXT_ENCODING)
+                        for p in results)
+    return Payload(data, first.mime_type, first.filename, meta)
+
+
+def _run_fork(payload: Payload, fork: Fork, on_step, branch: str, cancel):
+    """Run a fork's branches concurrently; returns (joined payload or None, step_log, outputs)."""
+    from concurrent.futures import ThreadPoolExecutor
+
+    shared = _share(payload)
+
+    def run_branch(name, output, steps):
+        path = f"{branch}/{name}" if branch else name
+        result, log, outputs = run_steps(_branch_copy(shared), steps, on_step, branch=path, cancel=cancel)
+        if result is not None and not fork.join:
+            outputs = [(path.replace('/', '_'), output, result)]
+        return result, log, outputs
+
+    workers = min(len(fork.branches), BRANCH_WORKERS)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='branch') as pool:
+        futures = [pool.submit(run_branch, *b) for b in fork.branches]
+        results = [f.result() for f in futures]     # first failing branch (in order) raises
+
+    step_log = [entry for _, log, _ in results for entry in log]
+    outputs  = [out for _, _, outs in results for out in outs]
+    if fork.join:
+        return _join([r for r, _, _ in results]), step_log, outputs
+    return None, step_log, outputs
+
+
+def run_steps(payload: Payload, active_steps: list,
+              on_step: Callable[[dict], None] = None, branch: str = "",
+              cancel: CancelToken = None) -> tuple:
+    """
+    Pass payload through each resolved step and return (payload, step_log,
+    outputs).  outputs lists (branch, output name, payload) for every branch
+    of a closing fork; payload is then None.  on_step, if given, receives
+    {step, index, total, status[, duration_ms][, branch]} as each step starts
+    ("running") and finishes ("ok").  Halts at the first failing function
+    with a StepError listing the steps that completed, or with Cancelled
+    once cancel is cancelled (checked before every step).
+    """
+    reset = _current_cancel.set(cancel)
+    try:
+        return _run_steps(payload, active_steps, on_step, branch, cancel)
+    finally:
+        _current_cancel.reset(reset)
+
+
+def _run_steps(payload, active_steps, on_step, branch, cancel) -> tuple:
+    step_log = []
+    total    = len(active_steps)
+    where    = f"[{branch}] " if branch else ""
+    tag      = {"branch": branch} if branch else {}
+    for index, step in enumerate(active_steps):
+        if cancel is not None and cancel.cancelled:
+            cancel.check(step[0] if isinstance(step, tuple) else None,
+                         completed=[s["step"] for s in step_log if "warning" not in s])
+        if isinstance(step, Fork):
+            payload, fork_log, outputs = _run_fork(payload, step, on_step, branch, cancel)
+            step_log += fork_log
+            if payload is None:
+                return None, step_log, outputs
+            continue
+        key, _, meta, _ = step
+        step_started = time.perf_counter()
+        if on_step:
+            on_step({"step": key, "index": index, "total": total, "status": "running", **tag})
+        accepted = meta.get("accepts", [])
+        if accepted and payload.mime_type not in accepted:
+            step_log.append({
+                "step":    key,
+                "warning": (
+                    f"type mismatch — plugin accepts {accepted}, "
+                    f"payload is '{payload.mime_type}'"
+                ),
+                **tag,
+            })
+
+        payload = _apply_step(step, payload, where, step_log, cancel)
+        step_log.append({"step": key, "status": "ok", **tag})
+        if on_step:
+            on_step({"step": key, "index": index, "total": total, "status": "ok",
+                     "duration_ms": round((time.perf_counter() - step_started) * 1000, 1), **tag})
+    return payload, step_log, []
+
+
+def _apply_step(step: tuple, payload, where: str, step_log: list, cancel):
+    """
+    Call a resolved step's functions in turn on payload — a Payload, or a
+    list of them when run_batch dispatches a batch step.  A batch function
+    given a single Payload sees a one-item list.
+    """
+    key, funcs, _, step_args = step
+    for fn in funcs:
+        try:
+            # Resolve which of the step's args this fn accepts
+            sig        = getattr(fn, '_orig_sig', None) or inspect.signature(fn)
+            fn_params  = dict(list(sig.parameters.items())[1:])  # skip first param
+            fn_kwargs  = {
+                k: _coerce_arg(v, fn_params[k].default)
+                for k, v in step_args.items()
+                if k in fn_params and fn_params[k].default is not inspect.Parameter.empty
+            }
+            if getattr(fn, '_batch', False) and isinstance(payload, Payload):
+                payload = fn([payload], **fn_kwargs)[0]
+            else:
+                payload = fn(payload, **fn_kwargs)
+        except Cancelled:
+            if cancel is not None:      # re-raise naming the step and what finished
+                cancel.check(key, completed=[s["step"] for s in step_log if "warning" not in s])
+            raise
+        except ValueError as e:
+            raise StepError(
+                f"{where}Step '{key}' → '{fn.__name__}': bad input — {e}", 400,
+                completed=[s["step"] for s in step_log if "warning" not in s],
+            ) from e
+        except Exception as e:
+            raise StepError(
+                f"{where}Step '{key}' → '{fn.__name__}': {type(e).__name__}: {e}", 500,
+                trace=traceback.format_exc(),
+                completed=[s["step"] for s in step_log if "warning" not in s],
+            ) from e
+    return payload
+
+
+# ── Batches ────────────────────────────────────────────────────────────────
+#
+# A batch step (every function marked "batch") sees all files of a batch in
+# one call, so it can build one model or one combined bounding box for the
+# lot.  run_batch splits the steps at each batch step: the stretches of
+# per-file steps in between run file by file, exactly as run_steps would,
+# and each batch step is called once with the payloads still in the batch.
+# A file whose per-file step fails drops out; a failing batch step fails
+# every file still in.  Batch steps inside fork branches run per file.
+
+def is_batch_step(step) -> bool:
+    """True for a resolved plugin step whose functions all take the whole batch."""
+    return isinstance(step, tuple) and all(getattr(fn, '_batch', False) for fn in step[1])
+
+
+def run_batch(payloads: list, active_steps: list,
+              on_step: Callable[[dict], None] = None, cancel: CancelToken = None) -> list:
+    """
+    Run resolved steps over a batch of payloads.  Returns one entry per
+    input, in order: (payload, step_log, outputs) as run_steps returns, or
+    the StepError that stopped that file.  on_step events carry "item" (the
+    input's index) for per-file steps and "items" (how many files it got)
+    for batch steps.  Cancelled stops the whole batch and is raised.
+    """
+    reset = _current_cancel.set(cancel)
+    try:
+        return _run_batch(payloads, active_steps, on_step, cancel)
+    finally:
+        _current_cancel.reset(reset)
+
+
+def _run_batch(payloads, active_steps, on_step, cancel) -> list:
+    total   = len(active_steps)
+    results = [[payload, [], []] for payload in payloads]
+    start   = 0
+    while start < total:
+        live = [i for i, r in enumerate(results) if isinstance(r, list) and r[0] is not None]
+        if not live:
+            break
+        if is_batch_step(active_steps[start]):
+            _run_batch_step(results, live, active_steps[start], start, total, on_step, cancel)
+            start += 1
+            continue
+        stop = next((i for i in range(start, total) if is_batch_step(active_steps[i])), total)
+        for i in live:
+            def item_step(ev, i=i):
+                on_step({**ev, "index": ev["index"] + start, "total": total, "item": i})
+            payload, step_log, _ = results[i]
+            try:
+                payload, more, outputs = _run_steps(payload, active_steps[start:stop],
+                                                    on_step and item_step, "", cancel)
+            except Cancelled:
+                raise
+            except StepError as e:
+                e.extra["completed"] = [s["step"] for s in step_log if "warning" not in s] + \
+                                       e.extra.get("completed", [])
+                results[i] = e
+                continue
+            results[i] = [payload, step_log + more, outputs]
+        start = stop
+    return [r if isinstance(r, StepError) else tuple(r) for r in results]
+
+
+def _run_batch_step(results: list, live: list, step: tuple, index: int, total: int, on_step, cancel) -> None:
+    key, _, meta, _ = step
+    if cancel is not None and cancel.cancelled:
+        cancel.check(key, completed=[s["step"] for s in results[live[0]][1] if "warning" not in s])
+    step_started = time.perf_counter()
+    if on_step:
+        on_step({"step": key, "index": index, "total": total, "status": "running", "items": len(live)})
+    accepted = meta.get("accepts", [])
+    for i in live:
+        payload, step_log, _ = results[i]
+        if accepted and payload.mime_type not in accepted:
+            step_log.append({
+                "step":    key,
+                "warning": f"type mismatch — plugin accepts {accepted}, payload is '{payload.mime_type}'",
+            })
+    try:
+        batch = _apply_step(step, [results[i][0] for i in live], "", results[live[0]][1], cancel)
+    except Cancelled:
+        raise
+    except StepError as e:
+        for i in live:
+            results[i] = e
+        return
+    for i, payload in zip(live, batch):
+        results[i][0] = payload
+        results[i][1].append({"step": key, "status": "ok", "batch": len(live)})
+    if on_step:
+        on_step({"step": key, "index": index, "total": total, "status": "ok", "items": len(live),
+                 "duration_ms": round((time.perf_counter() - step_started) * 1000, 1)})
+
+
+# ── Plugin sandbox ─────────────────────────────────────────────────────────
+#
+# The server runs plugin steps in a pool of reusable worker processes, so a
+# plugin that loops forever or eats memory costs one worker, not the server.
+# A worker is `python -c "import pipeline; pipeline.worker_main()"` (no
+# Flask) speaking pickles over its stdin/stdout; plugin prints go to stderr.
+# It imports plugins itself and reads the input file directly, so only the
+# results cross back, through shared memory.
+#
+# Limits, per step:
+#   time   — the parent kills a worker whose step runs past step_secs; the
+#            worker also sets RLIMIT_CPU, so a spinning step dies on its own
+#   memory — RLIMIT_DATA caps the worker's heap (the plugin sees MemoryError)
+#            and the parent kills a worker whose anonymous RSS passes the
+#            limit.  File and shared-memory mappings are not counted.
+# A worker that is killed, crashes or hits its memory limit is replaced.  The
+# resource limits and the RSS check need POSIX and Linux; elsewhere only the
+# time limit applies.  Cancelling a run forwards the cancel to its worker,
+# whose CancelToken stops the run at the next check.
+
+SANDBOX_WORKERS           = 2
+SANDBOX_STEP_SECS         = 120.0
+SANDBOX_MEMORY_MB         = 2048
+SANDBOX_POLL_SECS         = 0.1
+SANDBOX_CANCEL_GRACE_SECS = 2.0     # time a cancelled step gets to notice before its worker is killed
+
+_WORKER_ENTRY = "import sys, pipeline; sys.exit(pipeline.worker_main(sys.argv[1:]))"
+
+
+def _apply_memory_limit(memory_mb: int):
+    """Cap this process's heap at memory_mb; returns the resource module, or None off POSIX."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    if memory_mb:
+        _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        limit   = memory_mb * 1024 * 1024
+        if hard != resource.RLIM_INFINITY:
+            limit = min(limit, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+    return resource
+
+
+def worker_main(argv: list) -> int:
+    """Sandbox worker loop: run tasks from the parent until its end of stdin closes."""
+    memory_mb = int(argv[0]) if argv else 0
+    channel   = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())       # stray prints must not corrupt the channel
+    sys.stdout = sys.stderr
+    resource   = _apply_memory_limit(memory_mb)
+    send_lock  = threading.Lock()                          # fork branches report from threads
+    tasks      = queue.Queue()
+    current    = {}
+
+    def send(*message):
+        with send_lock:
+            pickle.dump(message, channel, pickle.HIGHEST_PROTOCOL)
+            channel.flush()
+
+    def read():
+        # ("run", source, scripts, step_secs, deadline_secs), ("manifest", filename) or
+        # ("cancel", reason); source is a file path, a shared-memory handle, or a list
+        # of paths for a batch.  A cancel applies to the run read before it, even if
+        # it has not started yet.
+        try:
+            while True:
+                message = pickle.load(sys.stdin.buffer)
+                if message[0] == "cancel":
+                    if current.get("token"):
+                        current["token"].cancel(message[1])
+                    continue
+                if message[0] == "manifest":
+                    tasks.put((message, None))
+                    continue
+                current["token"] = CancelToken(message[4])
+                tasks.put((message, current["token"]))
+        except (EOFError, OSError):
+            if current.get("token"):
+                current["token"].cancel()       # the parent is gone; stop at the next check
+            tasks.put(None)
+
+    threading.Thread(target=read, name='sandbox-reader', daemon=True).start()
+    sent = []
+    while True:
+        task = tasks.get()
+        if task is None:
+            return 0
+        if task[0][0] == "manifest":
+            try:
+                send("manifest", _plugin_registry.manifest(task[0][1]))
+            except Exception as e:
+                send("error", {"error": f"{type(e).__name__}: {e}", "trace": traceback.format_exc()}, 500)
+            continue
+        (_, source, scripts, step_secs, _), cancel = task
+        for handle in sent:             # the parent has attached to the previous results by now
+            release_shared(handle)
+        sent, running = [], {}
+
+        def on_step(ev):
+            if ev["status"] == "running":
+                running["step"] = ev["step"]
+                if resource and step_secs:
+                    usage = resource.getrusage(resource.RUSAGE_SELF)
+                    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+                    soft = int(usage.ru_utime + usage.ru_stime + step_secs) + 1
+                    resource.setrlimit(resource.RLIMIT_CPU,
+                                       (soft if hard == resource.RLIM_INFINITY else min(soft, hard), hard))
+            send("step", ev)
+
+        def share(source, result, step_log, outputs) -> tuple:
+            unchanged = isinstance(source, str) and result is not None and payload_unchanged(result, source)
+            handle    = None if result is None or unchanged else payload_to_shared(result)
+            outputs   = [(branch, output, payload_to_shared(p)) for branch, output, p in outputs]
+            sent.extend(h for h in [handle, *(h for _, _, h in outputs)] if h)
+            return "done", handle, unchanged, step_log, outputs
+
+        try:
+            if isinstance(source, list):    # a batch of file paths
+                items = run_batch([payload_from_file(path) for path in source], resolve_steps(scripts),
+                                  on_step, cancel=cancel)
+                cancel.check()
+                for item in items:
+                    if isinstance(item, StepError) and isinstance(item.__cause__, MemoryError):
+                        raise item
+                send("batch", [("error", item.report(), item.status) if isinstance(item, StepError)
+                               else share(path, *item) for path, item in zip(source, items)])
+            else:
+                payload = payload_from_file(source) if isinstance(source, str) else payload_from_shared(source)
+                result, step_log, outputs = run_steps(payload, resolve_steps(scripts), on_step, cancel=cancel)
+                cancel.check()
+                send(*share(source, result, step_log, outputs))
+        except StepError as e:
+            if isinstance(e.__cause__, MemoryError):
+                send("error", {"error": f"Step '{running.get('step')}' exceeded the {memory_mb} MB memory limit",
+                               "limit": "memory", "completed": e.extra.get("completed", [])}, 500)
+                return 1                # a worker that hit its heap limit is not reused
+            send("error", e.report(), e.status)
+        except Exception as e:
+            send("error", {"error": f"{type(e).__name__}: {e}", "trace": traceback.format_exc()}, 500)
+        finally:
+            if isinstance(source, dict):
+                release_shared(source)
+
+
+class _SandboxWorker:
+    def __init__(self, memory_mb: int):
+        self.proc    = subprocess.Popen([sys.executable, '-c', _WORKER_ENTRY, str(memory_mb)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=BASE_DIR)
+        self.inbox   = queue.Queue()
+        self.settled = True             # False while a task is out; see PluginSandbox.run
+        threading.Thread(target=self._read, name=f'sandbox-{self.proc.pid}', daemon=True).start()
+
+    def _read(self) -> None:
+        try:
+            while True:
+                self.inbox.put(pickle.load(self.proc.stdout))
+        except (EOFError, OSError, pickle.UnpicklingError):
+            self.inbox.put(None)        # the worker is gone
+
+    def send(self, task) -> bool:
+        try:
+            pickle.dump(task, self.proc.stdin, pickle.HIGHEST_PROTOCOL)
+            self.proc.stdin.flush()
+            return True
+        except OSError:
+            return False
+
+    def rss_bytes(self) -> int:
+        """Anonymous resident memory (heap), or 0 where /proc is not available."""
+        try:
+            with open(f'/proc/{self.proc.pid}/status') as f:
+                for line in f:
+                    if line.startswith('RssAnon:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def kill(self) -> None:
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+        for stream in (self.proc.stdin, self.proc.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class PluginSandbox:
+    """
+    Run steps in worker processes with per-step time and memory limits.
+    run() has the contract of run_steps; a step that breaks a limit raises a
+    StepError naming the step and the limit ("limit": "time" | "memory").
+    """
+
+    def __init__(self, workers: int = SANDBOX_WORKERS, step_secs: float = SANDBOX_STEP_SECS,
+                 memory_mb: int = SANDBOX_MEMORY_MB):
+        self.workers   = max(1, workers)
+        self.step_secs = step_secs
+        self.memory_mb = memory_mb
+        self._slots    = threading.BoundedSemaphore(self.workers)
+        self._idle     = []
+        self._lock     = threading.Lock()
+        self._closed   = False
+
+    def run(self, source, scripts: list, on_step: Callable[[dict], None] = None,
+            cancel: CancelToken = None) -> tuple:
+        """
+        Run scripts on source (a file path, read by the worker, or a Payload)
+        and return (payload, step_log, outputs) as run_steps does; a list of
+        paths is run as a batch (see run_batch).  A result
+        identical to the file at source comes back as that file, unchanged.
+        Cancelling passes the cancel on to the worker; one that does not stop
+        within SANDBOX_CANCEL_GRACE_SECS is killed.
+        """
+        if cancel is not None:
+            cancel.check()
+        handle = payload_to_shared(source) if isinstance(source, Payload) else source
+        try:
+            self._acquire(cancel)
+            try:
+                worker = self._checkout()
+                try:
+                    return self._run(worker, handle, scripts, on_step, cancel)
+                finally:
+                    if not worker.settled:      # interrupted mid-task: its late replies would
+                        self._replace(worker)   # reach the next run, so it is not reused
+            finally:
+                self._slots.release()
+        finally:
+            if isinstance(handle, dict):
+                release_shared(handle)
+
+    def _acquire(self, cancel: CancelToken = None) -> None:
+        """Wait for a free worker; a cancel or a passed deadline ends the wait with Cancelled."""
+        while True:
+            remaining = cancel.remaining() if cancel is not None else None
+            timeout   = SANDBOX_POLL_SECS if remaining is None else min(SANDBOX_POLL_SECS, remaining)
+            if self._slots.acquire(timeout=timeout):
+                return
+            if cancel is not None:
+                cancel.check()
+
+    def run_batch(self, sources: list, scripts: list, on_step: Callable[[dict], None] = None,
+                  cancel: CancelToken = None) -> list:
+        """run_batch over file paths in one worker; returns one entry per source, as run_batch does."""
+        return self.run(list(sources), scripts, on_step, cancel)
+
+    def manifest(self, filename: str) -> dict:
+        """
+        A plugin file's registry entries without "funcs", built by importing it
+        in a worker, under the step time limit; the registry's scanner in the
+        server, so plugin code never runs there.
+        """
+        with self._slots:
+            worker = self._checkout()
+            try:
+                if not worker.send(("manifest", filename)):
+                    self._replace(worker)
+                    raise StepError("The plugin worker process could not be started", 500)
+                deadline = time.monotonic() + (self.step_secs or float('inf'))
+                while True:
+                    try:
+                        message = worker.inbox.get(timeout=SANDBOX_POLL_SECS)
+                    except queue.Empty:
+                        if time.monotonic() > deadline:
+                            self._replace(worker)
+                            raise StepError(f"Importing {filename} exceeded the {self.step_secs:g} s time limit",
+                                            500, limit="time")
+                        continue
+                    if message is None:
+                        code = worker.proc.wait()
+                        self._replace(worker)
+                        raise StepError(f"Importing {filename} crashed its worker process (exit code {code})", 500)
+                    self._checkin(worker)
+                    if message[0] == "error":
+                        raise self._error(message)
+                    return message[1]
+            finally:
+                if not worker.settled:
+                    self._replace(worker)
+
+    def _run(self, worker: _SandboxWorker, handle, scripts: list, on_step, cancel):
+        remaining = cancel.remaining() if cancel is not None else None
+        if not worker.send(("run", handle, scripts, self.step_secs, remaining or 0)):
+            self._replace(worker)
+            raise StepError("The plugin worker process could not be started", 500)
+        step, completed, cancel_sent = None, [], None
+        deadline = time.monotonic() + (self.step_secs or float('inf'))
+        while True:
+            try:
+                message = worker.inbox.get(timeout=SANDBOX_POLL_SECS)
+            except queue.Empty:
+                message = False
+            if cancel is not None and cancel.cancelled:
+                if cancel_sent is None:
+                    worker.send(("cancel", cancel.reason))
+                    cancel_sent = time.monotonic()
+                elif time.monotonic() - cancel_sent > SANDBOX_CANCEL_GRACE_SECS:
+                    self._replace(worker)
+                    cancel.check(step, completed=completed)
+            if message is False:
+                if time.monotonic() > deadline:
+                    self._replace(worker)
+                    raise StepError(f"Step '{step}' exceeded the {self.step_secs:g} s time limit", 500,
+                                    limit="time", completed=completed)
+                if self.memory_mb and worker.rss_bytes() > self.memory_mb * 1024 * 1024:
+                    self._replace(worker)
+                    raise StepError(f"Step '{step}' exceeded the {self.memory_mb} MB memory limit", 500,
+                                    limit="memory", completed=completed)
+                continue
+
+            if message is None:
+                code = worker.proc.wait()
+                self._replace(worker)
+                if code == -getattr(signal, 'SIGXCPU', 0):
+                    raise StepError(f"Step '{step}' exceeded the {self.step_secs:g} s time limit (CPU)", 500,
+                                    limit="time", completed=completed)
+                raise StepError(f"Step '{step}' crashed its worker process (exit code {code})", 500,
+                                completed=completed)
+
+            kind = message[0]
+            if kind == "step":
+                ev = message[1]
+                if ev["status"] == "running":
+                    step, deadline = ev["step"], time.monotonic() + (self.step_secs or float('inf'))
+                else:
+                    completed.append(ev["step"])
+                if on_step:
+                    on_step(ev)
+            elif kind == "error":
+                if message[1].get("limit") == "memory":
+                    self._replace(worker)
+                else:
+                    self._checkin(worker)
+                raise self._error(message)
+            elif kind == "batch":
+                self._checkin(worker)
+                return [self._error(reply) if reply[0] == "error" else self._result(path, reply)
+                        for path, reply in zip(handle, message[1])]
+            else:
+                self._checkin(worker)
+                return self._result(handle, message)
+
+    @staticmethod
+    def _error(message: tuple) -> StepError:
+        report, status = dict(message[1]), message[2]
+        error = Cancelled if report.get("cancelled") else StepError
+        return error(report.pop("error"), status, report.pop("trace", None), **report)
+
+    @staticmethod
+    def _result(source, message: tuple) -> tuple:
+        _, result, unchanged, step_log, outputs = message
+        if unchanged:
+            payload = payload_from_file(source)
+        else:
+            payload = payload_from_shared(result) if result else None
+        shared  = [result, *(h for _, _, h in outputs)]
+        outputs = [(branch, output, payload_from_shared(h)) for branch, output, h in outputs]
+        for h in shared:
+            if h:
+                release_shared(h)   # our mapping stays valid until the payload is dropped
+        return payload, step_log, outputs
+
+    def _checkout(self) -> _SandboxWorker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.proc.poll() is None:
+                    break
+                worker.kill()
+            else:
+                worker = _SandboxWorker(self.memory_mb)
+        worker.settled = False
+        return worker
+
+    def _checkin(self, worker: _SandboxWorker) -> None:
+        worker.settled = True
+        with self._lock:
+            if self._closed or worker.proc.poll() is not None:
+                worker.kill()
+            else:
+                self._idle.append(worker)
+
+    def _replace(self, worker: _SandboxWorker) -> None:
+        """Kill a worker and start its replacement, so the next run does not wait for it."""
+        worker.settled = True
+        worker.kill()
+        if not self._closed:
+            self._checkin(_SandboxWorker(self.memory_mb))
+
+    def close(self) -> None:
+        with self._lock:
+            self._closed, idle, self._idle = True, self._idle, []
+        for worker in idle:
+            worker.kill()
+
+
+# ── Headless runner ────────────────────────────────────────────────────────
+#
+#   python app.py run --preset "Tile Grid.json" [--out DIR] [--jobs N] files...
+#   (or python pipeline.py run ...)
+#
+# Runs a saved preset over files without the web server.  Outputs replace the
+# inputs (atomically; untouched if unchanged) unless --out names a directory.  --jobs > 1
+# runs files in worker processes; each worker loads the plugin registry once.
+# A preset with batch steps runs all files as one batch in this process.
+
+def load_preset(name: str) -> list:
+    """Read a preset by path or by name in presets/; returns its enabled steps."""
+    path = name if os.path.isfile(name) else os.path.join(PRESETS_DIR, name)
+    if not os.path.isfile(path) and not path.endswith('.json'):
+        path += '.json'
+    with open(path) as f:
+        steps = json.load(f)
+    if not isinstance(steps, list):
+        raise ValueError(f"{name}: not a preset (expected a list of steps)")
+    return [s for s in steps if isinstance(s, dict) and s.get('isChecked', True)]
+
+
+def run_file(scripts: list, src: str, dest: str) -> dict:
+    """Run scripts over src and write the result to dest; returns a report dict."""
+    started = time.perf_counter()
+    try:
+        active_steps = resolve_steps(scripts)
+        payload, step_log, outputs = run_steps(payload_from_file(src), active_steps)
+        written = _write_run(payload, outputs, dest)
+    except StepError as e:
+        return {"file": src, **e.report()}
+    except Exception as e:
+        return {"file": src, "error": f"{type(e).__name__}: {e}"}
+    return {
+        "file":        src,
+        "output":      ', '.join(written),
+        "steps":       step_log,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _write_run(payload, outputs: list, dest: str) -> list:
+    paths = [os.path.join(os.path.dirname(dest), branch_output_name(os.path.basename(dest), branch, output))
+             for branch, output, _ in outputs]     # name check before anything is written
+    written = []
+    if payload is not None:
+        payload_to_file(payload, dest)
+        written.append(dest)
+    for path, (_, _, result) in zip(paths, outputs):
+        payload_to_file(result, path)
+        written.append(path)
+    return written
+
+
+def run_files_batch(scripts: list, jobs: list) -> list:
+    """
+    Run scripts over [(src, dest), ...] as one batch (see run_batch), so
+    batch steps see every file at once; returns run_file's reports in order.
+    """
+    started = time.perf_counter()
+    try:
+        items = run_batch([payload_from_file(src) for src, _ in jobs], resolve_steps(scripts))
+    except (StepError, OSError) as e:
+        report = e.report() if isinstance(e, StepError) else {"error": f"{type(e).__name__}: {e}"}
+        return [{"file": src, **report} for src, _ in jobs]
+    duration_ms = round((time.perf_counter() - started) * 1000, 1)   # shared by the batch
+    reports = []
+    for (src, dest), item in zip(jobs, items):
+        if isinstance(item, StepError):
+            reports.append({"file": src, **item.report()})
+            continue
+        payload, step_log, outputs = item
+        try:
+            written = _write_run(payload, outputs, dest)
+        except StepError as e:
+            reports.append({"file": src, **e.report()})
+            continue
+        except Exception as e:
+            reports.append({"file": src, "error": f"{type(e).__name__}: {e}"})
+            continue
+        reports.append({"file": src, "output": ', '.join(written), "steps": step_log,
+                        "duration_ms": duration_ms})
+    return reports
+
+
+def run_main(argv: list) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='app.py run', description='Run a preset over files without the web UI.')
+    parser.add_argument('--preset', required=True, help='preset file name in presets/, or a path')
+    parser.add_argument('--out', help='write outputs here instead of replacing the inputs')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='files processed in parallel')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+
+    try:
+        scripts = load_preset(args.preset)
+        batched = any(is_batch_step(step) for step in resolve_steps(scripts))   # fail fast, too
+    except (OSError, ValueError, StepError) as e:
+        print(f"[run] {e}", file=sys.stderr)
+        return 2
+
+    files = []
+    for pattern in args.files:    # Windows shells don't expand wildcards
+        files += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+    jobs = [(scripts, src, os.path.join(args.out, os.path.basename(src)) if args.out else src)
+            for src in files]
+
+    failures = 0
+
+    def report(result: dict) -> None:
+        nonlocal failures
+        if "error" in result:
+            failures += 1
+            print(f"[run] {result['file']}: {result['error']}", file=sys.stderr)
+        else:
+            print(f"[run] {result['file']} → {result['output']}  ({result['duration_ms']} ms)")
+
+    if batched:     # batch steps need every file in one process
+        for result in run_files_batch(scripts, [job[1:] for job in jobs]):
+            report(result)
+    elif args.jobs > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+        with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+            for fut in as_completed([pool.submit(run_file, *job) for job in jobs]):
+                report(fut.result())
+    else:
+        for job in jobs:
+            report(run_file(*job))
+
+    print(f"[run] {len(jobs) - failures}/{len(jobs)} file(s) processed")
+    return 1 if failures else 0
+
+
+# ── Parameter sweeps ───────────────────────────────────────────────────────
+#
+#   python app.py sweep --preset laser_preset --set inject_laser_power_on_z_moves.power=0.2:1:0.2 \
+#                       --set inject_laser_power_on_z_moves.engrave_z=0,-0.1 --out sweep/ part.gcode
+#
+# A sweep maps steps to lists of argument values:
+#
+#   {"inject_laser_power_on_z_moves": {"power": [0.2, 0.5, 0.8]},
+#    "3":                             {"speed_min": [600, 1200]}}
+#
+# Steps are named by pluginKey, by function name or by their index among the
+# enabled steps.  "grid" runs every combination; "list" pairs the i-th value
+# of every argument.  The steps before the first swept one run once, and
+# their result reaches the worker processes (sandbox workers in the server,
+# spawned ones otherwise) through shared memory.  Each worker runs the rest
+# of the pipeline with one combination, and <stem>__<label><ext> is written,
+# e.g. part__power-0.5_engrave_z-m0.1.gcode.
+# write_sweep_summary() tabulates the runs as CSV.
+
+SWEEP_MODES    = ("grid", "list")
+SWEEP_MAX_RUNS = 256
+SWEEP_VALUE_RE = re.compile(r'[^A-Za-z0-9.+-]+')
+
+
+def parse_sweep_values(text: str) -> list:
+    """"0.2,0.5,0.8" → [0.2, 0.5, 0.8]; "0.2:1:0.2" → 0.2 to 1 inclusive in steps of 0.2."""
+    def value(s):
+        try:
+            return json.loads(s)
+        except ValueError:
+            return s
+
+    parts = text.split(':')
+    if len(parts) == 3 and all(isinstance(value(p), (int, float)) for p in parts):
+        start, stop, step = (value(p) for p in parts)
+        if step <= 0:
+            raise ValueError(f"sweep range {text!r}: step must be positive")
+        count = int((stop - start) / step + 1e-9) + 1
+        return [round(start + i * step, 10) for i in range(max(count, 0))]
+    return [value(s.strip()) for s in text.split(',') if s.strip()]
+
+
+def _sweep_label(value) -> str:
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value)
+    if text.startswith('-'):
+        text = 'm' + text[1:]       # keep -0.1 and 0.1 apart once '-' is the separator
+    return SWEEP_VALUE_RE.sub('-', text).strip('-')[:24] or 'x'
+
+
+def sweep_output_name(filename: str, label: str) -> str:
+    stem, ext = os.path.splitext(filename)
+    return f"{stem}__{label}{ext}"
+
+
+def sweep_summary_name(filename: str) -> str:
+    return f"{os.path.splitext(filename)[0]}__sweep.csv"
+
+
+def expand_sweep(scripts: list, sweep: dict, mode: str = "grid", plugins: dict = None) -> tuple:
+    """
+    Validate a sweep against scripts and expand it.  Returns (prefix scripts,
+    columns, runs) where runs is [(label, {column: value}, tail scripts)].
+    """
+    from itertools import product
+
+    scripts = [s for s in scripts if s.get('isChecked', True)]
+    if mode not in SWEEP_MODES:
+        raise StepError(f"Unknown sweep mode '{mode}' (expected one of {list(SWEEP_MODES)})", 400)
+    if not isinstance(sweep, dict) or not sweep:
+        raise StepError("A sweep needs at least one step argument with a list of values", 400)
+    if any(isinstance(s.get('branches'), list) and not s.get('join') for s in scripts):
+        raise StepError("Sweeps run one output per combination, so they can't include a closing fork", 400)
+    if plugins is None:
+        plugins = get_plugins(_step_modules(scripts))
+    resolve_steps(scripts, plugins)
+
+    axes = []     # (step indices, arg, values)
+    for target, step_args in sweep.items():
+        target  = str(target)
+        indices = ([int(target)] if target.isdigit() and int(target) < len(scripts) else
+                   [i for i, s in enumerate(scripts)
+                    if target in (s.get('pluginKey'), str(s.get('pluginKey')).rsplit('.', 1)[-1])])
+        if not indices:
+            raise StepError(f"Sweep names no step in this pipeline: '{target}'", 400)
+        if not isinstance(step_args, dict) or not step_args:
+            raise StepError(f"Sweep for '{target}' must map argument names to value lists", 400)
+        for i in indices:
+            if 'pluginKey' not in scripts[i]:
+                raise StepError(f"Sweep target '{target}' is a fork; sweep a step inside it instead", 400)
+        for arg, values in step_args.items():
+            if isinstance(values, str):
+                values = parse_sweep_values(values)
+            if not isinstance(values, list) or not values:
+                raise StepError(f"Sweep '{target}.{arg}' has no values", 400)
+            for i in indices:
+                known = {a["name"] for a in plugins[scripts[i]['pluginKey']]["meta"].get("args", [])}
+                if arg not in known:
+                    raise StepError(f"Step '{scripts[i]['pluginKey']}' has no argument '{arg}'"
+                                    f" (has: {', '.join(sorted(known)) or 'none'})", 400)
+            axes.append((indices, arg, values))
+
+    names   = [arg for _, arg, _ in axes]
+    columns = [arg if names.count(arg) == 1 else
+               f"{scripts[idx[0]]['pluginKey'].rsplit('.', 1)[-1]}.{arg}" for idx, arg, _ in axes]
+    lengths = [len(values) for _, _, values in axes]
+    if mode == "list" and len(set(lengths)) > 1:
+        raise StepError(f"List sweeps need the same number of values for every argument (got {lengths})", 400)
+    count = lengths[0] if mode == "list" else math.prod(lengths)
+    if count > SWEEP_MAX_RUNS:
+        raise StepError(f"Sweep expands to {count} runs (limit {SWEEP_MAX_RUNS})", 400)
+    values = [values for _, _, values in axes]
+    combos = zip(*values) if mode == "list" else product(*values)
+
+    first  = min(i for indices, _, _ in axes for i in indices)
+    runs, labels = [], set()
+    for combo in combos:
+        tail = [dict(s, args=dict(s.get('args') or {})) if 'pluginKey' in s else s for s in scripts[first:]]
+        for (indices, arg, _), value in zip(axes, combo):
+            for i in indices:
+                tail[i - first]['args'][arg] = value
+        label = '_'.join(f"{col}-{_sweep_label(v)}" for col, v in zip(columns, combo))
+        if label in labels:
+            raise StepError(f"Sweep repeats the combination '{label}'", 400)
+        labels.add(label)
+        runs.append((label, dict(zip(columns, combo)), tail))
+    return scripts[:first], columns, runs
+
+
+_sweep_source = None     # per worker process: the shared prefix result (or a path)
+
+
+def _sweep_init(source) -> None:
+    global _sweep_source
+    _sweep_source = payload_from_shared(source) if isinstance(source, dict) else source
+
+
+def _sweep_run(tail: list, dest: str, source=None) -> dict:
+    """Run one combination's steps on the sweep source and write dest; returns a report."""
+    started = time.perf_counter()
+    source  = _sweep_source if source is None else source
+    try:
+        payload = payload_from_file(source) if isinstance(source, str) else _branch_copy(source)
+        payload, _, _ = run_steps(payload, resolve_steps(tail))
+        payload_to_file(payload, dest)
+    except StepError as e:
+        return {"status": "failed", "error": str(e)}
+    except Exception as e:
+        return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+    return {
+        "status":      "ok",
+        "output":      os.path.basename(dest),
+        "bytes":       os.path.getsize(dest),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def run_sweep(src: str, out_dir: str, prefix: list, runs: list, jobs: int = 0,
+              sandbox: "PluginSandbox" = None, cancel: CancelToken = None) -> list:
+    """
+    Run an expanded sweep (see expand_sweep) over src, writing one output per
+    run into out_dir.  Returns one row per run: {run, <column values>, status,
+    output, bytes, duration_ms} or {..., status, error}.  Raises StepError if
+    the shared prefix fails, since then no run can start.
+
+    With a sandbox, the prefix and every run go through it (its limits apply
+    and jobs is capped at its worker count); otherwise runs use spawned worker
+    processes, at most one per core.  Cancelling raises Cancelled once the
+    runs in progress stop; runs that finished before it keep their outputs.
+    """
+    if cancel is not None:
+        cancel.check()
+    dests = [os.path.join(out_dir, sweep_output_name(os.path.basename(src), label)) for label, _, _ in runs]
+    tails = [tail for _, _, tail in runs]
+    limit = sandbox.workers if sandbox is not None else os.cpu_count() or 1
+    workers = max(1, min(jobs or limit, limit, len(runs)))
+    if sandbox is not None:
+        reports = _sweep_sandboxed(sandbox, src, prefix, tails, dests, workers, cancel)
+    else:
+        reports = _sweep_local(src, prefix, tails, dests, workers, cancel)
+    return [{"run": label, **values, **report} for (label, values, _), report in zip(runs, reports)]
+
+
+def _sweep_sandboxed(sandbox, src, prefix, tails, dests, workers, cancel) -> list:
+    source = src
+    if prefix:
+        source, _, _ = sandbox.run(src, prefix, cancel=cancel)
+
+    def one(tail, dest):
+        started = time.perf_counter()
+        try:
+            payload, _, _ = sandbox.run(source, tail, cancel=cancel)
+            payload_to_file(payload, dest)
+        except Cancelled:
+            if cancel is not None:
+                cancel.check()          # report the sweep's deadline, not what was left of it for this run
+            raise
+        except StepError as e:
+            return {"status": "failed", "error": str(e)}
+        except Exception as e:
+            return {"status": "failed", "error": f"{type(e).__name__}: {e}"}
+        return {
+            "status":      "ok",
+            "output":      os.path.basename(dest),
+            "bytes":       os.path.getsize(dest),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+
+    if workers == 1:
+        return [one(tail, dest) for tail, dest in zip(tails, dests)]
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sweep') as pool:
+        futures = [pool.submit(one, tail, dest) for tail, dest in zip(tails, dests)]
+        try:
+            return [f.result() for f in futures]
+        except Cancelled:
+            for f in futures:
+                f.cancel()
+            raise
+
+
+def _sweep_local(src, prefix, tails, dests, workers, cancel) -> list:
+    source = src            # nothing shared: each run loads (or maps) the file itself
+    if prefix:
+        payload, _, _ = run_steps(payload_from_file(src), resolve_steps(prefix), cancel=cancel)
+        source = _share(payload)
+    if workers == 1:
+        reports = []
+        for tail, dest in zip(tails, dests):
+            if cancel is not None:
+                cancel.check()
+            reports.append(_sweep_run(tail, dest, source))
+        return reports
+
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, wait
+    from concurrent.futures.process import BrokenProcessPool
+
+    reap_shared_segments()
+    handle = payload_to_shared(source) if prefix else source
+    pool   = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_sweep_init, initargs=(handle,))
+    try:
+        futures = [pool.submit(_sweep_run, tail, dest) for tail, dest in zip(tails, dests)]
+        pending = set(futures)
+        while pending:
+            if cancel is not None and cancel.cancelled:
+                pool.shutdown(wait=True, cancel_futures=True)   # runs already going finish
+                cancel.check()
+            _, pending = wait(pending, timeout=SANDBOX_POLL_SECS)
+        return [f.result() for f in futures]
+    except BrokenProcessPool as e:
+        raise StepError(f"A sweep worker process died: {e}", 500) from e
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if prefix:
+            release_shared(handle)
+
+
+def write_sweep_summary(rows: list, columns: list, path: str) -> None:
+    """Write the sweep table as CSV: run, the swept arguments, then the outcome."""
+    import csv
+
+    fields = ["run", *columns, "status", "output", "bytes", "duration_ms", "error"]
+    tmp    = f"{path}.tmp{os.getpid()}"
+    with open(tmp, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp, path)
+
+
+def sweep_main(argv: list) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='app.py sweep', description='Run a preset once per combination of argument values.')
+    parser.add_argument('--preset', required=True, help='preset file name in presets/, or a path')
+    parser.add_argument('--set', action='append', required=True, metavar='STEP.ARG=VALUES', dest='sweep',
+                        help='values for one step argument: "a,b,c" or "start:stop:step" (repeatable)')
+    parser.add_argument('--list', action='store_true',
+                        help='pair the i-th values of every --set instead of running every combination')
+    parser.add_argument('--out', help='output folder (default: next to each input)')
+    parser.add_argument('--jobs', '-j', type=int, default=0, help='runs in parallel (default: one per core)')
+    parser.add_argument('files', nargs='+')
+    args = parser.parse_args(argv)
+
+    sweep = {}
+    for spec in args.sweep:
+        target, sep, values = spec.partition('=')
+        step, dot, arg = target.rpartition('.')
+        if not sep or not dot or not step or not arg:
+            parser.error(f"--set expects STEP.ARG=VALUES, got {spec!r}")
+        try:
+            sweep.setdefault(step, {})[arg] = parse_sweep_values(values)
+        except ValueError as e:
+            parser.error(str(e))
+
+    try:
+        prefix, columns, runs = expand_sweep(load_preset(args.preset), sweep, "list" if args.list else "grid")
+    except (OSError, ValueError, StepError) as e:
+        print(f"[sweep] {e}", file=sys.stderr)
+        return 2
+    print(f"[sweep] {len(runs)} run(s) per file; {len(prefix)} shared step(s) run once")
+
+    files = []
+    for pattern in args.files:
+        files += sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+    failures = 0
+    for src in files:
+        out_dir = args.out or os.path.dirname(os.path.abspath(src))
+        os.makedirs(out_dir, exist_ok=True)
+        try:
+            rows = run_sweep(src, out_dir, prefix, runs, args.jobs)
+        except (OSError, StepError) as e:
+            print(f"[sweep] {src}: {e}", file=sys.stderr)
+            failures += len(runs)
+            continue
+        summary = os.path.join(out_dir, sweep_summary_name(os.path.basename(src)))
+        write_sweep_summary(rows, columns, summary)
+        width = max(len(r["run"]) for r in rows)
+        for r in rows:
+            outcome = f"{r['output']}  ({r['duration_ms']} ms)" if r["status"] == "ok" else f"FAILED {r['error']}"
+            print(f"[sweep] {r['run']:<{width}}  {outcome}")
+        failures += sum(r["status"] != "ok" for r in rows)
+        print(f"[sweep] {src}: summary in {summary}")
+    return 1 if failures else 0
+
+
+# ── Hot folders ────────────────────────────────────────────────────────────
+#
+#   python app.py watch --map "drop/laser=laser_preset.json" [--map ...] [--jobs N]
+#
+# Polls each mapped folder with os.scandir, keeping (size, mtime_ns) per file.
+# A file is queued once its stat has not changed for --settle seconds, so
+# copies still in progress are left alone.  The output goes to <folder>/done
+# (replacing the dropped file); a file that fails moves to <folder>/failed
+# with a .error.txt next to it.  At most --queue files are in flight. When
+# the queue is full, settled files wait for the next poll.  A file is handed
+# off once per (size, mtime); if it cannot be moved away it is left alone
+# until it changes.
+
+WATCH_INTERVAL_SECS = 1.0
+WATCH_SETTLE_SECS   = 2.0
+WATCH_SKIP_SUFFIXES = ('.tmp', '.part', '.crdownload', '.partial', '.error.txt')
+
+
+@dataclass
+class HotFolder:
+    folder:  str
+    preset:  str
+    scripts: list
+    done:    str
+    failed:  str
+    seen:    dict = field(default_factory=dict)    # path → ((size, mtime_ns), stable since | None once handed off)
+
+
+def process_hot_file(scripts: list, src: str, done: str, failed: str) -> dict:
+    """Worker: run scripts over src into done/, or park src in failed/."""
+    result = run_file(scripts, src, os.path.join(done, os.path.basename(src)))
+    try:
+        if "error" in result:
+            dest = os.path.join(failed, os.path.basename(src))
+            os.replace(src, dest)
+            with open(dest + '.error.txt', 'w', encoding='utf-8') as f:
+                f.write(result["error"] + "\n" + result.get("trace", ""))
+        else:
+            os.remove(src)
+    except OSError as e:
+        result.setdefault("error", f"could not move {src}: {e}")
+    return result
+
+
+def _scan_settled(hot: HotFolder, now: float, settle: float):
+    """Yield files in hot.folder whose size and mtime have held for settle seconds."""
+    present = set()
+    try:
+        with os.scandir(hot.folder) as it:
+            for de in it:
+                if de.name.startswith('.') or de.name.endswith(WATCH_SKIP_SUFFIXES):
+                    continue
+                try:
+                    if not de.is_file():
+                        continue
+                    st = de.stat()
+                except OSError:
+                    continue            # vanished between listing and stat
+                present.add(de.path)
+                stamp = (st.st_size, st.st_mtime_ns)
+                prev  = hot.seen.get(de.path)
+                if prev is None or prev[0] != stamp:
+                    hot.seen[de.path] = (stamp, now)
+                elif prev[1] is not None and now - prev[1] >= settle:
+                    yield de.path
+    except OSError as e:
+        print(f"[watch] {hot.folder}: {e}", file=sys.stderr)
+    for path in hot.seen.keys() - present:
+        del hot.seen[path]
+
+
+def watch(folders: list, jobs: int = 1, queue_size: int = 0,
+          interval: float = WATCH_INTERVAL_SECS, settle: float = WATCH_SETTLE_SECS) -> None:
+    from concurrent.futures import ProcessPoolExecutor
+    queue_size = queue_size or jobs * 4
+    inflight   = {}                         # path → future
+    slots      = threading.BoundedSemaphore(queue_size)
+
+    def finished(path, fut):
+        inflight.pop(path, None)
+        slots.release()
+        try:
+            result = fut.result()
+        except Exception as e:              # worker process died
+            result = {"file": path, "error": f"{type(e).__name__}: {e}"}
+        if "error" in result:
+            print(f"[watch] {path}: {result['error']}", file=sys.stderr)
+        else:
+            print(f"[watch] {path} → {result['output']}  ({result['duration_ms']} ms)")
+
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        try:
+            while True:
+                now = time.monotonic()
+                for hot in folders:
+                    for path in _scan_settled(hot, now, settle):
+                        if path in inflight:
+                            continue
+                        if not slots.acquire(blocking=False):
+                            break           # queue full — pick it up next poll
+                        fut = pool.submit(process_hot_file, hot.scripts, path, hot.done, hot.failed)
+                        inflight[path] = fut
+                        # Not again until it changes: a file that could not be moved or
+                        # removed stays put, and must not be resubmitted every poll.
+                        hot.seen[path] = (hot.seen[path][0], None)
+                        fut.add_done_callback(lambda f, p=path: finished(p, f))
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("[watch] stopping — waiting for running jobs")
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def watch_main(argv: list) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='app.py watch', description='Run presets on files dropped into folders.')
+    parser.add_argument('--map', action='append', required=True, metavar='FOLDER=PRESET',
+                        help='watch FOLDER and run PRESET on new files (repeatable)')
+    parser.add_argument('--done', help='output folder (default: <folder>/done)')
+    parser.add_argument('--failed', help='folder for files that failed (default: <folder>/failed)')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='files processed in parallel')
+    parser.add_argument('--queue', type=int, default=0, help='max files in flight (default: 4 × jobs)')
+    parser.add_argument('--interval', type=float, default=WATCH_INTERVAL_SECS, help='seconds between scans')
+    parser.add_argument('--settle', type=float, default=WATCH_SETTLE_SECS,
+                        help='seconds a file must stay unchanged before it is processed')
+    args = parser.parse_args(argv)
+
+    folders = []
+    for spec in args.map:
+        folder, sep, preset = spec.rpartition('=')
+        if not sep or not folder:
+            parser.error(f"--map expects FOLDER=PRESET, got {spec!r}")
+        try:
+            scripts = load_preset(preset)
+            resolve_steps(scripts)
+        except (OSError, ValueError, StepError) as e:
+            print(f"[watch] {preset}: {e}", file=sys.stderr)
+            return 2
+        done   = args.done or os.path.join(folder, 'done')
+        failed = args.failed or os.path.join(folder, 'failed')
+        for path in (folder, done, failed):
+            os.makedirs(path, exist_ok=True)
+        folders.append(HotFolder(folder, preset, scripts, done, failed))
+        print(f"[watch] {folder} → {preset}  (done: {done})")
+
+    watch(folders, max(1, args.jobs), args.queue, args.interval, args.settle)
+    return 0
+
+
+COMMANDS = {"run": run_main, "sweep": sweep_main, "watch": watch_main}
+
+
+def main(argv: list) -> int:
+    """Entry point for `python app.py <command> ...` — argv starts at the command."""
+    if not argv or argv[0] not in COMMANDS:
+        print(f"usage: app.py {{{','.join(COMMANDS)}}} ...", file=sys.stderr)
+        return 2
+    return COMMANDS[argv[0]](argv[1:])
+
+
+if __name__ == '__main__':
+    raise SystemExit(main(sys.argv[1:]))
@@ -5,9 +5,14 @@ All functions use the legacy list[str] -> list[str] signature and are
 automatically wrapped by the plugin loader into the Payload contract.
 Functions that need to read or write payload.meta should use the new
 Payload signature instead (see laser_utils.py for an example).
+
+setup() compiles the regexes once per process into plugin_state, which the
+loader binds before calling it; imported any other way, the module builds
+them on first use.
 """
 
 import re
+import types
 
 # ── Module-level metadata (applies to all functions unless overridden) ─────
 
@@ -20,6 +25,31 @@ PLUGIN_META = {
     "tags":     ["gcode", "endmill"],
 }
 
+# ── Lifecycle ──────────────────────────────────────────────────────────────
+
+plugin_state = None     # PluginState, bound by the loader before setup()
+
+
+def setup(state):
+    """Build the patterns convert_g01_g00_to_g1_2decimals applies to every line."""
+    state.g0x_move   = re.compile(r'\bG0[01]\b')
+    state.axis_value = re.compile(r'([A-Z])(-?\d+\.\d+)')
+
+
+def _state():
+    """plugin_state, or a module-local one when the loader did not run setup()."""
+    global plugin_state
+    if plugin_state is None:
+        state = types.SimpleNamespace()
+        setup(state)
+        plugin_state = state
+    return plugin_state
+
+
+def _round_axis(m):
+    return f"{m.group(1)}{float(m.group(2)):.2f}"
+
+
 # ── Plugins ────────────────────────────────────────────────────────────────
 
 def add_printer_header(lines):
@@ -48,16 +78,10 @@ remove_comments.plugin_meta = {
 
 def convert_g01_g00_to_g1_2decimals(lines):
     """Normalise G00/G01 to G1 and round all axis coordinates to 2 decimal places."""
-    new_lines = []
-    for line in lines:
-        line = re.sub(r'\bG0[01]\b', 'G1', line)
-        line = re.sub(
-            r'([A-Z])(-?\d+\.\d+)',
-            lambda m: f"{m.group(1)}{float(m.group(2)):.2f}",
-            line,
-        )
-        new_lines.append(line)
-    return new_lines
+    state    = _state()
+    g0x_sub  = state.g0x_move.sub
+    axis_sub = state.axis_value.sub
+    return [axis_sub(_round_axis, g0x_sub('G1', line)) for line in lines]
 
 convert_g01_g00_to_g1_2decimals.plugin_meta = {
     "label":       "Normalise G00/G01 → G1 + 2 dp",
@@ -2,13 +2,15 @@
 laser_utils.py — G-code post-processing plugins for laser cutter operations.
 
 Mix of legacy list[str] -> list[str] functions (auto-wrapped by the loader)
-and one new-style Payload function that demonstrates writing to payload.meta.
+and new-style Payload functions: one slices the TextLines view without
+copying, one demonstrates writing to payload.meta.  align_to_common_origin
+is a batch step: it sees every file of a batch in one call.
 """
 
 import re
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
-    from app import Payload   # pragma: no cover
+    from pipeline import Payload   # pragma: no cover
 
 # ── Module-level metadata ──────────────────────────────────────────────────
 
@@ -23,18 +25,23 @@ PLUGIN_META = {
 
 # ── Plugins ────────────────────────────────────────────────────────────────
 
-def remove_flatcam_preamble(lines):
+def remove_flatcam_preamble(payload: "Payload") -> "Payload":
     """
     Strip the FlatCAM Repetier preamble and trailing shutdown from laser gcode.
 
     Removes everything up to and including the first M106 (Repetier spindle-on),
     and truncates at the first M107 (Repetier spindle-off) so only the toolpath
     remains. The laser header/footer plugin adds the correct Klipper commands.
+
+    Payload-style so a freshly loaded file stays a TextLines view: the scans
+    stop at the markers and both slices are views, so no line is copied.
     """
+    lines = payload.data
     start = next((i for i, l in enumerate(lines) if l.strip() == 'M106'), -1)
     lines = lines[start + 1:] if start != -1 else lines
     end = next((i for i, l in enumerate(lines) if l.strip() == 'M107'), len(lines))
-    return lines[:end]
+    payload.data = lines[:end]
+    return payload
 
 remove_flatcam_preamble.plugin_meta = {
     "label":       "Remove FlatCAM preamble / trailer",
@@ -323,4 +330,41 @@ make_laser_grid.plugin_meta = {
         "Coordinates are baked in; no Klipper macro changes needed. "
         "Run after 'Add laser header + footer' and 'Inject laser power on Z transitions'."
     ),
-}
\ No newline at end of file
+}
+
+# ── Batch ──────────────────────────────────────────────────────────────────
+
+def align_to_common_origin(payloads: list["Payload"], margin=0.0) -> list["Payload"]:
+    """
+    payloads — every file in the batch (a batch step; a single run passes one).
+    margin — where the shared lower-left corner ends up, in mm from X0 Y0.
+
+    Finds the bounding box of all files together and shifts each file by the
+    same amount, so a set of panels keeps its relative placement.
+    """
+    xy_pat = re.compile(r'([XY])(-?\d+(?:\.\d+)?)')
+    min_x = min_y = None
+    for payload in payloads:
+        for line in payload.data:
+            if line.lstrip().startswith(('G0', 'G1', 'G2', 'G3')):
+                for axis, val in xy_pat.findall(line):
+                    val = float(val)
+                    if axis == 'X':
+                        min_x = val if min_x is None else min(min_x, val)
+                    else:
+                        min_y = val if min_y is None else min(min_y, val)
+    dx = margin - min_x if min_x is not None else 0.0
+    dy = margin - min_y if min_y is not None else 0.0
+    for payload in payloads:
+        payload.data = _shift_body(payload.data, dx, dy)
+        payload.meta["origin_shift"] = [dx, dy]
+    return payloads
+
+align_to_common_origin.plugin_meta = {
+    "label":       "Align batch to a common origin",
+    "description": (
+        "Shifts every file in the batch by the same X/Y offset so their combined "
+        "bounding box starts at (margin, margin). Relative placement is kept."
+    ),
+    "batch":       True,
+}
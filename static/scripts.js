@@ -19,6 +19,7 @@ const state = {
     pendingFiles:          [],    // held during warn prompt before upload starts
     isBatchSession:        false, // true when session has >1 file
     batchRunDone:          false, // true after a batch run completes
+    activeRun:             null,  // followRunProgress() handle while a run is in flight
     uploadAbortFlag:       false,
     // Choose Plugins
     sessionPlugins:        null,   // null = all available; Set = restricted set (module keys)
@@ -32,6 +33,8 @@ const state = {
     cachedPresets:         [],
     fileEditDirty:         false,
     fileEditSaving:        false,
+    fileEditBase:          null,   // file text as last loaded/saved — patches are diffed against it
+    fileEditVersion:       null,   // server version token for fileEditBase
 };
 
 let el = {};
@@ -77,9 +80,13 @@ function updateDebugToggle() {
 
 function startServerDebug() {
     if (_logSource) return;
-    _logSource = new EventSource(`${API_BASE}/logs`);
+    _logSource = new EventSource(`${API_BASE}/events?types=log`);
     _logSource.onmessage = e => {
-        try { log('[server] ' + JSON.parse(e.data), 'system'); } catch (_) {}
+        try {
+            const frame = JSON.parse(e.data);
+            if (frame.dropped) log(`[server] … ${frame.dropped} log line(s) dropped (console too slow)`, 'warn');
+            frame.events.forEach(ev => log('[server] ' + ev.message, 'system'));
+        } catch (_) {}
     };
     localStorage.setItem('serverDebug', '1');
     log('Server debug stream connected.', 'system');
@@ -104,7 +111,54 @@ function copyConsoleToClipboard() {
 
 // ── Step list ──────────────────────────────────────────────────────────────
 
-function createStepEl({ pluginKey, description = '', isChecked = true, args = {} }) {
+// A fork step ({branches: [{name, steps, output}], join}) is shown as one
+// read-only card; its branches are edited in the preset JSON.
+function createForkEl({ branches, join = '', description = '', isChecked = true }) {
+    const li = document.createElement('li');
+    li.dataset.fork = JSON.stringify({ branches, join });
+    if (!isChecked) li.classList.add('step-disabled');
+
+    const summary = branches
+        .map(b => `${b.name} (${(b.steps || []).length} step${(b.steps || []).length === 1 ? '' : 's'})`)
+        .join(' · ');
+
+    li.innerHTML = `
+        <div class="step-drag-handle">
+            <svg width="12" height="16" viewBox="0 0 12 16" fill="currentColor">
+                <circle cx="3.5" cy="3"  r="1.5"/><circle cx="8.5" cy="3"  r="1.5"/>
+                <circle cx="3.5" cy="8"  r="1.5"/><circle cx="8.5" cy="8"  r="1.5"/>
+                <circle cx="3.5" cy="13" r="1.5"/><circle cx="8.5" cy="13" r="1.5"/>
+            </svg>
+        </div>
+        <input type="checkbox" class="step-checkbox" ${isChecked ? 'checked' : ''}>
+        <div class="step-body">
+            <div class="step-header-row">
+                <span class="step-label">Fork${join ? ` → ${join}` : ''}</span>
+                <span class="step-key-sub">${summary}</span>
+            </div>
+            <input type="text" class="step-note" value="${description.replace(/"/g,'&quot;')}" placeholder="Add a note…">
+        </div>
+        <button class="step-delete" title="Remove step">
+            <svg width="14" height="14" fill="none" stroke="currentColor" viewBox="0 0 24 24">
+                <path stroke-linecap="round" stroke-linejoin="round" stroke-width="2"
+                      d="M19 7l-.867 12.142A2 2 0 0116.138 21H7.862a2 2 0 01-1.995-1.858L5 7m5 4v6m4-6v6m1-10V4a1 1 0 00-1-1h-4a1 1 0 00-1 1v3M4 7h16"/>
+            </svg>
+        </button>`;
+
+    li.querySelector('.step-checkbox').addEventListener('change', e => {
+        li.classList.toggle('step-disabled', !e.target.checked);
+        pushHistoryAndSave();
+    });
+    li.querySelector('.step-note').addEventListener('change', pushHistoryAndSave);
+    li.querySelector('.step-delete').addEventListener('click', () => {
+        li.remove(); updateEmptyState(); pushHistoryAndSave();
+    });
+    return li;
+}
+
+function createStepEl(step) {
+    if (Array.isArray(step.branches)) return createForkEl(step);
+    const { pluginKey, description = '', isChecked = true, args = {} } = step;
     const li = document.createElement('li');
     li.dataset.pluginKey = pluginKey;
     if (!isChecked) li.classList.add('step-disabled');
@@ -219,6 +273,13 @@ function createStepEl({ pluginKey, description = '', isChecked = true, args = {}
 
 function getSequence() {
     return Array.from(el.scriptList.children).map(li => {
+        if (li.dataset.fork) {
+            return {
+                ...JSON.parse(li.dataset.fork),
+                description: li.querySelector('.step-note').value,
+                isChecked:   li.querySelector('.step-checkbox').checked,
+            };
+        }
         const args = {};
         li.querySelectorAll('.step-arg-input').forEach(input => {
             const name = input.dataset.arg;
@@ -343,7 +404,8 @@ function initCanvasPan() {
 
 // ── File preview ───────────────────────────────────────────────────────────
 
-const PREVIEW_MAX_LINES = 2000;
+const PREVIEW_MAX_LINES      = 2000;    // page size for ranged /preview_file requests
+const PREVIEW_EDIT_MAX_LINES = 20000;   // larger files open in the read-only virtual view
 let fileEditTimer = null;
 let fileEditSavePromise = null;
 
@@ -355,6 +417,27 @@ function updateFileEditControls() {
         : state.fileEditDirty ? 'Unsaved edits' : '';
 }
 
+// Reduce an edit to one line-range patch: the lines between the common
+// prefix and common suffix of the last-saved and current text.
+function diffToLinePatch(before, after) {
+    const a = splitPreviewLines(before);
+    const b = splitPreviewLines(after);
+    let p = 0;
+    while (p < a.length && p < b.length && a[p] === b[p]) p++;
+    let s = 0;
+    while (s < a.length - p && s < b.length - p && a[a.length - 1 - s] === b[b.length - 1 - s]) s++;
+    if (p === a.length && p === b.length) return null;
+    return { start: p, delete: a.length - p - s, insert: b.slice(p, b.length - s).join('') };
+}
+
+async function postFileEdit(body) {
+    const r = await fetch(`${API_BASE}/update_file`, {
+        method: 'POST', headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({ session_dir: state.sessionDir, filename: state.outputFilename, ...body }),
+    });
+    return { status: r.status, ok: r.ok, data: await r.json() };
+}
+
 async function saveFileEdits() {
     clearTimeout(fileEditTimer);
     if (state.fileEditSaving) return fileEditSavePromise;
@@ -365,16 +448,27 @@ async function saveFileEdits() {
     updateFileEditControls();
     fileEditSavePromise = (async () => {
         try {
-            const r = await fetch(`${API_BASE}/update_file`, {
-                method: 'POST', headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({
-                    session_dir: state.sessionDir,
-                    filename: state.outputFilename,
-                    content,
-                }),
-            });
-            const d = await r.json();
-            if (!r.ok) throw new Error(d.error || 'Save failed');
+            let res;
+            if (state.fileEditBase != null && state.fileEditVersion) {
+                const patch = diffToLinePatch(state.fileEditBase, content);
+                res = await postFileEdit({
+                    version: state.fileEditVersion,
+                    patches: patch ? [patch] : [],
+                });
+            }
+            if (res && res.status === 409) {
+                // Changed on the server since it was loaded: show that version rather than overwrite it
+                log(`Edit not saved: ${state.outputFilename} changed on the server since it was loaded. `
+                    + 'Showing the current version; make the edit again.', 'error');
+                state.fileEditDirty = false;
+                await refreshFilePreview(true);
+                return;
+            }
+            // No baseline to diff against: send it whole
+            if (!res) res = await postFileEdit({ content });
+            if (!res.ok) throw new Error(res.data.error || 'Save failed');
+            state.fileEditBase    = content;
+            state.fileEditVersion = res.data.version;
             if (el.filePreview.value === content) state.fileEditDirty = false;
             await refreshFileUndoRedoButtons();
         } catch (e) {
@@ -396,6 +490,7 @@ async function refreshFilePreview(force = false) {
     if (!state.sessionDir || !state.outputFilename || state.isBatchSession) {
         clearTimeout(fileEditTimer);
         state.fileEditDirty = false;
+        hideVirtualPreview();
         el.filePreview.style.display          = 'none';
         el.filePreviewTruncation.style.display = 'none';
         el.filePreviewEmpty.style.display     = '';
@@ -404,28 +499,33 @@ async function refreshFilePreview(force = false) {
     }
     if (state.fileEditDirty && !force) return;
     try {
-        const r = await fetch(
-            `${API_BASE}/preview_file`
+        const base = `${API_BASE}/preview_file`
             + `?session_dir=${encodeURIComponent(state.sessionDir)}`
-            + `&filename=${encodeURIComponent(state.outputFilename)}`
-            + `&full=1`
-        );
-        const d = await r.json();
+            + `&filename=${encodeURIComponent(state.outputFilename)}`;
+        const d = await (await fetch(`${base}&start=0&count=${PREVIEW_MAX_LINES}`)).json();
         if (d.error) { return; }
 
-        if (d.type === 'text') {
-            el.filePreview.value                  = d.content;
+        if (d.type === 'text' && d.total_lines > PREVIEW_EDIT_MAX_LINES) {
+            showVirtualPreview(base, d);
+        } else if (d.type === 'text') {
+            let content = d.content;
+            let version = d.version;
+            if (d.truncated) {
+                const full = await (await fetch(`${base}&full=1`)).json();
+                if (full.error) { return; }
+                content = full.content;
+                version = full.version;
+            }
+            hideVirtualPreview();
+            el.filePreview.value                  = content;
+            state.fileEditBase                    = el.filePreview.value;  // as normalised by the textarea
+            state.fileEditVersion                 = version;
             el.filePreview.readOnly               = false;
             el.filePreview.style.display          = '';
             el.filePreviewEmpty.style.display     = 'none';
-            if (d.truncated) {
-                el.filePreviewTruncation.textContent  =
-                    `Showing first ${PREVIEW_MAX_LINES.toLocaleString()} of ${d.total_lines.toLocaleString()} lines`;
-                el.filePreviewTruncation.style.display = '';
-            } else {
-                el.filePreviewTruncation.style.display = 'none';
-            }
+            el.filePreviewTruncation.style.display = 'none';
         } else {
+            hideVirtualPreview();
             el.filePreview.value                  = `[${d.mime_type}  ·  ${fmtBytes(d.size)}]\n\nBinary files cannot be edited as text.`;
             el.filePreview.readOnly               = true;
             el.filePreview.style.display          = '';
@@ -437,6 +537,107 @@ async function refreshFilePreview(force = false) {
     } catch (_) {}
 }
 
+// ── Virtual preview (large files) ──────────────────────────────────────────
+// Files over PREVIEW_EDIT_MAX_LINES are shown read-only.  Only the visible
+// lines are rendered; pages of PREVIEW_MAX_LINES are fetched by range from
+// /preview_file as the user scrolls and kept in a small LRU cache.  Very
+// long files scale the scrollbar so the spacer stays under browser height
+// limits.
+
+const VIRTUAL_MAX_SCROLL_PX = 8000000;
+const VIRTUAL_CACHE_PAGES   = 40;
+const virtualPreview = {
+    base: null, version: null, total: 0, lineHeight: 0, spacerHeight: 0,
+    pages: new Map(), loading: new Set(), frame: 0,
+};
+
+function splitPreviewLines(text) {
+    return text.match(/[^\n]*\n|[^\n]+$/g) || [];
+}
+
+function showVirtualPreview(base, first) {
+    const vp = virtualPreview;
+    vp.base    = base;
+    vp.version = first.version;
+    vp.total   = first.total_lines;
+    vp.pages.clear();
+    vp.loading.clear();
+    vp.pages.set(0, splitPreviewLines(first.content));
+
+    el.filePreview.value                   = '';
+    el.filePreview.readOnly                = true;
+    el.filePreview.style.display           = 'none';
+    el.filePreviewEmpty.style.display      = 'none';
+    el.fileVirtual.style.display           = '';
+    el.filePreviewTruncation.textContent   =
+        `Large file: ${vp.total.toLocaleString()} lines — read-only, loaded as you scroll`;
+    el.filePreviewTruncation.style.display = '';
+
+    vp.lineHeight   = parseFloat(getComputedStyle(el.fileVirtual).lineHeight) || 20;
+    vp.spacerHeight = Math.min(vp.total * vp.lineHeight, VIRTUAL_MAX_SCROLL_PX);
+    el.fileVirtualSpacer.style.height = `${vp.spacerHeight}px`;
+    el.fileVirtual.scrollTop = 0;
+    renderVirtualPreview();
+}
+
+function hideVirtualPreview() {
+    state.fileEditBase    = null;
+    state.fileEditVersion = null;
+    virtualPreview.base = null;
+    virtualPreview.pages.clear();
+    el.fileVirtual.style.display = 'none';
+    el.fileVirtualWindow.textContent = '';
+}
+
+function scheduleVirtualRender() {
+    if (virtualPreview.frame) return;
+    virtualPreview.frame = requestAnimationFrame(() => {
+        virtualPreview.frame = 0;
+        renderVirtualPreview();
+    });
+}
+
+function renderVirtualPreview() {
+    const vp = virtualPreview;
+    const v  = el.fileVirtual;
+    if (!vp.base) return;
+    const visible   = Math.ceil(v.clientHeight / vp.lineHeight) + 1;
+    const maxFirst  = Math.max(0, vp.total - visible + 1);
+    const maxScroll = vp.spacerHeight - v.clientHeight;
+    const first     = maxScroll > 0 ? Math.round((v.scrollTop / maxScroll) * maxFirst) : 0;
+
+    const out = [];
+    for (let i = first; i < Math.min(vp.total, first + visible); i++) {
+        const n    = Math.floor(i / PREVIEW_MAX_LINES);
+        const page = vp.pages.get(n);
+        if (!page) { loadVirtualPage(n); out.push('\n'); continue; }
+        const line = page[i - n * PREVIEW_MAX_LINES] ?? '';
+        out.push(line.endsWith('\n') ? line : line + '\n');
+    }
+    el.fileVirtualWindow.style.transform = `translateY(${v.scrollTop}px)`;
+    el.fileVirtualWindow.textContent = out.join('');
+}
+
+async function loadVirtualPage(n) {
+    const vp = virtualPreview;
+    if (vp.loading.has(n)) return;
+    vp.loading.add(n);
+    const base = vp.base;
+    try {
+        const d = await (await fetch(
+            `${base}&start=${n * PREVIEW_MAX_LINES}&count=${PREVIEW_MAX_LINES}`
+        )).json();
+        if (base !== vp.base || d.error) return;
+        if (d.version !== vp.version) { refreshFilePreview(true); return; }  // file changed underneath
+        vp.pages.set(n, splitPreviewLines(d.content));
+        while (vp.pages.size > VIRTUAL_CACHE_PAGES) vp.pages.delete(vp.pages.keys().next().value);
+        scheduleVirtualRender();
+    } catch (_) {
+    } finally {
+        vp.loading.delete(n);
+    }
+}
+
 // ── File-content history ───────────────────────────────────────────────────
 
 async function refreshFileUndoRedoButtons() {
@@ -577,10 +778,25 @@ function updateOutputState() {
     }
 }
 
+// Batch zip compression, chosen in Settings and stored per browser.
+// G-code compresses well, but "Store" starts fastest for very large batches.
+const BATCH_ZIP_MODES = {
+    store:   { label: 'Store (no compression)', query: '&compression=store' },
+    fast:    { label: 'Deflate — fast',         query: '&compression=deflate&level=1' },
+    deflate: { label: 'Deflate — balanced',     query: '&compression=deflate&level=6' },
+    best:    { label: 'Deflate — smallest',     query: '&compression=deflate&level=9' },
+};
+
+function batchZipMode() {
+    const mode = localStorage.getItem('batchZipMode');
+    return mode in BATCH_ZIP_MODES ? mode : 'deflate';
+}
+
 function saveOutput() {
     if (state.isBatchSession) {
         if (!state.batchRunDone || !state.sessionDir) return;
-        const url = `${API_BASE}/download_batch?session_dir=${encodeURIComponent(state.sessionDir)}`;
+        const url = `${API_BASE}/download_batch?session_dir=${encodeURIComponent(state.sessionDir)}`
+            + BATCH_ZIP_MODES[batchZipMode()].query;
         const a   = document.createElement('a');
         a.href = url; a.download = `${state.sessionDir}_output.zip`;
         document.body.appendChild(a); a.click(); document.body.removeChild(a);
@@ -680,23 +896,33 @@ async function loadPresetFromPicker(file) {
     } catch (e) { log('Load failed: ' + e.message, 'error'); }
 }
 
-async function recordPresetEvent(filename, event) {
+async function recordPresetEvent(filename, event, timing = {}) {
     try {
         await fetch(`${API_BASE}/preset_event`, {
             method: 'POST', headers: {'Content-Type':'application/json'},
-            body: JSON.stringify({ filename, event }),
+            body: JSON.stringify({ filename, event, ...timing }),
         });
     } catch (_) {}
 }
 
 // ── Preset Library ─────────────────────────────────────────────────────────
 
+let presetSearchTimer = null;
+
 async function openPresetLibrary() {
     state.presetLibraryOpen = true;
     el.presetLibraryOverlay.classList.add('open');
     el.presetLibraryBody.innerHTML = '<div class="modal-loading">Loading…</div>';
+    await fetchPresetLibrary();
+}
+
+async function fetchPresetLibrary() {
+    // Search and sort run server-side against the preset catalog index
+    const params = new URLSearchParams({ sort: el.presetSortSelect.value });
+    const q = el.presetSearchInput.value.trim();
+    if (q) params.set('q', q);
     try {
-        state.cachedPresets = await (await fetch(`${API_BASE}/list_presets`)).json();
+        state.cachedPresets = await (await fetch(`${API_BASE}/list_presets?${params}`)).json();
     } catch (e) {
         el.presetLibraryBody.innerHTML = `<div class="modal-loading">Failed: ${e.message}</div>`;
         return;
@@ -709,31 +935,23 @@ function closePresetLibrary() {
     el.presetLibraryOverlay.classList.remove('open');
 }
 
-function sortPresets(presets, by) {
-    return [...presets].sort((a, b) => {
-        if (by === 'uses')         return (b.uses || 0) - (a.uses || 0);
-        if (by === 'success_rate') return (b.success_rate ?? -1) - (a.success_rate ?? -1);
-        if (by === 'last_used')    return (b.last_used || '').localeCompare(a.last_used || '');
-        if (by === 'name')         return a.filename.localeCompare(b.filename);
-        return 0;
-    });
-}
-
 function isSkillCandidate(p) {
     return p.uses >= 5 && p.success_rate != null && p.success_rate >= 0.8;
 }
 
 function renderPresetLibrary() {
-    const presets = sortPresets(state.cachedPresets, el.presetSortSelect.value);
+    const presets = state.cachedPresets;
     if (presets.length === 0) {
-        el.presetLibraryBody.innerHTML =
-            '<div class="modal-empty">No presets saved yet. Build a pipeline and hit Save.</div>';
+        el.presetLibraryBody.innerHTML = el.presetSearchInput.value.trim()
+            ? '<div class="modal-empty">No presets match your search.</div>'
+            : '<div class="modal-empty">No presets saved yet. Build a pipeline and hit Save.</div>';
         return;
     }
     el.presetLibraryBody.innerHTML = '';
     presets.forEach(p => {
         const card = document.createElement('div');
         card.className = 'preset-card' + (isSkillCandidate(p) ? ' preset-card-star' : '');
+        card.title = (p.plugin_keys || []).join('\n');
         const name = p.filename.replace(/\.json$/, '');
         const pct  = p.success_rate != null ? `${Math.round(p.success_rate * 100)}%` : '—';
         const last = p.last_used ? new Date(p.last_used).toLocaleDateString() : 'Never';
@@ -751,6 +969,7 @@ function renderPresetLibrary() {
                     <span>${pct} success</span>
                     <span class="meta-dot">·</span>
                     <span>Last: ${last}</span>
+                    ${p.throughput != null ? `<span class="meta-dot">·</span><span title="Average over ${p.runs} timed run${p.runs !== 1 ? 's' : ''}">${fmtBytes(p.throughput)}/s</span>` : ''}
                 </div>
                 ${p.uses > 0 ? `<div class="preset-card-bar"><div class="preset-card-bar-fill" style="width:${Math.round((p.success_rate||0)*100)}%"></div></div>` : ''}
             </div>
@@ -1090,6 +1309,14 @@ async function openSettings() {
         <div class="settings-row">
             <span class="settings-meta">Max file snapshots kept in memory per file. Older states are dropped when the limit is reached.</span>
         </div>
+        <div class="settings-section">Batch Download</div>
+        <div class="settings-row settings-edit-row">
+            <label class="settings-key" for="batchZipSelect">Zip compression</label>
+            <select class="modal-sort" id="batchZipSelect">
+                ${Object.entries(BATCH_ZIP_MODES).map(([k, m]) =>
+                    `<option value="${k}"${k === batchZipMode() ? ' selected' : ''}>${m.label}</option>`).join('')}
+            </select>
+        </div>
         <div class="settings-section">Plugins</div>
         <div class="settings-row">
             <code class="settings-val">${d.plugin_dir}</code>
@@ -1160,6 +1387,11 @@ async function openSettings() {
     };
     fileUndoLimitSaveBtn.addEventListener('click', saveFileUndoLimit);
     fileUndoLimitInput.addEventListener('keydown', e => { if (e.key === 'Enter') saveFileUndoLimit(); });
+
+    // Batch zip compression (browser-local preference)
+    document.getElementById('batchZipSelect').addEventListener('change', e => {
+        localStorage.setItem('batchZipMode', e.target.value);
+    });
 }
 
 function closeSettings() {
@@ -1318,6 +1550,61 @@ function hideBatchStrip() {
     el.batchProgress.style.display = 'none';
 }
 
+// Chunked upload protocol (see /upload/init in app.py): chunks stream to a
+// .part file on the server, and an interrupted upload resumes from whatever
+// offset the server reports.
+const UPLOAD_CHUNK_BYTES = 8 * 1024 * 1024;
+const UPLOAD_PARALLEL    = 4;
+const UPLOAD_RETRIES     = 3;
+
+async function uploadJSON(path, body) {
+    const r = await fetch(`${API_BASE}${path}`, {
+        method: 'POST', headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify(body),
+    });
+    const d = await r.json();
+    if (!r.ok) throw new Error(d.error || `HTTP ${r.status}`);
+    return d;
+}
+
+async function sha256Hex(buffer) {
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadFileChunked(file, onBytes) {
+    const init = await uploadJSON('/upload/init', {
+        filename: file.name, size: file.size, session_dir: state.sessionDir || '',
+    });
+    const url = `${API_BASE}/upload/chunk?upload_id=${encodeURIComponent(init.upload_id)}`;
+    let offset = init.offset;
+    let failures = 0;
+    onBytes(offset);
+
+    while (offset < file.size) {
+        if (state.uploadAbortFlag) throw new Error('Upload aborted');
+        const chunk   = file.slice(offset, Math.min(offset + UPLOAD_CHUNK_BYTES, file.size));
+        const headers = {'Content-Type': 'application/octet-stream'};
+        if (window.crypto?.subtle) headers['X-Chunk-SHA256'] = await sha256Hex(await chunk.arrayBuffer());
+        let r, d;
+        try {
+            r = await fetch(`${url}&offset=${offset}`, { method: 'PUT', headers, body: chunk });
+            d = await r.json();
+        } catch (e) {
+            if (++failures > UPLOAD_RETRIES) throw e;
+            continue;
+        }
+        // 409 (offset mismatch) and 422 (bad checksum) both report the
+        // server's real offset — resume from there
+        if (!r.ok && r.status !== 409 && r.status !== 422) throw new Error(d.error || `HTTP ${r.status}`);
+        if (!r.ok && ++failures > UPLOAD_RETRIES) throw new Error(d.error);
+        if (r.ok) failures = 0;
+        onBytes(d.offset - offset);
+        offset = d.offset;
+    }
+    return uploadJSON('/upload/finalize', { upload_id: init.upload_id });
+}
+
 async function startUpload(files) {
     if (state.fileEditDirty) await saveFileEdits();
     if (state.sessionDir) resetFileHistory();
@@ -1339,32 +1626,40 @@ async function startUpload(files) {
     let bytesDone = 0;
 
     updateUploadProgress(0, files.length, 0, totalBytes);
-
-    for (let i = 0; i < files.length; i++) {
-        if (state.uploadAbortFlag) {
-            log(`Upload aborted after ${i} of ${files.length} file(s).`, 'warn');
-            break;
-        }
-
+    el.batchProgressText.textContent = files.length > 1
+        ? `Uploading ${files.length} files…`
+        : `Uploading ${files[0].name}`;
+
+    const uploaded = new Array(files.length).fill(null);
+    let done = 0;
+    const onBytes = n => {
+        bytesDone += n;
+        updateUploadProgress(done, files.length, bytesDone, totalBytes);
+    };
+    const uploadOne = async i => {
         const file = files[i];
-        el.batchProgressText.textContent = `Uploading ${i + 1}/${files.length}: ${file.name}`;
-
-        const form = new FormData();
-        form.append('file', file);
-        if (state.sessionDir) form.append('session_dir', state.sessionDir);
-
         try {
-            const data = await (await fetch(`${API_BASE}/upload`, { method: 'POST', body: form })).json();
-            if (data.error) { log(`Upload failed (${file.name}): ${data.error}`, 'error'); continue; }
+            const data = await uploadFileChunked(file, onBytes);
             if (!state.sessionDir) state.sessionDir = data.session_dir;
-            state.batchFiles.push({ name: data.filename, size: file.size });
-            bytesDone += file.size;
-            updateUploadProgress(i + 1, files.length, bytesDone, totalBytes);
-            if (!state.isBatchSession) state.outputFilename = data.filename;
+            uploaded[i] = { name: data.filename, size: file.size };
         } catch (e) {
-            log(`Upload failed (${file.name}): ${e.message}`, 'error');
+            if (!state.uploadAbortFlag) log(`Upload failed (${file.name}): ${e.message}`, 'error');
         }
-    }
+        done++;
+        updateUploadProgress(done, files.length, bytesDone, totalBytes);
+    };
+
+    // Upload one file to create the session, then fill it in parallel
+    let next = 0;
+    while (!state.sessionDir && next < files.length && !state.uploadAbortFlag) await uploadOne(next++);
+    const worker = async () => {
+        while (next < files.length && !state.uploadAbortFlag) await uploadOne(next++);
+    };
+    await Promise.all(Array.from({ length: UPLOAD_PARALLEL }, worker));
+
+    if (state.uploadAbortFlag) log(`Upload aborted after ${done} of ${files.length} file(s).`, 'warn');
+    state.batchFiles = uploaded.filter(Boolean);
+    if (!state.isBatchSession && state.batchFiles.length) state.outputFilename = state.batchFiles[0].name;
 
     hideBatchStrip();
     updateOutputState();
@@ -1405,14 +1700,89 @@ function cancelBatchWarn() {
 
 // ── Run ────────────────────────────────────────────────────────────────────
 
-async function executeSingleFile(filename, sessionDir, activeSteps) {
+async function executeSingleFile(filename, sessionDir, activeSteps, runId) {
     const r = await fetch(`${API_BASE}/execute`, {
         method: 'POST', headers: {'Content-Type':'application/json'},
-        body: JSON.stringify({ filename, session_dir: sessionDir, scripts: activeSteps }),
+        body: JSON.stringify({ filename, session_dir: sessionDir, scripts: activeSteps, run_id: runId,
+                              preset: state.currentPresetName || '' }),
     });
     return r.json();
 }
 
+// One call for the whole batch, so batch-capable steps see every file at once.
+async function executeBatch(filenames, sessionDir, activeSteps, runId) {
+    const r = await fetch(`${API_BASE}/execute_batch`, {
+        method: 'POST', headers: {'Content-Type':'application/json'},
+        body: JSON.stringify({ filenames, session_dir: sessionDir, scripts: activeSteps, run_id: runId,
+                              preset: state.currentPresetName || '' }),
+    });
+    return r.json();
+}
+
+function isBatchStep(step) {
+    const fn = state.functionCache.find(p => p.key === step.pluginKey)
+            || state.pluginCache.find(p => p.key === step.pluginKey);
+    return !!fn?.batch;
+}
+
+// Log one file's result in a batch run; returns false if the file failed.
+function logBatchFileResult(name, result, timing) {
+    if (result.cancelled) {
+        log(`  [${name}] ${result.error} — file left unchanged`, 'warn');
+        return false;
+    }
+    if (result.error) {
+        log(`  [${name}] Error: ${result.error}`, 'error');
+        if (result.trace) result.trace.split('\n').filter(l => l.trim()).forEach(l => log(`    ${l}`, 'error'));
+        return false;
+    }
+    (result.steps||[]).forEach(s => { if (s.warning) log(`  [${name}] ${s.step}: ${s.warning}`, 'warn'); });
+    log(`  [${name}] Done`, 'success');
+    (result.outputs||[]).forEach(o => log(`  [${name}] ${o.branch} → ${o.filename}`, 'system'));
+    timing.duration_ms += result.duration_ms || 0;
+    timing.bytes       += result.bytes || 0;
+    return true;
+}
+
+// Follow a run's step events so the Run button shows which step is executing.
+// prefix is the batch counter ("3/12 · ") or empty for single-file runs.
+// While the run is open the Stop button is shown; see stopRun().
+function followRunProgress(runId) {
+    const src = new EventSource(`${API_BASE}/events?types=step&run=${encodeURIComponent(runId)}`);
+    const progress = {
+        runId, prefix: '', cancelled: false,
+        close: () => { src.close(); el.stopRun.hidden = true; state.activeRun = null; },
+    };
+    state.activeRun     = progress;
+    el.stopRun.hidden   = false;
+    el.stopRun.disabled = false;
+    src.onmessage = e => {
+        try {
+            const frame = JSON.parse(e.data);
+            const last  = frame.events.filter(ev => ev.status === 'running').pop();
+            if (last && el.playAll.disabled) {
+                el.playAll.innerHTML = `<svg width="13" height="13" fill="currentColor" viewBox="0 0 24 24"><path d="M8 5v14l11-7z"/></svg> ${progress.prefix}${last.index + 1}/${last.total}`;
+            }
+        } catch (_) {}
+    };
+    return progress;
+}
+
+// Ask the server to stop the current run; a batch also stops before its next file.
+async function stopRun() {
+    const progress = state.activeRun;
+    if (!progress || progress.cancelled) return;
+    progress.cancelled  = true;
+    el.stopRun.disabled = true;
+    try {
+        await fetch(`${API_BASE}/cancel`, {
+            method: 'POST', headers: {'Content-Type':'application/json'},
+            body: JSON.stringify({ run_id: progress.runId }),
+        });
+    } catch (_) {}
+    log('Stopping run…', 'warn');
+}
+
 async function runSequence() {
     if (state.fileEditDirty) await saveFileEdits();
     if (!state.sessionDir) { log('No file loaded. Select a file or folder first.', 'error'); return; }
@@ -1432,31 +1802,49 @@ async function runSequence() {
 
     el.playAll.disabled = true;
     state.batchRunDone  = false;
+    const runId    = `run-${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 8)}`;
+    const progress = followRunProgress(runId);
 
     if (state.isBatchSession) {
         const files  = state.batchFiles;
         let failures = 0;
+        const timing = { duration_ms: 0, bytes: 0 };
         log(`Batch run: ${activeSteps.length} step(s) × ${files.length} file(s)…`);
 
-        for (let i = 0; i < files.length; i++) {
-            const f = files[i];
-            el.playAll.innerHTML = `<svg width="13" height="13" fill="currentColor" viewBox="0 0 24 24"><path d="M8 5v14l11-7z"/></svg> ${i + 1}/${files.length}`;
+        if (activeSteps.some(isBatchStep)) {
+            // Batch steps need all files in one request; progress shows the step counter only.
+            progress.prefix = `${files.length} files · `;
             try {
-                const result = await executeSingleFile(f.name, state.sessionDir, activeSteps);
-                if (result.error) {
-                    log(`  [${f.name}] Error: ${result.error}`, 'error');
-                    if (result.trace) result.trace.split('\n').filter(l => l.trim()).forEach(l => log(`    ${l}`, 'error'));
-                    failures++;
+                const result = await executeBatch(files.map(f => f.name), state.sessionDir, activeSteps, runId);
+                if (result.results) {
+                    result.results.forEach(r => { if (!logBatchFileResult(r.filename, r, timing)) failures++; });
+                    timing.duration_ms = result.duration_ms || 0;
+                    timing.bytes       = result.bytes || 0;
                 } else {
-                    (result.steps||[]).forEach(s => { if (s.warning) log(`  [${f.name}] ${s.step}: ${s.warning}`, 'warn'); });
-                    log(`  [${f.name}] Done`, 'success');
+                    logBatchFileResult('batch', result, timing);
+                    failures = files.length;
                 }
             } catch (e) {
-                log(`  [${f.name}] Failed: ${e.message}`, 'error');
-                failures++;
+                log(`  Batch failed: ${e.message}`, 'error');
+                failures = files.length;
+            }
+        } else {
+            for (let i = 0; i < files.length; i++) {
+                if (progress.cancelled) { log(`Batch stopped — ${files.length - i} file(s) not run.`, 'warn'); failures++; break; }
+                const f = files[i];
+                progress.prefix = `${i + 1}/${files.length} · `;
+                el.playAll.innerHTML = `<svg width="13" height="13" fill="currentColor" viewBox="0 0 24 24"><path d="M8 5v14l11-7z"/></svg> ${i + 1}/${files.length}`;
+                try {
+                    const result = await executeSingleFile(f.name, state.sessionDir, activeSteps, runId);
+                    if (!logBatchFileResult(f.name, result, timing)) failures++;
+                } catch (e) {
+                    log(`  [${f.name}] Failed: ${e.message}`, 'error');
+                    failures++;
+                }
             }
         }
 
+        progress.close();
         el.playAll.disabled = false;
         el.playAll.innerHTML = `<svg width="13" height="13" fill="currentColor" viewBox="0 0 24 24"><path d="M8 5v14l11-7z"/></svg> Run`;
 
@@ -1464,33 +1852,39 @@ async function runSequence() {
             log(`Batch complete — ${files.length} file(s) processed.`, 'success');
             log('Use "Save Output" to download a zip of all results.', 'system');
             state.batchRunDone = true;
-            if (state.currentPresetName) recordPresetEvent(state.currentPresetName, 'success');
+            if (state.currentPresetName) recordPresetEvent(state.currentPresetName, 'success', timing);
         } else {
             log(`Batch done with ${failures} failure(s).`, 'warn');
         }
         updateOutputState();
     } else {
         const filename = state.batchFiles[0]?.name || state.selectedFile?.name;
-        if (!filename) { log('No file available.', 'error'); el.playAll.disabled = false; return; }
+        if (!filename) { log('No file available.', 'error'); el.playAll.disabled = false; progress.close(); return; }
         log(`Running ${activeSteps.length} step(s) on ${filename}…`);
         try {
-            const result = await executeSingleFile(filename, state.sessionDir, activeSteps);
-            if (result.error) {
+            const result = await executeSingleFile(filename, state.sessionDir, activeSteps, runId);
+            if (result.cancelled) {
+                log(`${result.error} — file left unchanged`, 'warn');
+            } else if (result.error) {
                 log(`Error: ${result.error}`, 'error');
                 if (result.trace) result.trace.split('\n').filter(l => l.trim()).forEach(l => log(`  ${l}`, 'error'));
                 if (result.completed?.length) log(`Completed before failure: ${result.completed.join(', ')}`, 'warn');
             } else {
                 (result.steps||[]).forEach(s => { if (s.warning) log(`  ${s.step}: ${s.warning}`, 'warn'); });
-                log(`Done — ${result.message}  [${result.mime_type}]`, 'success');
+                log(`Done — ${result.message}${result.mime_type ? `  [${result.mime_type}]` : ''}`, 'success');
+                (result.outputs||[]).forEach(o => log(`  ${o.branch} → ${o.filename}  [${o.mime_type}]`, 'system'));
                 log('Use "Save Output" to download the result.', 'system');
                 state.outputFilename = filename;
                 updateOutputState();
                 refreshFileUndoRedoButtons();
                 refreshFilePreview();
-                if (state.currentPresetName) recordPresetEvent(state.currentPresetName, 'success');
+                if (state.currentPresetName) recordPresetEvent(state.currentPresetName, 'success',
+                    { duration_ms: result.duration_ms, bytes: result.bytes });
             }
         } catch (e) { log('Execution failed: ' + e.message, 'error'); }
+        progress.close();
         el.playAll.disabled = false;
+        el.playAll.innerHTML = `<svg width="13" height="13" fill="currentColor" viewBox="0 0 24 24"><path d="M8 5v14l11-7z"/></svg> Run`;
     }
 }
 
@@ -1539,6 +1933,9 @@ document.addEventListener('DOMContentLoaded', async () => {
         filePreview:          document.getElementById('filePreview'),
         filePreviewEmpty:     document.getElementById('filePreviewEmpty'),
         filePreviewTruncation:document.getElementById('filePreviewTruncation'),
+        fileVirtual:          document.getElementById('fileVirtual'),
+        fileVirtualSpacer:    document.getElementById('fileVirtualSpacer'),
+        fileVirtualWindow:    document.getElementById('fileVirtualWindow'),
         applyFileEditBtn:     document.getElementById('applyFileEditBtn'),
         fileEditStatus:       document.getElementById('fileEditStatus'),
         // pane headers — workflow history
@@ -1570,6 +1967,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         presetLibraryOverlay: document.getElementById('presetLibraryOverlay'),
         presetLibraryBody:    document.getElementById('presetLibraryBody'),
         presetSortSelect:     document.getElementById('presetSortSelect'),
+        presetSearchInput:    document.getElementById('presetSearchInput'),
         // add step picker
         addStepBtn:           document.getElementById('add-global-step'),
         addStepLabel:         document.getElementById('addStepLabel'),
@@ -1581,6 +1979,7 @@ document.addEventListener('DOMContentLoaded', async () => {
         openPluginsFolderBtn: document.getElementById('openPluginsFolderBtn'),
         // run / console
         playAll:              document.getElementById('playAll'),
+        stopRun:              document.getElementById('stopRun'),
         consoleClear:         document.getElementById('consoleClear'),
         consoleCopy:          document.getElementById('consoleCopy'),
         consoleDebugToggle:   document.getElementById('consoleDebugToggle'),
@@ -1676,7 +2075,11 @@ document.addEventListener('DOMContentLoaded', async () => {
     // Preset library
     document.getElementById('presetLibraryClose').addEventListener('click', closePresetLibrary);
     el.presetLibraryOverlay.addEventListener('click', e => { if (e.target === el.presetLibraryOverlay) closePresetLibrary(); });
-    el.presetSortSelect.addEventListener('change', renderPresetLibrary);
+    el.presetSortSelect.addEventListener('change', fetchPresetLibrary);
+    el.presetSearchInput.addEventListener('input', () => {
+        clearTimeout(presetSearchTimer);
+        presetSearchTimer = setTimeout(fetchPresetLibrary, 150);
+    });
 
     // Add Step picker
     el.undoBtn.addEventListener('click', performUndo);
@@ -1690,6 +2093,8 @@ document.addEventListener('DOMContentLoaded', async () => {
         clearTimeout(fileEditTimer);
         fileEditTimer = setTimeout(saveFileEdits, 700);
     });
+    el.fileVirtual.addEventListener('scroll', scheduleVirtualRender);
+    window.addEventListener('resize', scheduleVirtualRender);
     el.filePreview.addEventListener('keydown', e => {
         if (e.key === 'Tab') {
             e.preventDefault();
@@ -1706,6 +2111,7 @@ document.addEventListener('DOMContentLoaded', async () => {
 
     // Run
     el.playAll.addEventListener('click', runSequence);
+    el.stopRun.addEventListener('click', stopRun);
 
     // Global close
     document.addEventListener('click', e => {